@@ -0,0 +1 @@
+"""Modules shared by several homeworks. Scripts put the repository root on sys.path to import them."""
@@ -0,0 +1,252 @@
+"""
+
+Some simple logging functionality, inspired by rllab's logging, shared by the homeworks through
+their logz.py shims. Assumes that each diagnostic gets logged each iteration
+
+Call logz.configure_output_dir() to start logging to a
+tab-separated-values file (some_folder_name/log.txt)
+
+To load the learning curves, you can do, for example
+
+A = np.genfromtxt('/tmp/expt_1468984536/log.txt',delimiter='\t',dtype=None, names=True)
+A['EpRewMean']
+
+The rows are also stored column-wise in chunks of .npz files (some_folder_name/metrics/),
+which load_metrics() concatenates, e.g. load_metrics('/tmp/expt_1468984536')['EpRewMean'].
+Files are written by a background thread, so dump_tabular() does not wait for the disk.
+New keys may appear in later iterations; earlier rows then hold NaN (or "") for them.
+
+"""
+
+import os.path as osp, time, atexit, os
+import glob
+import json
+import multiprocessing.util
+import pickle
+import threading
+from queue import Queue
+import numpy as np
+
+color2num = dict(
+    gray=30,
+    red=31,
+    green=32,
+    yellow=33,
+    blue=34,
+    magenta=35,
+    cyan=36,
+    white=37,
+    crimson=38
+)
+
+def colorize(string, color, bold=False, highlight=False):
+    attr = []
+    num = color2num[color]
+    if highlight: num += 10
+    attr.append(str(num))
+    if bold: attr.append('1')
+    return '\x1b[%sm%s\x1b[0m' % (';'.join(attr), string)
+
+class G:
+    output_dir = None
+    output_file = None
+    writer = None
+    first_row = True
+    log_headers = []
+    log_current_row = {}
+
+class MetricsWriter(object):
+    """
+    Writes the rows passed to write() on a background thread
+
+    Every row is appended to log.txt. When a new key appears, the lines already in the file are padded
+    to the union of the columns, so only the rows not yet saved to a chunk are kept in memory. Every
+    chunk_rows rows, these rows are saved column-wise to metrics/chunk_<pid>_<n>.npz.
+
+    Several processes can write to the same output dir: chunks are named after the writing process and
+    written to a temporary file that is then renamed, and the TSV file is log.txt for the process that
+    creates it first and log_<pid>.txt for the others.
+    """
+    def __init__(self, output_dir, chunk_rows=100):
+        self.output_dir = output_dir
+        self.metrics_dir = osp.join(output_dir, "metrics")
+        os.makedirs(self.metrics_dir, exist_ok=True)
+        try:
+            self.output_file = open(osp.join(output_dir, "log.txt"), 'x+')
+        except FileExistsError:
+            self.output_file = open(osp.join(output_dir, "log_%i.txt"%os.getpid()), 'x+')
+        self.chunk_rows = chunk_rows
+        self.headers = []
+        # rows since the last chunk
+        self.rows = []
+        self.num_chunks = 0
+        self.queue = Queue()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def write(self, row):
+        self.queue.put(row)
+
+    def close(self):
+        """
+        Wait for all rows to be written, then write the last chunk
+        """
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+    def _run(self):
+        while True:
+            row = self.queue.get()
+            if row is None:
+                break
+            self._write_row(row)
+        self._write_chunk()
+        self.output_file.close()
+
+    def _write_row(self, row):
+        new_headers = [key for key in row if key not in self.headers]
+        if new_headers:
+            # new columns go last, so the lines written so far only need empty trailing fields
+            self.output_file.seek(0)
+            lines = self.output_file.read().splitlines()[1:]
+            self.headers.extend(new_headers)
+            self.output_file.seek(0)
+            self.output_file.truncate()
+            self.output_file.write("\t".join(self.headers))
+            self.output_file.write("\n")
+            for line in lines:
+                self.output_file.write(line + "\t"*len(new_headers))
+                self.output_file.write("\n")
+        self.output_file.write("\t".join(str(row.get(key, "")) for key in self.headers))
+        self.output_file.write("\n")
+        self.output_file.flush()
+        self.rows.append(row)
+        if len(self.rows) >= self.chunk_rows:
+            self._write_chunk()
+
+    def _write_chunk(self):
+        if not self.rows:
+            return
+        columns = {}
+        for key in self.headers:
+            vals = [r.get(key) for r in self.rows]
+            if all(v is None or hasattr(v, "__float__") for v in vals):
+                columns[key] = np.array([np.nan if v is None else float(v) for v in vals])
+            else:
+                columns[key] = np.array(["" if v is None else str(v) for v in vals])
+        path = osp.join(self.metrics_dir, "chunk_%i_%05d.npz"%(os.getpid(), self.num_chunks))
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **columns)
+        os.replace(tmp_path, path)
+        self.rows = []
+        self.num_chunks += 1
+
+def create_writer(d, chunk_rows=100, exist_ok=False):
+    """
+    Create the output directory d and a MetricsWriter for it, closed at exit
+
+    Unless exist_ok, d must not exist yet; with exist_ok, processes can share d (see MetricsWriter)
+    """
+    assert exist_ok or not osp.exists(d), "Log dir %s already exists! Delete it first or use a different dir"%d
+    os.makedirs(d, exist_ok=exist_ok)
+    writer = MetricsWriter(d, chunk_rows=chunk_rows)
+    atexit.register(writer.close)
+    # processes started by multiprocessing exit without atexit handlers, but run its finalizers
+    multiprocessing.util.Finalize(writer, writer.close, exitpriority=0)
+    print(colorize("Logging data to %s"%writer.output_file.name, 'green', bold=True))
+    return writer
+
+def configure_output_dir(d=None, chunk_rows=100, exist_ok=False):
+    """
+    Set output directory to d, or to /tmp/somerandomnumber if d is None
+    """
+    G.output_dir = d or "/tmp/experiments/%i"%int(time.time())
+    G.writer = create_writer(G.output_dir, chunk_rows=chunk_rows, exist_ok=exist_ok)
+    G.output_file = G.writer.output_file
+
+def log_tabular(key, val):
+    """
+    Log a value of some diagnostic
+    Call this once for each diagnostic quantity, each iteration
+    """
+    if key not in G.log_headers:
+        G.log_headers.append(key)
+    assert key not in G.log_current_row, "You already set %s this iteration. Maybe you forgot to call dump_tabular()"%key
+    G.log_current_row[key] = val
+
+def save_params(params, output_dir=None, indent=None):
+    """
+    Write params to params.json in output_dir (default: the configured output dir), one entry per
+    line, or indented by indent spaces if given
+    """
+    if indent is None:
+        params_json = json.dumps(params, separators=(',\n','\t:\t'), sort_keys=True)
+    else:
+        params_json = json.dumps(params, indent=indent, separators=(',', ': '), sort_keys=True)
+    with open(osp.join(output_dir or G.output_dir, "params.json"), 'w') as out:
+        out.write(params_json)
+
+def pickle_tf_vars():
+    """
+    Saves tensorflow variables
+    Requires them to be initialized first, also a default session must exist
+    """
+    import tensorflow as tf
+    _dict = {v.name : v.eval() for v in tf.global_variables()}
+    with open(osp.join(G.output_dir, "vars.pkl"), 'wb') as f:
+        pickle.dump(_dict, f)
+
+
+def dump_tabular(writer=None):
+    """
+    Write all of the diagnostics from the current iteration, to writer if given (see create_writer)
+    """
+    vals = []
+    key_lens = [len(key) for key in G.log_headers]
+    max_key_len = max(15,max(key_lens))
+    keystr = '%'+'%d'%max_key_len
+    fmt = "| " + keystr + "s | %15s |"
+    n_slashes = 22 + max_key_len
+    print("-"*n_slashes)
+    for key in G.log_headers:
+        val = G.log_current_row.get(key, "")
+        if hasattr(val, "__float__"): valstr = "%8.3g"%val
+        else: valstr = val
+        print(fmt%(key, valstr))
+        vals.append(val)
+    print("-"*n_slashes)
+    writer = writer or G.writer
+    if writer is not None:
+        writer.write(dict(G.log_current_row))
+    G.log_current_row.clear()
+    G.first_row=False
+
+def load_metrics(d, pid=None):
+    """
+    Load the columnar metrics of output directory d as a dict of arrays, one entry per row
+
+    If several processes wrote to d, their rows follow each other, unless pid selects one of them
+    """
+    pattern = "chunk_*.npz" if pid is None else "chunk_%i_*.npz"%pid
+    chunks = []
+    for path in sorted(glob.glob(osp.join(d, "metrics", pattern))):
+        with np.load(path) as chunk:
+            chunks.append({key: chunk[key] for key in chunk.files})
+    keys = []
+    for chunk in chunks:
+        keys.extend(key for key in chunk if key not in keys)
+    metrics = {}
+    for key in keys:
+        numeric = all(chunk[key].dtype.kind == 'f' for chunk in chunks if key in chunk)
+        parts = []
+        for chunk in chunks:
+            num_rows = len(next(iter(chunk.values())))
+            if key in chunk:
+                parts.append(chunk[key])
+            else:
+                parts.append(np.full(num_rows, np.nan) if numeric else np.full(num_rows, ""))
+        metrics[key] = np.concatenate(parts)
+    return metrics
@@ -0,0 +1,159 @@
+"""
+Parallel on-policy trajectory sampler for the actor-critic trainers
+(hw3/train_ac_f18.py and hw5/exp/train_ac_exploration_f18.py).
+
+Environments are stepped in subprocess workers while the policy is evaluated
+once per step for all workers in the parent process, so one sess.run call
+serves every environment. Each worker's current episode is written into
+preallocated NumPy buffers and copied out as a path dict in the same format
+as Agent.sample_trajectory.
+"""
+import multiprocessing
+import pickle
+from multiprocessing import Pipe, Process
+
+import numpy as np
+
+
+def _worker(remote, parent_remote, env_fn, seed):
+    parent_remote.close()
+    env = env_fn()
+    env.seed(seed)
+    try:
+        while True:
+            cmd, data = remote.recv()
+            if cmd == 'step':
+                ob, rew, done, _ = env.step(data)
+                remote.send((ob, rew, done))
+            elif cmd == 'reset':
+                remote.send(env.reset())
+            elif cmd == 'render':
+                env.render()
+                remote.send(None)
+            elif cmd == 'close':
+                break
+            else:
+                raise NotImplementedError(cmd)
+    finally:
+        remote.close()
+
+
+class ParallelSampler(object):
+    def __init__(self, env_fn, num_envs, ob_dim, ac_dim, discrete, max_path_length, seed):
+        """
+            Starts num_envs subprocess workers, each owning one environment.
+
+            Create the sampler before the tensorflow session, since the workers are
+            forked from the current process.
+
+            arguments:
+                env_fn: function without arguments that returns a new environment.
+                    Unless workers are forked, it is pickled into the workers, so it
+                    has to be a top-level function or e.g. a functools.partial of one.
+                num_envs: number of environments stepped in parallel
+                ob_dim: dimension of the observation space
+                ac_dim: number of actions if discrete, else dimension of the action space
+                discrete: whether the action space is discrete
+                max_path_length: episodes are cut after max_path_length + 1 steps,
+                    as in Agent.sample_trajectory
+                seed: worker i seeds its environment with seed + i
+        """
+        if multiprocessing.get_start_method() != 'fork':
+            try:
+                pickle.dumps(env_fn)
+            except (pickle.PicklingError, AttributeError, TypeError) as e:
+                raise ValueError("env_fn has to be picklable with the '%s' start method: %s"
+                                 % (multiprocessing.get_start_method(), e))
+        self.num_envs = num_envs
+        self.max_path_length = int(max_path_length)
+        self.remotes, self.work_remotes = zip(*[Pipe() for _ in range(num_envs)])
+        self.processes = []
+        for i, (remote, work_remote) in enumerate(zip(self.remotes, self.work_remotes)):
+            p = Process(target=_worker, args=(work_remote, remote, env_fn, seed + i))
+            p.daemon = True  # workers die with the parent
+            p.start()
+            work_remote.close()
+            self.processes.append(p)
+
+        buffer_len = self.max_path_length + 1
+        ac_shape = (buffer_len,) if discrete else (buffer_len, ac_dim)
+        self.buffers = [{"observation": np.zeros((buffer_len, ob_dim), dtype=np.float32),
+                         "reward": np.zeros(buffer_len, dtype=np.float32),
+                         "action": np.zeros(ac_shape, dtype=np.float32),
+                         "next_observation": np.zeros((buffer_len, ob_dim), dtype=np.float32),
+                         "terminal": np.zeros(buffer_len, dtype=np.float32)}
+                        for _ in range(num_envs)]
+        self.obs = np.zeros((num_envs, ob_dim), dtype=np.float32)
+        self.steps = np.zeros(num_envs, dtype=np.int64)
+        self.closed = False
+
+    def _reset(self, i):
+        self.remotes[i].send(('reset', None))
+        self.obs[i] = self.remotes[i].recv()
+        self.steps[i] = 0
+
+    def sample(self, policy_fn, min_timesteps, render=False):
+        """
+            Collects complete paths until more than min_timesteps steps were taken.
+
+            Once the budget is reached no new episodes are started, but the episodes
+            in flight are run to completion, so short episodes are not favoured.
+
+            arguments:
+                policy_fn: maps a batch of observations (n, ob_dim) to actions
+                render: render the first episode of the first worker
+
+            returns:
+                paths: list of dicts with "observation", "reward", "action",
+                    "next_observation" and "terminal" arrays
+                timesteps_this_batch: total number of steps in paths
+        """
+        for i in range(self.num_envs):
+            self.remotes[i].send(('reset', None))
+        for i in range(self.num_envs):
+            self.obs[i] = self.remotes[i].recv()
+        self.steps[:] = 0
+        active = np.ones(self.num_envs, dtype=bool)
+
+        paths = []
+        timesteps_this_batch = 0
+        while active.any():
+            workers = np.flatnonzero(active)
+            acs = policy_fn(self.obs[workers])
+            if render and active[0]:
+                self.remotes[0].send(('render', None))
+                self.remotes[0].recv()
+            for i, ac in zip(workers, acs):
+                self.remotes[i].send(('step', ac))
+            for i, ac in zip(workers, acs):
+                ob, rew, done = self.remotes[i].recv()
+                t = self.steps[i]
+                buf = self.buffers[i]
+                buf["observation"][t] = self.obs[i]
+                buf["action"][t] = ac
+                buf["reward"][t] = rew
+                buf["next_observation"][t] = ob
+                self.obs[i] = ob
+                self.steps[i] = t = t + 1
+                if done or t > self.max_path_length:
+                    buf["terminal"][t - 1] = 1
+                    paths.append({k: v[:t].copy() for k, v in buf.items()})
+                    timesteps_this_batch += t
+                    if i == 0:
+                        render = False
+                    if timesteps_this_batch > min_timesteps:
+                        active[i] = False
+                    else:
+                        self._reset(i)
+                else:
+                    buf["terminal"][t - 1] = 0
+        return paths, timesteps_this_batch
+
+    def close(self):
+        if self.closed:
+            return
+        for remote in self.remotes:
+            remote.send(('close', None))
+        for p in self.processes:
+            p.join()
+        self.closed = True
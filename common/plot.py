@@ -0,0 +1,227 @@
+import seaborn as sns
+import pandas as pd
+import matplotlib.pyplot as plt
+import numpy as np
+import json
+import os
+import pickle
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+"""
+Plotting of learning curves, shared by the homeworks through their plot.py shims, which only
+set the default value and time columns of their logs.
+
+Using the plotter:
+
+Call it from the command line, and supply it with logdirs to experiments.
+Suppose you ran an experiment with name 'test', and you ran 'test' for 10
+random seeds. The runner code stored it in the directory structure
+
+    data
+    L test_EnvName_DateTime
+      L  0
+        L log.txt
+        L params.json
+      L  1
+        L log.txt
+        L params.json
+       .
+       .
+       .
+      L  9
+        L log.txt
+        L params.json
+
+To plot learning curves from the experiment, averaged over all random
+seeds, call
+
+    python plot.py data/test_EnvName_DateTime --value AverageReturn
+
+and voila. To see a different statistics, change what you put in for
+the keyword --value. You can also enter /multiple/ values, and it will
+make all of them in order.
+
+
+Suppose you ran two experiments: 'test1' and 'test2'. In 'test2' you tried
+a different set of hyperparameters from 'test1', and now you would like
+to compare them -- see their learning curves side-by-side. Just call
+
+    python plot.py data/test1 data/test2
+
+and it will plot them both! They will be given titles in the legend according
+to their exp_name parameters. If you want to use custom legend titles, use
+the --legend flag and then provide a title for each logdir.
+
+Parsed logs are cached in a .plot_cache.pkl file in every logdir and only
+re-parsed when they change. Use --save to render to a file without a display,
+e.g.
+
+    python plot.py data/test1 data/test2 --save comparison.png
+
+"""
+
+CACHE_NAME = '.plot_cache.pkl'
+
+
+def load_run(root):
+    """
+    Parse the params and the log of the run in directory root
+    """
+    with open(os.path.join(root, 'params.json')) as f:
+        exp_name = json.load(f)['exp_name']
+    return exp_name, pd.read_table(os.path.join(root, 'log.txt'))
+
+
+def run_stamp(root):
+    return tuple(os.path.getmtime(os.path.join(root, name)) for name in ('log.txt', 'params.json'))
+
+
+def load_runs(fpath, use_cache=True, num_workers=8):
+    """
+    Load every run below fpath as an (exp_name, DataFrame) pair, ordered by path
+
+    Parsed runs are cached in fpath/.plot_cache.pkl, keyed by their path relative to fpath and
+    the modification times of their files, so only new or changed runs are parsed again. Those
+    are parsed in parallel.
+    """
+    roots = sorted(os.path.relpath(root, fpath) for root, dir, files in os.walk(fpath) if 'log.txt' in files)
+    cache_path = os.path.join(fpath, CACHE_NAME)
+    cache = {}
+    if use_cache and os.path.exists(cache_path):
+        try:
+            with open(cache_path, 'rb') as f:
+                cache = pickle.load(f)
+        except Exception:
+            cache = {}
+
+    stamps = {root: run_stamp(os.path.join(fpath, root)) for root in roots}
+    stale = [root for root in roots if root not in cache or cache[root][0] != stamps[root]]
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        for root, run in zip(stale, executor.map(load_run, [os.path.join(fpath, root) for root in stale])):
+            cache[root] = (stamps[root], run)
+
+    if use_cache and (stale or len(cache) != len(roots)):
+        cache = {root: cache[root] for root in roots}
+        with open(cache_path + '.tmp', 'wb') as f:
+            pickle.dump(cache, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(cache_path + '.tmp', cache_path)
+    return [cache[root][1] for root in roots]
+
+
+def aggregate(data, value="AverageReturn", time="Iteration"):
+    """
+    Aggregate value over the units (runs) of every condition
+
+    returns: an ordered dict from condition to a dict with the sorted times and, at every time,
+        the mean, std, standard error of the mean and number of units of value
+    """
+    if isinstance(data, list):
+        data = pd.concat(data, ignore_index=True)
+
+    results = OrderedDict()
+    for condition, condition_data in data.groupby('Condition', sort=False):
+        times, time_idx = np.unique(condition_data[time].values, return_inverse=True)
+        units, unit_idx = np.unique(condition_data['Unit'].values, return_inverse=True)
+        values = np.full((len(units), len(times)), np.nan)
+        values[unit_idx, time_idx] = condition_data[value].values
+        count = np.sum(~np.isnan(values), axis=0)
+        std = np.nanstd(values, axis=0)
+        results[condition] = dict(time=times,
+                                  mean=np.nanmean(values, axis=0),
+                                  std=std,
+                                  sem=std / np.sqrt(count),
+                                  count=count)
+    return results
+
+
+def plot_data(data, value="AverageReturn", time="Iteration", band="sem", save_path=None):
+    """
+    Plot the mean of value over the units of every condition, with a shaded band of one std,
+    one standard error (sem) or a 95% confidence interval (ci95) of the mean. The plot is shown,
+    or saved to save_path if given.
+    """
+    sns.set(style="darkgrid", font_scale=1.5)
+    plt.figure()
+    for condition, agg in aggregate(data, value=value, time=time).items():
+        width = dict(std=agg['std'], sem=agg['sem'], ci95=1.96 * agg['sem'])[band]
+        line, = plt.plot(agg['time'], agg['mean'], label=condition)
+        plt.fill_between(agg['time'], agg['mean'] - width, agg['mean'] + width, color=line.get_color(), alpha=0.2)
+    plt.xlabel(time)
+    plt.ylabel(value)
+    if save_path is None:
+        plt.legend(loc='best').draggable()
+        plt.show()
+    else:
+        plt.legend(loc='best')
+        plt.savefig(save_path, bbox_inches='tight')
+        plt.close()
+
+
+def get_datasets(fpath, condition=None, use_cache=True, num_workers=8):
+    datasets = []
+    for unit, (exp_name, experiment_data) in enumerate(load_runs(fpath, use_cache, num_workers)):
+        experiment_data = experiment_data.copy()
+        experiment_data.insert(
+            len(experiment_data.columns),
+            'Unit',
+            unit
+            )
+        experiment_data.insert(
+            len(experiment_data.columns),
+            'Condition',
+            condition or exp_name
+            )
+
+        datasets.append(experiment_data)
+
+    return datasets
+
+
+def main(value='AverageReturn', time='Iteration'):
+    """
+    The command line of the plot.py of every homework, which passes the default value and time
+    columns of its logs
+    """
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('logdir', nargs='*')
+    parser.add_argument('--legend', nargs='*')
+    parser.add_argument('--value', default=value, nargs='*')
+    parser.add_argument('--band', default='sem', choices=('std', 'sem', 'ci95'))
+    parser.add_argument('--save', default=None)
+    parser.add_argument('--no_cache', action='store_true')
+    parser.add_argument('--num_workers', type=int, default=8)
+    args = parser.parse_args()
+
+    if args.save is not None:
+        # render headless
+        plt.switch_backend('Agg')
+
+    use_legend = False
+    if args.legend is not None:
+        assert len(args.legend) == len(args.logdir), \
+            "Must give a legend title for each set of experiments."
+        use_legend = True
+
+    data = []
+    if use_legend:
+        for logdir, legend_title in zip(args.logdir, args.legend):
+            data += get_datasets(logdir, legend_title, not args.no_cache, args.num_workers)
+    else:
+        for logdir in args.logdir:
+            data += get_datasets(logdir, use_cache=not args.no_cache, num_workers=args.num_workers)
+
+    if isinstance(args.value, list):
+        values = args.value
+    else:
+        values = [args.value]
+    for value in values:
+        save_path = args.save
+        if save_path is not None and len(values) > 1:
+            base, ext = os.path.splitext(save_path)
+            save_path = '{0}_{1}{2}'.format(base, value, ext or '.png')
+        plot_data(data, value=value, time=time, band=args.band, save_path=save_path)
+
+if __name__ == "__main__":
+    main()
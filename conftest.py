@@ -0,0 +1,28 @@
+"""
+Lets pytest collect the tests of all homeworks in one run
+
+Every homework is a directory of flat modules importing each other by name, and several names
+(utils, logz, ...) exist in more than one homework. Before the tests of a directory are
+collected, the modules imported from other directories of this repository are forgotten, so that
+the test files import the modules next to them.
+"""
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_collectstart(collector):
+    if not isinstance(collector, pytest.Module):
+        return
+    test_dir = os.path.dirname(str(collector.path))
+    for name, module in list(sys.modules.items()):
+        path = getattr(module, '__file__', None)
+        if path is None:
+            continue
+        module_dir = os.path.dirname(os.path.abspath(path))
+        if module_dir.startswith(ROOT + os.sep) and module_dir != test_dir:
+            del sys.modules[name]
@@ -4,6 +4,7 @@ import itertools
 import pickle
 import random
 import sys
+import threading
 import time
 import inspect
 import uuid
@@ -17,27 +18,12 @@ import tensorflow as tf
 import tensorflow.contrib.layers as layers
 
 from dqn_utils import *
+from q_heads import LinearHead
 
 OptimizerSpec = namedtuple(
     "OptimizerSpec", ["constructor", "kwargs", "lr_schedule"])
 
 
-def get_action_q(q, a):
-    """
-        q has shape [batch_size, num_actions]
-        a has shape [batch_size, 1]
-        output is q values for action a from q
-    """
-    # index all batch, so create indexing range to cover batch_size
-    batch_indx = tf.range(tf.shape(q)[0])
-
-    # stitch each batch index with its corresponding index from the action tensor
-    indx = tf.stack([batch_indx, a], axis=1)
-
-    # index the tensor!
-    return tf.gather_nd(q, indx)
-
-
 def is_jsonable(x):
     try:
         json.dumps(x)
@@ -67,6 +53,9 @@ class QLearner(object):
             grad_norm_clipping=10,
             rew_file=None,
             double_q=True,
+            q_head=None,
+            prefetch_batches=0,
+            instrument=False,
             lander=False,
             logdir='data'):
         """Run Deep Q-learning algorithm.
@@ -93,6 +82,8 @@ class QLearner(object):
                     should be created
                 reuse: bool
                     whether previously created variables should be reused.
+                head: q_heads.QHead
+                    head to build on top of the model features.
         optimizer_spec: OptimizerSpec
             Specifying the constructor and kwargs, as well as learning rate schedule
             for the optimizer
@@ -123,6 +114,19 @@ class QLearner(object):
         double_q: bool
             If True, then use double Q-learning to compute target values. Otherwise, use vanilla DQN.
             https://papers.nips.cc/paper/3964-double-q-learning.pdf
+        q_head: q_heads.QHead or None
+            Output head of the Q network (linear, dueling or categorical), which
+            also defines the TD loss. Defaults to q_heads.LinearHead().
+        prefetch_batches: int
+            If positive, training batches are sampled from the replay buffer by a
+            background tf.data pipeline this many batches ahead, overlapping
+            sampling with env steps and updates, instead of being fed through
+            feed_dict. Observations stay uint8 until they are cast in the graph.
+        instrument: bool
+            If True, time the env step, frame encoding, action selection, replay
+            sampling and train step phases, and log env steps/s, updates/s and
+            p50/p99 latencies of every phase. Off by default, the run_dqn_*
+            scripts turn it on with --instrument.
         logdir: str
             Name of the log directory.
         """
@@ -139,6 +143,7 @@ class QLearner(object):
         self.env = env
         self.session = session
         self.exploration = exploration
+        self.q_head = LinearHead() if q_head is None else q_head
         self.rew_file = str(uuid.uuid4()) + \
             '.pkl' if rew_file is None else rew_file
 
@@ -159,23 +164,48 @@ class QLearner(object):
             input_shape = (img_h, img_w, frame_history_len * img_c)
         self.num_actions = self.env.action_space.n
 
-        # set up placeholders
-        # placeholder for current observation (or state)
-        self.obs_t_ph = tf.placeholder(
-            tf.float32 if lander else tf.uint8, [None] + list(input_shape))
-        # placeholder for current action
-        self.act_t_ph = tf.placeholder(tf.int32,   [None])
-        # placeholder for current reward
-        self.rew_t_ph = tf.placeholder(tf.float32, [None])
-        # placeholder for next observation (or state)
-        self.obs_tp1_ph = tf.placeholder(
-            tf.float32 if lander else tf.uint8, [None] + list(input_shape))
-        # placeholder for end of episode mask
-        # this value is 1 if the next state corresponds to the end of an episode,
-        # in which case there is no Q-value at the next state; at the end of an
-        # episode, only the current state reward contributes to the target, not the
-        # next state Q-value (i.e. target is just rew_t_ph, not rew_t_ph + gamma * q_tp1)
-        self.done_mask_ph = tf.placeholder(tf.float32, [None])
+        # construct the replay buffer
+        self.replay_buffer = ReplayBuffer(
+            replay_buffer_size, frame_history_len, lander=lander)
+        self.replay_buffer_idx = None
+        # guards the replay buffer when batches are sampled on a background thread
+        self.replay_lock = threading.Lock()
+        self.timer = PhaseTimer(
+            ['EnvStep', 'FrameEncode', 'ActionSelection', 'ReplaySample', 'TrainStep'],
+            enabled=instrument)
+        self.prefetch_batches = prefetch_batches
+
+        obs_dtype = tf.float32 if lander else tf.uint8
+        if prefetch_batches > 0:
+            # the placeholders default to the next prefetched batch, and can still be
+            # fed explicitly (e.g. for action selection or variable initialization)
+            dataset = replay_dataset(self.sample_batch, input_shape, obs_dtype,
+                                     prefetch=prefetch_batches)
+            obs_t_batch, act_batch, rew_batch, obs_tp1_batch, done_mask = \
+                dataset.make_one_shot_iterator().get_next()
+            self.obs_t_ph = tf.placeholder_with_default(
+                obs_t_batch, [None] + list(input_shape))
+            self.act_t_ph = tf.placeholder_with_default(act_batch, [None])
+            self.rew_t_ph = tf.placeholder_with_default(rew_batch, [None])
+            self.obs_tp1_ph = tf.placeholder_with_default(
+                obs_tp1_batch, [None] + list(input_shape))
+            self.done_mask_ph = tf.placeholder_with_default(done_mask, [None])
+        else:
+            # set up placeholders
+            # placeholder for current observation (or state)
+            self.obs_t_ph = tf.placeholder(obs_dtype, [None] + list(input_shape))
+            # placeholder for current action
+            self.act_t_ph = tf.placeholder(tf.int32,   [None])
+            # placeholder for current reward
+            self.rew_t_ph = tf.placeholder(tf.float32, [None])
+            # placeholder for next observation (or state)
+            self.obs_tp1_ph = tf.placeholder(obs_dtype, [None] + list(input_shape))
+            # placeholder for end of episode mask
+            # this value is 1 if the next state corresponds to the end of an episode,
+            # in which case there is no Q-value at the next state; at the end of an
+            # episode, only the current state reward contributes to the target, not the
+            # next state Q-value (i.e. target is just rew_t_ph, not rew_t_ph + gamma * q_tp1)
+            self.done_mask_ph = tf.placeholder(tf.float32, [None])
 
         # casting to float on GPU ensures lower data transfer times.
         if lander:
@@ -208,48 +238,34 @@ class QLearner(object):
         scope_q_func = 'q_func'
         scope_target_q_func = 'target_q_func'
 
-        # get q values for all actions in the current state s_t via current q function
-        qs_t = q_func(obs_t_float, self.num_actions,
-                      scope=scope_q_func, reuse=False)
+        # get head outputs for all actions in the current state s_t via current q function
+        out_t = q_func(obs_t_float, self.num_actions,
+                       scope=scope_q_func, reuse=False, head=self.q_head)
+        qs_t = self.q_head.q_values(out_t)
         assert qs_t.shape.as_list() == [None, self.num_actions]
 
         self.q_argmax = tf.argmax(qs_t, axis=1, output_type=tf.int32)
 
-        # get q values for executed actions only
-        q_t = get_action_q(qs_t, self.act_t_ph)
-        assert q_t.shape.as_list() == [None]
-
-        # get q values for all actions in the next state s_tp1 via target q function
-        qs_tp1_target = q_func(
-            obs_tp1_float, self.num_actions, scope=scope_target_q_func, reuse=False)
-        assert qs_tp1_target.shape.as_list() == [None, self.num_actions]
+        # get head outputs for all actions in the next state s_tp1 via target q function
+        out_tp1_target = q_func(
+            obs_tp1_float, self.num_actions, scope=scope_target_q_func, reuse=False, head=self.q_head)
 
         if double_q:
             # get q values for all actions in the next state s_t+1 via current q function
-            qs_tp1 = q_func(obs_tp1_float, self.num_actions,
-                            scope=scope_q_func, reuse=True)
-            assert qs_tp1.shape.as_list() == [None, self.num_actions]
-
-            # get actions with max q values only
-            act_argmax_tp1 = tf.argmax(qs_tp1, axis=1, output_type=tf.int32)
-            assert act_argmax_tp1.shape.as_list() == [None]
-
-            # get q value for actions according to target network
-            q_tp1 = get_action_q(qs_tp1_target, act_argmax_tp1)
-            assert q_tp1.shape.as_list() == [None]
-
-            q_target = self.rew_t_ph + \
-                (gamma * q_tp1 * (1 - self.done_mask_ph))
-
+            qs_tp1 = self.q_head.q_values(q_func(obs_tp1_float, self.num_actions,
+                                                 scope=scope_q_func, reuse=True, head=self.q_head))
         else:
-            q_target = self.rew_t_ph + \
-                (gamma * tf.reduce_max(qs_tp1_target, axis=1)
-                 * (1 - self.done_mask_ph))
-        assert q_target.shape.as_list() == [None]
+            qs_tp1 = self.q_head.q_values(out_tp1_target)
+        assert qs_tp1.shape.as_list() == [None, self.num_actions]
+
+        # get actions with max q values only; the head evaluates them with the target network
+        act_argmax_tp1 = tf.argmax(qs_tp1, axis=1, output_type=tf.int32)
+        assert act_argmax_tp1.shape.as_list() == [None]
 
         # define loss for calculating bellman error
-        self.total_error = tf.losses.huber_loss(
-            q_target, q_t, reduction=tf.losses.Reduction.SUM)
+        self.total_error = self.q_head.td_loss(
+            out_t, self.act_t_ph, self.rew_t_ph, self.done_mask_ph,
+            out_tp1_target, act_argmax_tp1, gamma)
         q_func_vars = tf.get_collection(
             tf.GraphKeys.GLOBAL_VARIABLES, scope=scope_q_func)
         target_q_func_vars = tf.get_collection(
@@ -272,11 +288,6 @@ class QLearner(object):
             update_target_fn.append(var_target.assign(var))
         self.update_target_fn = tf.group(*update_target_fn)
 
-        # construct the replay buffer
-        self.replay_buffer = ReplayBuffer(
-            replay_buffer_size, frame_history_len, lander=lander)
-        self.replay_buffer_idx = None
-
         ###############
         # RUN ENV     #
         ###############
@@ -287,7 +298,7 @@ class QLearner(object):
         self.last_obs = self.env.reset()
         self.log_every_n_steps = 10000
 
-        self.start_time = None
+        self.start_time = time.time()
         self.t = 0
 
     def setup_logger(self, dir, locals_):
@@ -307,6 +318,14 @@ class QLearner(object):
             locals_[k]) else None for k in args}
         logz.save_params(params)
 
+    def sample_batch(self):
+        """Sample a training batch from the replay buffer, safe to call from any thread."""
+        tic = self.timer.tic()
+        with self.replay_lock:
+            batch = self.replay_buffer.sample(self.batch_size)
+        self.timer.toc('ReplaySample', tic)
+        return batch
+
     def stopping_criterion_met(self):
         return self.stopping_criterion is not None and self.stopping_criterion(self.env, self.t)
 
@@ -345,23 +364,31 @@ class QLearner(object):
 
         # YOUR CODE HERE
         # store current observation in the replay buffer and fetch its index
-        idx = self.replay_buffer.store_frame(self.last_obs)
+        tic = self.timer.tic()
+        with self.replay_lock:
+            idx = self.replay_buffer.store_frame(self.last_obs)
 
-        # transform current observation so it can be passed to the model
-        obs = self.replay_buffer.encode_recent_observation()
+            # transform current observation so it can be passed to the model
+            obs = self.replay_buffer.encode_recent_observation()
+        self.timer.toc('FrameEncode', tic)
 
         # sample from policy the next action to do (use e-greedy for exploration)
+        tic = self.timer.tic()
         if not self.model_initialized or random.random() < self.exploration.value(self.t):
             action = self.env.action_space.sample()
         else:
             action = self.session.run(self.q_argmax, feed_dict={
-                                      self.obs_t_ph: self.replay_buffer.encode_recent_observation()[None]})[0]
+                                      self.obs_t_ph: obs[None]})[0]
+        self.timer.toc('ActionSelection', tic)
 
         # step the simulator using the new action and fetch the new last observation
+        tic = self.timer.tic()
         self.last_obs, reward, done, _ = self.env.step(action)
+        self.timer.toc('EnvStep', tic)
 
         # update the replay buffer with the current observation info
-        self.replay_buffer.store_effect(idx, action, reward, done)
+        with self.replay_lock:
+            self.replay_buffer.store_effect(idx, action, reward, done)
 
         # check if episode is done, if so invoke obs = env.reset()
         if done:
@@ -411,9 +438,20 @@ class QLearner(object):
             #####
 
             # YOUR CODE HERE
-            # sample mini-batch from replay buffer
-            obs_t_batch, act_batch, rew_batch, obs_tp1_batch, done_mask = self.replay_buffer.sample(
-                self.batch_size)
+            feed_dict = {
+                self.learning_rate: self.optimizer_spec.lr_schedule.value(self.t)
+            }
+            if self.prefetch_batches == 0 or not self.model_initialized:
+                # sample mini-batch from replay buffer; with prefetching enabled the
+                # input pipeline provides batches once the model is initialized
+                obs_t_batch, act_batch, rew_batch, obs_tp1_batch, done_mask = self.sample_batch()
+                feed_dict.update({
+                    self.obs_t_ph: obs_t_batch,
+                    self.act_t_ph: act_batch,
+                    self.rew_t_ph: rew_batch,
+                    self.obs_tp1_ph: obs_tp1_batch,
+                    self.done_mask_ph: done_mask,
+                })
 
             # initialize the model if its not initialized
             if not self.model_initialized:
@@ -423,16 +461,10 @@ class QLearner(object):
                 self.model_initialized = True
 
             # conduct one training step to update current q network
-            feed_dict = {
-                self.obs_t_ph: obs_t_batch,
-                self.act_t_ph: act_batch,
-                self.rew_t_ph: rew_batch,
-                self.obs_tp1_ph: obs_tp1_batch,
-                self.done_mask_ph: done_mask,
-                self.learning_rate: self.optimizer_spec.lr_schedule.value(self.t)
-            }
+            tic = self.timer.tic()
             _, bellman_err = self.session.run(
                 [self.train_fn, self.total_error], feed_dict=feed_dict)
+            self.timer.toc('TrainStep', tic)
 
             # print("The Bellman error at {} is {}".format(self.t, bellman_err))
 
@@ -462,11 +494,7 @@ class QLearner(object):
             print("exploration %f" % self.exploration.value(self.t))
             print("learning_rate %f" %
                   self.optimizer_spec.lr_schedule.value(self.t))
-            if self.start_time is not None:
-                print("running time %f" %
-                      ((time.time() - self.start_time) / 60.))
-
-            self.start_time = time.time()
+            print("running time %f" % ((time.time() - self.start_time) / 60.))
 
             sys.stdout.flush()
 
@@ -481,6 +509,12 @@ class QLearner(object):
             logz.log_tabular("Exploration", self.exploration.value(self.t))
             logz.log_tabular(
                 "LearningRate", self.optimizer_spec.lr_schedule.value(self.t))
+            if self.timer.enabled:
+                rates = self.timer.rates()
+                logz.log_tabular("EnvStepsPerSec", rates['EnvStep'])
+                logz.log_tabular("UpdatesPerSec", rates['TrainStep'])
+                for key, val in self.timer.summary():
+                    logz.log_tabular(key, val)
             logz.dump_tabular()
 
 
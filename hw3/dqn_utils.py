@@ -4,6 +4,7 @@ import gym
 import tensorflow as tf
 import numpy as np
 import random
+import time
 
 def huber_loss(x, delta=1.0):
     # https://en.wikipedia.org/wiki/Huber_loss
@@ -13,6 +14,21 @@ def huber_loss(x, delta=1.0):
         delta * (tf.abs(x) - 0.5 * delta)
     )
 
+def get_action_q(q, a):
+    """
+        q has shape [batch_size, num_actions] (or [batch_size, num_actions, num_atoms])
+        a has shape [batch_size]
+        output is q values (or atom logits) for action a from q
+    """
+    # index all batch, so create indexing range to cover batch_size
+    batch_indx = tf.range(tf.shape(q)[0])
+
+    # stitch each batch index with its corresponding index from the action tensor
+    indx = tf.stack([batch_indx, a], axis=1)
+
+    # index the tensor!
+    return tf.gather_nd(q, indx)
+
 def sample_n_unique(sampling_f, n):
     """Helper function. Given a function `sampling_f` that returns
     comparable objects, sample n such unique objects.
@@ -171,6 +187,105 @@ def get_wrapper_by_name(env, classname):
         else:
             raise ValueError("Couldn't find wrapper named %s"%classname)
 
+def replay_dataset(sample_fn, obs_shape, obs_dtype, prefetch=1):
+    """Wrap a replay sampling function into a prefetching tf.data pipeline.
+
+    Batches are sampled by a background thread of the tf.data runtime while
+    the current update runs, and observations keep `obs_dtype` (np.uint8 for
+    Atari) until the graph casts them, so frames are never expanded to float
+    in Python.
+
+    Parameters
+    ----------
+    sample_fn: () -> tuple
+        Returns one batch in the format of ReplayBuffer.sample. It is called
+        concurrently with env steps, so it has to take care of locking the
+        buffer, and it must not be called before the buffer can sample.
+    obs_shape: [int]
+        Shape of a single encoded observation.
+    obs_dtype: tf.DType
+        tf.uint8 for frames, tf.float32 for low-dimensional states.
+    prefetch: int
+        Number of batches to sample ahead.
+
+    Returns
+    -------
+    dataset: tf.data.Dataset
+        Infinite dataset of (obs_batch, act_batch, rew_batch, next_obs_batch,
+        done_mask) tuples, see ReplayBuffer.sample.
+    """
+    def generator():
+        while True:
+            yield sample_fn()
+
+    obs_shape = tf.TensorShape([None] + list(obs_shape))
+    dataset = tf.data.Dataset.from_generator(
+        generator,
+        output_types=(obs_dtype, tf.int32, tf.float32, obs_dtype, tf.float32),
+        output_shapes=(obs_shape, tf.TensorShape([None]), tf.TensorShape([None]),
+                       obs_shape, tf.TensorShape([None])))
+    return dataset.prefetch(prefetch)
+
+class PhaseTimer(object):
+    def __init__(self, phases, enabled=True, window=10000):
+        """Wall-clock latencies of the phases of a training loop.
+
+        Usage: `tic = timer.tic(); ...; timer.toc('EnvStep', tic)`. When
+        disabled, `tic` returns None and `toc` returns immediately, so the
+        calls can stay in the hot path.
+
+        Parameters
+        ----------
+        phases: [str]
+            Names of the timed phases, used as logging column prefixes.
+        enabled: bool
+            Whether to record anything.
+        window: int
+            Number of most recent latencies per phase kept for percentiles.
+        """
+        self.enabled = enabled
+        self.phases = list(phases)
+        self.window = window
+        self.latencies = {name: np.zeros(window) for name in self.phases}
+        self.counts = dict.fromkeys(self.phases, 0)
+        self._last_counts = dict(self.counts)
+        self._last_time = time.time()
+
+    def tic(self):
+        return time.perf_counter() if self.enabled else None
+
+    def toc(self, name, tic):
+        if tic is None:
+            return
+        count = self.counts[name]
+        self.latencies[name][count % self.window] = time.perf_counter() - tic
+        self.counts[name] = count + 1
+
+    def percentile(self, name, q):
+        """q-th percentile in seconds over the most recent `window` calls."""
+        n = min(self.counts[name], self.window)
+        if n == 0:
+            return float('nan')
+        return np.percentile(self.latencies[name][:n], q)
+
+    def rates(self):
+        """Calls per second of every phase since the previous call to `rates`."""
+        now = time.time()
+        elapsed = max(now - self._last_time, 1e-8)
+        rates = {name: (self.counts[name] - self._last_counts[name]) / elapsed
+                 for name in self.phases}
+        self._last_counts = dict(self.counts)
+        self._last_time = now
+        return rates
+
+    def summary(self):
+        """[(column, value)] with p50/p99 latencies in milliseconds for every phase."""
+        stats = []
+        for name in self.phases:
+            stats.append((name + 'P50Ms', 1e3 * self.percentile(name, 50)))
+            stats.append((name + 'P99Ms', 1e3 * self.percentile(name, 99)))
+        return stats
+
 class ReplayBuffer(object):
     def __init__(self, size, frame_history_len, lander=False):
         """This is a memory efficient implementation of the replay buffer.
@@ -0,0 +1,200 @@
+"""Pluggable output heads for the Q networks used by dqn.QLearner.
+
+A head sits on top of the features produced by a model torso (the convnet
+or MLP in run_dqn_*.py) and owns two things: the layers that map features
+to per-action outputs, and the TD loss defined on those outputs. This lets
+QLearner stay agnostic of whether the network predicts scalar Q-values
+(linear and dueling heads) or a categorical return distribution (C51).
+"""
+import tensorflow as tf
+import tensorflow.contrib.layers as layers
+
+from dqn_utils import get_action_q
+
+
+class QHead(object):
+    def __call__(self, features, num_actions):
+        """Build the head on top of `features`, inside the caller's variable scope.
+
+        Returns the raw head outputs, whose shape depends on the head.
+        """
+        raise NotImplementedError()
+
+    def q_values(self, outputs):
+        """Map head outputs to Q-values of shape [batch_size, num_actions]."""
+        raise NotImplementedError()
+
+    def td_loss(self, out_t, act_t, rew_t, done_mask, out_tp1, act_tp1, gamma):
+        """Scalar TD loss, summed over the batch.
+
+        Every head reduces with a sum, like the baseline huber loss, so that
+        switching heads keeps the gradient scale that the learning rate and
+        gradient clipping of the run scripts are tuned for.
+
+        Parameters
+        ----------
+        out_t: tf.Tensor
+            Head outputs of the online network at s_t.
+        act_t: tf.Tensor
+            Actions taken at s_t, shape [batch_size].
+        rew_t: tf.Tensor
+            Rewards, shape [batch_size].
+        done_mask: tf.Tensor
+            1 if s_tp1 is terminal, shape [batch_size].
+        out_tp1: tf.Tensor
+            Head outputs of the target network at s_tp1.
+        act_tp1: tf.Tensor
+            Actions used to bootstrap at s_tp1 (greedy w.r.t. the online
+            network for double Q-learning, the target network otherwise).
+        gamma: float
+            Discount factor.
+        """
+        raise NotImplementedError()
+
+
+class LinearHead(QHead):
+    """Single fully connected layer producing one Q-value per action."""
+
+    def __call__(self, features, num_actions):
+        return layers.fully_connected(features, num_outputs=num_actions, activation_fn=None)
+
+    def q_values(self, outputs):
+        return outputs
+
+    def td_loss(self, out_t, act_t, rew_t, done_mask, out_tp1, act_tp1, gamma):
+        q_t = get_action_q(out_t, act_t)
+        q_tp1 = get_action_q(out_tp1, act_tp1)
+        q_target = rew_t + gamma * q_tp1 * (1 - done_mask)
+        return tf.losses.huber_loss(
+            tf.stop_gradient(q_target), q_t, reduction=tf.losses.Reduction.SUM)
+
+
+class DuelingHead(LinearHead):
+    """Separate value and advantage streams, Q = V + A - mean(A).
+
+    https://arxiv.org/abs/1511.06581
+    """
+
+    def __init__(self, hidden_size=None):
+        """
+        hidden_size: int or None
+            If not None, each stream gets its own relu hidden layer of this size
+            before its output layer.
+        """
+        self.hidden_size = hidden_size
+
+    def _stream(self, features, num_outputs, scope):
+        with tf.variable_scope(scope):
+            out = features
+            if self.hidden_size is not None:
+                out = layers.fully_connected(out, num_outputs=self.hidden_size, activation_fn=tf.nn.relu)
+            return layers.fully_connected(out, num_outputs=num_outputs, activation_fn=None)
+
+    def __call__(self, features, num_actions):
+        value = self._stream(features, 1, "state_value")
+        advantage = self._stream(features, num_actions, "advantage")
+        return value + advantage - tf.reduce_mean(advantage, axis=1, keepdims=True)
+
+
+def categorical_projection(probs_tp1, rew_t, done_mask, gamma, support):
+    """Project the distributional Bellman target onto a fixed support.
+
+    Every atom z_j of the next-state distribution is shifted to
+    Tz_j = r + gamma * (1 - done) * z_j, clipped to [v_min, v_max] and its
+    probability is split between the two neighbouring atoms in proportion
+    to their distance. The split is written as a triangular kernel
+    max(0, 1 - |b_j - i|), which also handles Tz_j landing exactly on an atom.
+
+    Parameters
+    ----------
+    probs_tp1: tf.Tensor
+        Next-state probabilities, shape [batch_size, num_atoms].
+    rew_t: tf.Tensor
+        Rewards, shape [batch_size].
+    done_mask: tf.Tensor
+        Terminal indicators, shape [batch_size].
+    gamma: float
+        Discount factor.
+    support: np.array
+        Evenly spaced atoms z_0 < ... < z_{num_atoms - 1}.
+
+    Returns
+    -------
+    target: tf.Tensor
+        Projected target probabilities, shape [batch_size, num_atoms].
+    """
+    num_atoms = len(support)
+    v_min, v_max = float(support[0]), float(support[-1])
+    delta_z = (v_max - v_min) / (num_atoms - 1)
+
+    z = tf.constant(support, dtype=tf.float32)
+    tz = rew_t[:, None] + gamma * (1 - done_mask[:, None]) * z[None, :]
+    tz = tf.clip_by_value(tz, v_min, v_max)
+    # fractional atom index of every shifted atom, shape [batch_size, num_atoms]
+    b = (tz - v_min) / delta_z
+
+    atom_idx = tf.range(num_atoms, dtype=tf.float32)
+    # weight[n, i, j]: share of shifted atom j that lands on atom i
+    weight = tf.maximum(0., 1. - tf.abs(b[:, None, :] - atom_idx[None, :, None]))
+    return tf.reduce_sum(weight * probs_tp1[:, None, :], axis=2)
+
+
+class CategoricalHead(QHead):
+    """C51 distributional head: a softmax over `num_atoms` returns per action.
+
+    https://arxiv.org/abs/1707.06887
+    """
+
+    def __init__(self, num_atoms=51, v_min=-10., v_max=10.):
+        assert num_atoms > 1 and v_min < v_max
+        self.num_atoms = num_atoms
+        self.v_min = v_min
+        self.v_max = v_max
+        step = (v_max - v_min) / (num_atoms - 1)
+        self.support = [v_min + i * step for i in range(num_atoms)]
+
+    def __call__(self, features, num_actions):
+        logits = layers.fully_connected(
+            features, num_outputs=num_actions * self.num_atoms, activation_fn=None)
+        # outputs are logits of shape [batch_size, num_actions, num_atoms]
+        return tf.reshape(logits, [-1, num_actions, self.num_atoms])
+
+    def q_values(self, outputs):
+        z = tf.constant(self.support, dtype=tf.float32)
+        return tf.reduce_sum(tf.nn.softmax(outputs) * z, axis=2)
+
+    def td_loss(self, out_t, act_t, rew_t, done_mask, out_tp1, act_tp1, gamma):
+        logits_t = get_action_q(out_t, act_t)
+        probs_tp1 = tf.nn.softmax(get_action_q(out_tp1, act_tp1))
+        target = categorical_projection(probs_tp1, rew_t, done_mask, gamma, self.support)
+        cross_entropy = tf.nn.softmax_cross_entropy_with_logits_v2(
+            labels=tf.stop_gradient(target), logits=logits_t)
+        return tf.reduce_sum(cross_entropy)
+
+
+HEADS = {
+    'linear': LinearHead,
+    'dueling': DuelingHead,
+    'c51': CategoricalHead,
+}
+
+
+def make_head(name, **kwargs):
+    """Instantiate a head by name, e.g. make_head('c51', num_atoms=51)."""
+    if name not in HEADS:
+        raise ValueError("Unknown Q head %s, expected one of %s" % (name, sorted(HEADS)))
+    return HEADS[name](**kwargs)
+
+
+def add_head_args(parser):
+    """Add the command line flags shared by the run_dqn_* scripts."""
+    parser.add_argument('--q_head', type=str, default='linear', choices=sorted(HEADS))
+    parser.add_argument('--num_atoms', type=int, default=51)
+    parser.add_argument('--v_min', type=float, default=-10.)
+    parser.add_argument('--v_max', type=float, default=10.)
+
+
+def head_from_args(args):
+    if args.q_head == 'c51':
+        return make_head('c51', num_atoms=args.num_atoms, v_min=args.v_min, v_max=args.v_max)
+    return make_head(args.q_head)
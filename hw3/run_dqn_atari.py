@@ -11,9 +11,10 @@ from gym import wrappers
 import dqn
 from atari_wrappers import *
 from dqn_utils import *
+from q_heads import LinearHead, add_head_args, head_from_args
 
 
-def atari_model(img_in, num_actions, scope, reuse=False):
+def atari_model(img_in, num_actions, scope, reuse=False, head=None):
     # as described in https://storage.googleapis.com/deepmind-data/assets/papers/DeepMindNature14236Paper.pdf
     with tf.variable_scope(scope, reuse=reuse):
         out = img_in
@@ -28,14 +29,17 @@ def atari_model(img_in, num_actions, scope, reuse=False):
         out = layers.flatten(out)
         with tf.variable_scope("action_value"):
             out = layers.fully_connected(out, num_outputs=512,         activation_fn=tf.nn.relu)
-            out = layers.fully_connected(out, num_outputs=num_actions, activation_fn=None)
+            out = (head or LinearHead())(out, num_actions)
 
         return out
 
 
 def atari_learn(env,
                 session,
-                num_timesteps):
+                num_timesteps,
+                q_head=None,
+                prefetch_batches=0,
+                instrument=False):
     # This is just a rough estimate
     num_iterations = float(num_timesteps) / 4.0
 
@@ -81,6 +85,9 @@ def atari_learn(env,
         target_update_freq=10000,
         grad_norm_clipping=10,
         double_q=True,
+        q_head=q_head,
+        prefetch_batches=prefetch_batches,
+        instrument=instrument,
         exp_name='DoubleQLearning'
     )
     env.close()
@@ -127,6 +134,12 @@ def get_env(task, seed):
 
 
 def main():
+    parser = argparse.ArgumentParser()
+    add_head_args(parser)
+    parser.add_argument('--prefetch_batches', type=int, default=1)
+    parser.add_argument('--instrument', action='store_true')
+    args = parser.parse_args()
+
     # Get Atari games.
     task = gym.make('PongNoFrameskip-v4')
 
@@ -135,7 +148,8 @@ def main():
     print('random seed = %d' % seed)
     env = get_env(task, seed)
     session = get_session()
-    atari_learn(env, session, num_timesteps=2e8)
+    atari_learn(env, session, num_timesteps=2e8, q_head=head_from_args(args),
+                prefetch_batches=args.prefetch_batches, instrument=args.instrument)
 
 
 if __name__ == "__main__":
@@ -9,14 +9,15 @@ import tensorflow.contrib.layers as layers
 
 import dqn
 from dqn_utils import *
+from q_heads import LinearHead, add_head_args, head_from_args
 
-def lander_model(obs, num_actions, scope, reuse=False):
+def lander_model(obs, num_actions, scope, reuse=False, head=None):
     with tf.variable_scope(scope, reuse=reuse):
         out = obs
         with tf.variable_scope("action_value"):
             out = layers.fully_connected(out, num_outputs=64, activation_fn=tf.nn.relu)
             out = layers.fully_connected(out, num_outputs=64, activation_fn=tf.nn.relu)
-            out = layers.fully_connected(out, num_outputs=num_actions, activation_fn=None)
+            out = (head or LinearHead())(out, num_actions)
 
         return out
 
@@ -46,6 +47,7 @@ def lander_kwargs(args):
     return {
         'optimizer_spec': lander_optimizer(),
         'q_func': lander_model,
+        'q_head': head_from_args(args),
         'replay_buffer_size': 50000,
         'batch_size': 32,
         'gamma': 1.00,
@@ -55,6 +57,7 @@ def lander_kwargs(args):
         'target_update_freq': 3000,
         'grad_norm_clipping': 10,
         'lander': True,
+        'instrument': args.instrument,
         'exp_name': args.exp_name
     }
 
@@ -104,6 +107,8 @@ def main():
     # Setup arguments
     parser = argparse.ArgumentParser()
     parser.add_argument('--exp_name', type=str, default='DoubleQLearning')
+    add_head_args(parser)
+    parser.add_argument('--instrument', action='store_true')
     args = parser.parse_args()
     # Run training
     seed = 4565 # you may want to randomize this
@@ -11,10 +11,11 @@ import tensorflow.contrib.layers as layers
 
 import dqn
 from dqn_utils import *
+from q_heads import LinearHead, add_head_args, head_from_args
 from atari_wrappers import *
 
 
-def atari_model(ram_in, num_actions, scope, reuse=False):
+def atari_model(ram_in, num_actions, scope, reuse=False, head=None):
     with tf.variable_scope(scope, reuse=reuse):
         out = ram_in
         #out = tf.concat(1,(ram_in[:,4:5],ram_in[:,8:9],ram_in[:,11:13],ram_in[:,21:22],ram_in[:,50:51], ram_in[:,60:61],ram_in[:,64:65]))
@@ -22,13 +23,15 @@ def atari_model(ram_in, num_actions, scope, reuse=False):
             out = layers.fully_connected(out, num_outputs=256, activation_fn=tf.nn.relu)
             out = layers.fully_connected(out, num_outputs=128, activation_fn=tf.nn.relu)
             out = layers.fully_connected(out, num_outputs=64, activation_fn=tf.nn.relu)
-            out = layers.fully_connected(out, num_outputs=num_actions, activation_fn=None)
+            out = (head or LinearHead())(out, num_actions)
 
         return out
 
 def atari_learn(env,
                 session,
-                num_timesteps):
+                num_timesteps,
+                q_head=None,
+                instrument=False):
     # This is just a rough estimate
     num_iterations = float(num_timesteps) / 4.0
 
@@ -72,7 +75,9 @@ def atari_learn(env,
         learning_freq=4,
         frame_history_len=1,
         target_update_freq=10000,
-        grad_norm_clipping=10
+        grad_norm_clipping=10,
+        q_head=q_head,
+        instrument=instrument
     )
     env.close()
 
@@ -113,11 +118,17 @@ def get_env(seed):
     return env
 
 def main():
+    parser = argparse.ArgumentParser()
+    add_head_args(parser)
+    parser.add_argument('--instrument', action='store_true')
+    args = parser.parse_args()
+
     # Run training
     seed = 0 # Use a seed of zero (you may want to randomize the seed!)
     env = get_env(seed)
     session = get_session()
-    atari_learn(env, session, num_timesteps=int(4e7))
+    atari_learn(env, session, num_timesteps=int(4e7), q_head=head_from_args(args),
+                instrument=args.instrument)
 
 if __name__ == "__main__":
     main()
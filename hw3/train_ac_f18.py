@@ -3,8 +3,10 @@ Original code from John Schulman for CS294 Deep Reinforcement Learning Spring 20
 Adapted for CS294-112 Fall 2017 by Abhishek Gupta and Joshua Achiam
 Adapted for CS294-112 Fall 2018 by Soroush Nasiriany, Sid Reddy, and Greg Kahn
 """
+import functools
 import inspect
 import os
+import sys
 import time
 from multiprocessing import Process
 
@@ -14,12 +16,17 @@ import tensorflow as tf
 
 import logz
 
+# modules shared between homeworks live in common/ at the repository root
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir))
+from common.parallel_sampler import ParallelSampler
+
 #============================================================================================#
 # Utilities
 #============================================================================================#
 
 
-def build_mlp(input_placeholder, output_size, scope, n_layers, size, activation=tf.tanh, output_activation=None):
+def build_mlp(input_placeholder, output_size, scope, n_layers, size, activation=tf.tanh, output_activation=None,
+              reuse=False, use_resource=None):
     """
         Builds a feedforward neural network
 
@@ -31,6 +38,9 @@ def build_mlp(input_placeholder, output_size, scope, n_layers, size, activation=
             size: dimension of the hidden layer
             activation: activation of the hidden layers
             output_activation: activation of the ouput layers
+            reuse: whether to reuse the variables already created in scope
+            use_resource: whether to create resource variables, which can be read
+                and updated inside tf.while_loop
 
         returns:
             output placeholder of the network (the result of a forward pass)
@@ -38,7 +48,7 @@ def build_mlp(input_placeholder, output_size, scope, n_layers, size, activation=
         Hint: use tf.layers.dense
     """
     # YOUR HW2 CODE HERE
-    with tf.variable_scope(scope):
+    with tf.variable_scope(scope, reuse=reuse, use_resource=use_resource):
         layer = input_placeholder
         for i in range(n_layers):
             # CORRECTION: When network says number of layers this does not count the output layer of
@@ -50,6 +60,9 @@ def build_mlp(input_placeholder, output_size, scope, n_layers, size, activation=
                                name="output_layer")
 
 
+def make_env(env_name):
+    return gym.make(env_name)
+
 def pathlength(path):
     return len(path["reward"])
 
@@ -79,10 +92,12 @@ class Agent(object):
         self.num_target_updates = computation_graph_args['num_target_updates']
         self.num_grad_steps_per_target_update = computation_graph_args[
             'num_grad_steps_per_target_update']
+        self.critic_minibatch_size = computation_graph_args['critic_minibatch_size']
 
         self.animate = sample_trajectory_args['animate']
         self.max_path_length = sample_trajectory_args['max_path_length']
         self.min_timesteps_per_batch = sample_trajectory_args['min_timesteps_per_batch']
+        self.sampler = sample_trajectory_args['sampler']
 
         self.gamma = estimate_advantage_args['gamma']
         self.normalize_advantages = estimate_advantage_args['normalize_advantages']
@@ -94,6 +109,7 @@ class Agent(object):
         self.sess = tf.Session(config=tf_config)
         self.sess.__enter__()  # equivalent to `with self.sess:`
         tf.global_variables_initializer().run()  # pylint: disable=E1101
+        self.sess.run(self.critic_target_sync_op)
 
     def define_placeholders(self):
         """
@@ -195,7 +211,7 @@ class Agent(object):
         else:
             sy_mean, sy_logstd = policy_parameters
             # YOUR_HW2 CODE_HERE
-            sy_z = tf.random_normal(shape=sy_logstd.shape)
+            sy_z = tf.random_normal(shape=tf.shape(sy_mean))
             sy_std = tf.math.exp(sy_logstd)
             sy_sampled_ac = sy_mean + sy_std * sy_z
             assert sy_sampled_ac.shape.as_list() == sy_mean.shape.as_list()
@@ -288,15 +304,84 @@ class Agent(object):
             1,
             "nn_critic",
             n_layers=self.n_layers,
-            size=self.size))
-        self.sy_target_n = tf.placeholder(
-            shape=[None], name="critic_target", dtype=tf.float32)
-        self.critic_loss = tf.losses.mean_squared_error(
-            self.sy_target_n, self.critic_prediction)
-        self.critic_update_op = tf.train.AdamOptimizer(
-            self.learning_rate).minimize(self.critic_loss)
+            size=self.size,
+            use_resource=True))
+        self.critic_optimizer = tf.train.AdamOptimizer(self.learning_rate)
+
+        self.build_critic_update_loop()
+
+    def build_critic_update_loop(self):
+        """
+            Builds the in-graph critic training loop used by Agent.update_critic.
+
+            A frozen copy of the critic, "nn_critic_target", provides the bootstrapped
+            targets r(s, a) + gamma*V'(s'). Running self.critic_update_loop evaluates
+            the targets once, takes self.num_grad_steps_per_target_update gradient
+            steps inside a tf.while_loop, and then copies the critic into the target
+            network, so one target update costs a single session call.
+
+            If self.critic_minibatch_size is set, every gradient step uses a freshly
+            shuffled minibatch of that size instead of the full batch.
+        """
+        self.sy_next_ob_no = tf.placeholder(
+            shape=[None, self.ob_dim], name="next_ob", dtype=tf.float32)
+        self.sy_re_n = tf.placeholder(shape=[None], name="re", dtype=tf.float32)
+        self.sy_terminal_n = tf.placeholder(
+            shape=[None], name="terminal", dtype=tf.float32)
+
+        target_value_n = tf.squeeze(build_mlp(
+            self.sy_next_ob_no,
+            1,
+            "nn_critic_target",
+            n_layers=self.n_layers,
+            size=self.size,
+            use_resource=True), axis=1)
+        target_n = self.sy_re_n + self.gamma * \
+            target_value_n * (1 - self.sy_terminal_n)
+
+        critic_vars = tf.get_collection(
+            tf.GraphKeys.TRAINABLE_VARIABLES, scope="nn_critic/")
+        target_critic_vars = tf.get_collection(
+            tf.GraphKeys.TRAINABLE_VARIABLES, scope="nn_critic_target/")
+
+        def grad_step(i):
+            ob_no, step_target_n = self.sy_ob_no, target_n
+            if self.critic_minibatch_size:
+                indices = tf.random_shuffle(tf.range(tf.shape(ob_no)[0]))[
+                    :self.critic_minibatch_size]
+                ob_no = tf.gather(ob_no, indices)
+                step_target_n = tf.gather(step_target_n, indices)
+            prediction_n = tf.squeeze(build_mlp(
+                ob_no,
+                1,
+                "nn_critic",
+                n_layers=self.n_layers,
+                size=self.size,
+                reuse=True,
+                use_resource=True), axis=1)
+            loss = tf.losses.mean_squared_error(step_target_n, prediction_n)
+            update_op = self.critic_optimizer.minimize(loss, var_list=critic_vars)
+            with tf.control_dependencies([update_op]):
+                return i + 1
+
+        grad_steps = tf.while_loop(
+            lambda i: i < self.num_grad_steps_per_target_update,
+            grad_step, [tf.constant(0)])
+
+        def sync_target():
+            return tf.group(*[var_target.assign(var) for var, var_target in
+                              zip(sorted(critic_vars, key=lambda v: v.name),
+                                  sorted(target_critic_vars, key=lambda v: v.name))])
+
+        self.critic_target_sync_op = sync_target()
+        with tf.control_dependencies([grad_steps]):
+            self.critic_update_loop = sync_target()
 
     def sample_trajectories(self, itr, env):
+        if self.sampler is not None:
+            animate_this_batch = (itr % 10 == 0) and self.animate
+            return self.sampler.sample(self.policy_fn, self.min_timesteps_per_batch,
+                                       render=animate_this_batch)
         # Collect paths until we have enough timesteps
         timesteps_this_batch = 0
         paths = []
@@ -310,6 +395,10 @@ class Agent(object):
                 break
         return paths, timesteps_this_batch
 
+    def policy_fn(self, ob_no):
+        """ Samples actions for a batch of observations, used by the parallel sampler """
+        return self.sess.run(self.sy_sampled_ac, feed_dict={self.sy_ob_no: ob_no})
+
     def sample_trajectory(self, env, animate_this_episode):
         ob = env.reset()
         obs, acs, rewards, next_obs, terminals = [], [], [], [], []
@@ -417,17 +506,13 @@ class Agent(object):
         # otherwise the values will grow without bound.
         # YOUR CODE HERE
 
+        # the frozen target network always matches the critic at this point, so
+        # every call computes fresh targets, takes the gradient steps in-graph
+        # and then re-syncs the target network
+        feed_dict = {self.sy_ob_no: ob_no, self.sy_next_ob_no: next_ob_no,
+                     self.sy_re_n: re_n, self.sy_terminal_n: terminal_n}
         for _ in range(self.num_target_updates):
-            # compute target values
-            q_tp1 = self.sess.run(self.critic_prediction, feed_dict={
-                                  self.sy_ob_no: next_ob_no})
-            target_n = re_n + self.gamma * q_tp1 * (1 - terminal_n)
-
-            for _ in range(self.num_grad_steps_per_target_update):
-                # take gradinet step
-                _, loss = self.sess.run([self.critic_update_op, self.critic_loss], feed_dict={
-                              self.sy_ob_no: ob_no, self.sy_target_n: target_n})
-                # print("Critic loss: {}".format(loss))
+            self.sess.run(self.critic_update_loop, feed_dict=feed_dict)
 
     def update_actor(self, ob_no, ac_na, adv_n):
         """
@@ -458,7 +543,9 @@ def train_AC(
         learning_rate,
         num_target_updates,
         num_grad_steps_per_target_update,
+        critic_minibatch_size,
         animate,
+        num_envs,
         logdir,
         normalize_advantages,
         seed,
@@ -494,6 +581,12 @@ def train_AC(
     ob_dim = env.observation_space.shape[0]
     ac_dim = env.action_space.n if discrete else env.action_space.shape[0]
 
+    # Subprocess env workers are forked before any tensorflow session exists
+    sampler = None
+    if num_envs > 1:
+        sampler = ParallelSampler(functools.partial(make_env, env_name), num_envs, ob_dim, ac_dim,
+                                  discrete, max_path_length, seed)
+
     #========================================================================================#
     # Initialize Agent
     #========================================================================================#
@@ -506,12 +599,14 @@ def train_AC(
         'learning_rate': learning_rate,
         'num_target_updates': num_target_updates,
         'num_grad_steps_per_target_update': num_grad_steps_per_target_update,
+        'critic_minibatch_size': critic_minibatch_size,
     }
 
     sample_trajectory_args = {
         'animate': animate,
         'max_path_length': max_path_length,
         'min_timesteps_per_batch': min_timesteps_per_batch,
+        'sampler': sampler,
     }
 
     estimate_advantage_args = {
@@ -572,6 +667,9 @@ def train_AC(
         logz.dump_tabular()
         logz.pickle_tf_vars()
 
+    if sampler is not None:
+        sampler.close()
+
 
 def main():
     import argparse
@@ -579,6 +677,7 @@ def main():
     parser.add_argument('env_name', type=str)
     parser.add_argument('--exp_name', type=str, default='vac')
     parser.add_argument('--render', action='store_true')
+    parser.add_argument('--num_envs', '-ne', type=int, default=1)
     parser.add_argument('--discount', type=float, default=1.0)
     parser.add_argument('--n_iter', '-n', type=int, default=100)
     parser.add_argument('--batch_size', '-b', type=int, default=1000)
@@ -589,6 +688,7 @@ def main():
     parser.add_argument('--num_target_updates', '-ntu', type=int, default=10)
     parser.add_argument('--num_grad_steps_per_target_update',
                         '-ngsptu', type=int, default=10)
+    parser.add_argument('--critic_minibatch_size', '-cmb', type=int, default=0)
     parser.add_argument('--seed', type=int, default=1)
     parser.add_argument('--n_experiments', '-e', type=int, default=1)
     parser.add_argument('--n_layers', '-l', type=int, default=2)
@@ -625,7 +725,9 @@ def main():
                 learning_rate=args.learning_rate,
                 num_target_updates=args.num_target_updates,
                 num_grad_steps_per_target_update=args.num_grad_steps_per_target_update,
+                critic_minibatch_size=args.critic_minibatch_size or None,
                 animate=args.render,
+                num_envs=args.num_envs,
                 logdir=os.path.join(logdir, '%d' % seed),
                 normalize_advantages=not(args.dont_normalize_advantages),
                 seed=seed,
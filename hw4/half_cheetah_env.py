@@ -38,43 +38,21 @@ class HalfCheetahEnv(mujoco_env.MujocoEnv, utils.EzPickle):
 
     @staticmethod
     def cost_fn(states, actions, next_states):
-        is_tf = tf.contrib.framework.is_tensor(states)
-        is_single_state = (len(states.get_shape()) == 1) if is_tf else (len(states.shape) == 1)
-
-        if is_single_state:
-            states = states[None, ...]
-            actions = actions[None, ...]
-            next_states = next_states[None, ...]
-
-        scores = tf.zeros(actions.get_shape()[0].value) if is_tf else np.zeros(actions.shape[0])
-
-        heading_penalty_factor = 10
-
-        # dont move front shin back so far that you tilt forward
-        front_leg = states[:, 5]
-        my_range = 0.2
-        if is_tf:
-            scores += tf.cast(front_leg >= my_range, tf.float32) * heading_penalty_factor
+        """
+        Works on tensorflow tensors and numpy arrays, with or without a leading batch dimension
+        """
+        if tf.contrib.framework.is_tensor(states):
+            to_float, reduce_sum = lambda x: tf.cast(x, tf.float32), tf.reduce_sum
         else:
-            scores += (front_leg >= my_range) * heading_penalty_factor
+            to_float, reduce_sum = lambda x: x.astype(np.float32), np.sum
 
-        front_shin = states[:, 6]
-        my_range = 0
-        if is_tf:
-            scores += tf.cast(front_shin >= my_range, tf.float32) * heading_penalty_factor
-        else:
-            scores += (front_shin >= my_range) * heading_penalty_factor
-
-        front_foot = states[:, 7]
-        my_range = 0
-        if is_tf:
-            scores += tf.cast(front_foot >= my_range, tf.float32) * heading_penalty_factor
-        else:
-            scores += (front_foot >= my_range) * heading_penalty_factor
+        heading_penalty_factor = 10
 
-        scores -= (next_states[:, 17] - states[:, 17]) / 0.01
+        # dont move front leg, shin and foot back so far that you tilt forward
+        front_joints = states[..., 5:8]
+        my_ranges = np.array([0.2, 0, 0], dtype=np.float32)
+        scores = reduce_sum(to_float(front_joints >= my_ranges), axis=-1) * heading_penalty_factor
 
-        if is_single_state:
-            scores = scores[0]
+        scores -= (next_states[..., 17] - states[..., 17]) / 0.01
 
         return scores
@@ -1,4 +1,7 @@
 import os
+import atexit
+import csv
+import time
 from collections import defaultdict
 import logging
 from colorlog import ColoredFormatter
@@ -41,6 +44,14 @@ class LoggerClass(object):
         self._tabular = defaultdict(list)
         self._curr_recorded = list()
         self._num_dump_tabular_calls = 0
+        # the csv is append-only: rows are buffered and appended in batches, and the whole file is only
+        # rewritten when a new column appears
+        self._csv_columns = None
+        self._pending_rows = list()
+        self._flush_rows = 10
+        self._flush_secs = 60.
+        self._last_flush_time = time.time()
+        atexit.register(self.flush)
 
     @property
     def dir(self):
@@ -50,7 +61,12 @@ class LoggerClass(object):
     ### Setup ###
     #############
 
-    def setup(self, display_name, log_path, lvl):
+    def setup(self, display_name, log_path, lvl, flush_rows=10, flush_secs=60.):
+        """
+        The csv is written every flush_rows dumps or flush_secs seconds, whatever comes first
+        """
+        self._flush_rows = flush_rows
+        self._flush_secs = flush_secs
         self._dir = os.path.dirname(log_path)
         self._logger = self._get_logger(LoggerClass.GLOBAL_LOGGER_NAME,
                                         log_path,
@@ -60,7 +76,7 @@ class LoggerClass(object):
 
         ### load csv if exists
         if os.path.exists(self._csv_path):
-            self._tabular = {k: list(v) for k, v in pandas.read_csv(self._csv_path).items()}
+            self._tabular = {k: list(v) for k, v in pandas.read_csv(self._csv_path, index_col=0).items()}
             self._num_dump_tabular_calls = len(tuple(self._tabular.values())[0])
 
     def _get_logger(self, name, log_path, lvl=logging.INFO, display_name=None):
@@ -156,8 +172,38 @@ class LoggerClass(object):
                 print_func(line)
 
         ### write to file
-        tabular_pandas = pandas.DataFrame({k: pandas.Series(v) for k, v in self._tabular.items()})
-        tabular_pandas.to_csv(self._csv_path)
+        if list(self._tabular.keys()) != self._csv_columns:
+            self._rewrite_csv()
+        else:
+            self._pending_rows.append([self._num_dump_tabular_calls - 1] +
+                                      [self._csv_value(v[-1]) for v in self._tabular.values()])
+            if len(self._pending_rows) >= self._flush_rows or \
+                    time.time() - self._last_flush_time >= self._flush_secs:
+                self.flush()
+
+    @staticmethod
+    def _csv_value(val):
+        return '' if isinstance(val, float) and np.isnan(val) else val
+
+    def _rewrite_csv(self):
+        """
+        Writes all recorded rows with the current columns (pandas.DataFrame.to_csv layout, with an index column)
+        """
+        self._csv_columns = list(self._tabular.keys())
+        with open(self._csv_path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow([''] + self._csv_columns)
+            for i in range(self._num_dump_tabular_calls):
+                writer.writerow([i] + [self._csv_value(self._tabular[k][i]) for k in self._csv_columns])
+        self._pending_rows = list()
+        self._last_flush_time = time.time()
+
+    def flush(self):
+        if len(self._pending_rows) > 0:
+            with open(self._csv_path, 'a', newline='') as f:
+                csv.writer(f).writerows(self._pending_rows)
+            self._pending_rows = list()
+        self._last_flush_time = time.time()
 
 
 logger = LoggerClass()
@@ -5,6 +5,7 @@ import time
 from half_cheetah_env import HalfCheetahEnv
 from logger import logger
 from model_based_rl import ModelBasedRL
+from timer import timeit
 
 parser = argparse.ArgumentParser()
 parser.add_argument('question', type=str, choices=('q1, q2, q3'))
@@ -14,6 +15,19 @@ parser.add_argument('--render', action='store_true')
 parser.add_argument('--mpc_horizon', type=int, default=15)
 parser.add_argument('--num_random_action_selection', type=int, default=4096)
 parser.add_argument('--nn_layers', type=int, default=1)
+parser.add_argument('--planner', type=str, default='random', choices=('random', 'cem'))
+parser.add_argument('--cem_iterations', type=int, default=4)
+parser.add_argument('--cem_elite_frac', type=float, default=0.1)
+parser.add_argument('--warm_start', action='store_true')
+parser.add_argument('--replan_interval', type=int, default=1)
+parser.add_argument('--num_envs', type=int, default=1)
+parser.add_argument('--ensemble_size', type=int, default=1)
+parser.add_argument('--probabilistic', action='store_true')
+parser.add_argument('--num_particles', type=int, default=None)
+parser.add_argument('--no_prediction_plots', action='store_true')
+parser.add_argument('--holdout_frac', type=float, default=0.)
+parser.add_argument('--early_stopping_patience', type=int, default=5)
+parser.add_argument('--profile', action='store_true')
 args = parser.parse_args()
 
 data_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'data')
@@ -25,6 +39,8 @@ assert not os.path.exists(exp_dir),\
     'Experiment directory {0} already exists. Either delete the directory, or run the experiment with a different name'.format(exp_dir)
 os.makedirs(exp_dir, exist_ok=True)
 logger.setup(exp_name, os.path.join(exp_dir, 'log.txt'), 'debug')
+if args.profile:
+    timeit.enable_trace(run_metadata_names=('plan', 'train step'))
 
 env = {
     'HalfCheetah': HalfCheetahEnv()
@@ -34,7 +50,19 @@ mbrl = ModelBasedRL(env=env,
                     render=args.render,
                     mpc_horizon=args.mpc_horizon,
                     num_random_action_selection=args.num_random_action_selection,
-                    nn_layers=args.nn_layers)
+                    nn_layers=args.nn_layers,
+                    planner=args.planner,
+                    cem_iterations=args.cem_iterations,
+                    cem_elite_frac=args.cem_elite_frac,
+                    warm_start=args.warm_start,
+                    replan_interval=args.replan_interval,
+                    num_envs=args.num_envs,
+                    ensemble_size=args.ensemble_size,
+                    probabilistic=args.probabilistic,
+                    num_particles=args.num_particles,
+                    plot_predictions=not args.no_prediction_plots,
+                    holdout_frac=args.holdout_frac,
+                    early_stopping_patience=args.early_stopping_patience)
 
 run_func = {
     'q1': mbrl.run_q1,
@@ -2,6 +2,7 @@ import numpy as np
 import tensorflow as tf
 
 import utils
+from timer import timeit
 
 
 class ModelBasedPolicy(object):
@@ -11,7 +12,16 @@ class ModelBasedPolicy(object):
                  init_dataset,
                  horizon=15,
                  num_random_action_selection=4096,
-                 nn_layers=1):
+                 nn_layers=1,
+                 planner='random',
+                 cem_iterations=4,
+                 cem_elite_frac=0.1,
+                 warm_start=False,
+                 warm_start_frac=0.1,
+                 replan_interval=1,
+                 ensemble_size=1,
+                 probabilistic=False,
+                 num_particles=None):
         self._cost_fn = env.cost_fn
         self._state_dim = env.observation_space.shape[0]
         self._action_dim = env.action_space.shape[0]
@@ -22,6 +32,24 @@ class ModelBasedPolicy(object):
         self._num_random_action_selection = num_random_action_selection
         self._nn_layers = nn_layers
         self._learning_rate = 1e-3
+        assert planner in ('random', 'cem')
+        self._planner = planner
+        self._cem_iterations = cem_iterations
+        self._cem_elite_frac = cem_elite_frac
+        # receding-horizon state: the last plan and how many of its actions were executed
+        assert 1 <= replan_interval <= horizon
+        self._warm_start = warm_start
+        self._warm_start_frac = warm_start_frac
+        self._replan_interval = replan_interval
+        self._default_action = (self._action_space_low + self._action_space_high) / 2.
+        self._plan = None
+        self._plan_step = 0
+        # dynamics ensemble: each member predicts the next state (as a Gaussian if probabilistic), and the
+        # planner propagates num_particles particles per action sequence through random members
+        self._ensemble_size = ensemble_size
+        self._probabilistic = probabilistic
+        self._num_particles = num_particles or ensemble_size
+        assert self._num_particles % ensemble_size == 0
 
         self._sess, self._state_ph, self._action_ph, self._next_state_ph,\
             self._next_state_pred, self._loss, self._optimizer, self._best_action = self._setup_graph()
@@ -45,20 +73,84 @@ class ModelBasedPolicy(object):
 
         return state_ph, action_ph, next_state_ph
 
+    def _setup_statistics(self):
+        """
+            Creates non-trainable variables holding the normalization statistics
+
+            They are filled from the dataset's running statistics by update_statistics, so the
+            statistics can follow a growing dataset without rebuilding the graph
+        """
+        def stat_variable(name, dim):
+            return tf.get_variable(name, shape=[dim], dtype=tf.float32, trainable=False,
+                                   initializer=tf.zeros_initializer())
+
+        with tf.variable_scope('normalization'):
+            self._state_mean = stat_variable('state_mean', self._state_dim)
+            self._state_std = stat_variable('state_std', self._state_dim)
+            self._action_mean = stat_variable('action_mean', self._action_dim)
+            self._action_std = stat_variable('action_std', self._action_dim)
+            self._delta_state_mean = stat_variable('delta_state_mean', self._state_dim)
+            self._delta_state_std = stat_variable('delta_state_std', self._state_dim)
+
+    def _setup_training_data(self):
+        """
+            Creates non-trainable variables holding the training transitions, and the training inputs
+
+            The variables are filled by set_training_data. A training step then only feeds the indices of
+            its minibatch in self._train_indices_ph, and the minibatch is gathered on the graph. Feeding the
+            returned tensors directly (as train_step does) bypasses the stored data.
+
+            returns:
+                train_state, train_action, train_next_state: tensors with shape [None, dim]
+        """
+        # the number of stored transitions changes, so the variables are assigned without shape validation
+        self._train_data_assigns = []
+
+        def data_variable(name, dim):
+            variable = tf.get_variable(name, initializer=tf.zeros([0, dim]), trainable=False, validate_shape=False)
+            value_ph = tf.placeholder(tf.float32, [None, dim], name=name + '_value')
+            self._train_data_assigns.append((value_ph, tf.assign(variable, value_ph, validate_shape=False)))
+            return variable
+
+        with tf.variable_scope('training_data'):
+            self._train_states = data_variable('states', self._state_dim)
+            self._train_actions = data_variable('actions', self._action_dim)
+            self._train_next_states = data_variable('next_states', self._state_dim)
+        self._train_indices_ph = tf.placeholder(tf.int32, [None], name='train_indices')
+
+        def train_input(variable, dim, name):
+            batch = tf.reshape(tf.gather(variable, self._train_indices_ph), [-1, dim])
+            return tf.placeholder_with_default(batch, [None, dim], name=name)
+
+        return train_input(self._train_states, self._state_dim, 'train_state'), \
+            train_input(self._train_actions, self._action_dim, 'train_action'), \
+            train_input(self._train_next_states, self._state_dim, 'train_next_state')
+
+    @property
+    def ensemble_size(self):
+        return self._ensemble_size
+
     def _dynamics_func(self, state, action, reuse):
         """
             Takes as input a state and action, and predicts the next state
 
+            The dynamics model is an ensemble of self._ensemble_size networks. state and action have shape
+            [self._ensemble_size, batch_size, dim], and member b predicts the next states of state[b].
+
             returns:
-                next_state_pred: predicted next state
+                next_state_pred: predicted next state (the mean of the prediction if self._probabilistic)
+                delta_state_norm_logvar: log variance of the normalized delta state prediction if
+                    self._probabilistic, else None
 
             implementation details (in order):
-                (a) Normalize both the state and action by using the statistics of self._init_dataset and
-                    the utils.normalize function
+                (a) Normalize both the state and action by using the dataset statistics (see
+                    update_statistics) and the utils.normalize function
                 (b) Concatenate the normalized state and action
                 (c) Pass the concatenated, normalized state-action tensor through a neural network with
-                    self._nn_layers number of layers using the function utils.build_mlp. The resulting output
-                    is the normalized predicted difference between the next state and the current state
+                    self._nn_layers number of layers using the function utils.build_ensemble_mlp. The resulting
+                    output is the normalized predicted difference between the next state and the current state.
+                    If self._probabilistic, the network has twice as many outputs, and the second half is the
+                    log variance of that prediction, which is bounded with self._bound_logvar
                 (d) Unnormalize the delta state prediction, and add it to the current state in order to produce
                     the predicted next state
 
@@ -67,23 +159,91 @@ class ModelBasedPolicy(object):
         # YOUR CODE HERE
         raise NotImplementedError
 
-        return next_state_pred
+        return next_state_pred, delta_state_norm_logvar
+
+    def _bound_logvar(self, logvar, reuse):
+        """
+            Softly bounds the predicted log variance between the learned variables self._min_logvar and
+            self._max_logvar, as in Chua et al. 2018
+        """
+        with tf.variable_scope('dynamics_logvar_bounds', reuse=reuse):
+            self._max_logvar = tf.get_variable('max_logvar', [self._state_dim],
+                                               initializer=tf.constant_initializer(0.5))
+            self._min_logvar = tf.get_variable('min_logvar', [self._state_dim],
+                                               initializer=tf.constant_initializer(-10.))
+        logvar = self._max_logvar - tf.nn.softplus(self._max_logvar - logvar)
+        return self._min_logvar + tf.nn.softplus(logvar - self._min_logvar)
+
+    def _sample_next_state(self, state, action):
+        """
+            Propagates a batch of particles one step through the ensemble
+
+            state and action have shape [batch_size, dim], where batch_size is divisible by
+            self._ensemble_size. The particles are split evenly over the members in order, so callers
+            randomize the particle-to-member assignment by shuffling the particles. Probabilistic
+            members sample the next state from their predicted Gaussian.
+        """
+        state = tf.reshape(state, [self._ensemble_size, -1, self._state_dim])
+        action = tf.reshape(action, [self._ensemble_size, -1, self._action_dim])
+        next_state, delta_state_norm_logvar = self._dynamics_func(state, action, reuse=True)
+        if self._probabilistic:
+            noise = tf.random_normal(tf.shape(next_state)) * tf.exp(0.5 * delta_state_norm_logvar)
+            next_state += noise * self._delta_state_std
+        return tf.reshape(next_state, [-1, self._state_dim])
+
+    def _mean_prediction(self, state, action):
+        """
+            Predicts the next state for a batch of states with shape [batch_size, self._state_dim]
+
+            Every ensemble member sees all states, and their (mean) predictions are averaged
+        """
+        def all_members(x):
+            return tf.tile(x[None], [self._ensemble_size, 1, 1])
+        next_state_pred, _ = self._dynamics_func(all_members(state), all_members(action), reuse=True)
+        return tf.reduce_mean(next_state_pred, axis=0)
 
-    def _setup_training(self, state_ph, next_state_ph, next_state_pred):
+    def _setup_open_loop_prediction(self, state_ph):
+        """
+            Predicts whole trajectories open-loop from their initial states in state_ph, given the
+            action sequences in self._open_loop_actions_ph with shape [batch_size, num_steps, self._action_dim]
+
+            All trajectories are unrolled together in one tf.while_loop over the steps
+        """
+        self._open_loop_actions_ph = tf.placeholder(tf.float32, [None, None, self._action_dim],
+                                                    name='open_loop_actions')
+        actions_per_step = tf.transpose(self._open_loop_actions_ph, [1, 0, 2])
+        num_steps = tf.shape(actions_per_step)[0]
+
+        def prediction_step(t, states, pred_states):
+            next_states = self._mean_prediction(states, actions_per_step[t])
+            return t + 1, next_states, pred_states.write(t, next_states)
+
+        _, _, pred_states = tf.while_loop(lambda t, states, pred_states: t < num_steps,
+                                          prediction_step,
+                                          [tf.constant(0), state_ph,
+                                           tf.TensorArray(tf.float32, size=num_steps)])
+        self._open_loop_pred = tf.transpose(pred_states.stack(), [1, 0, 2])
+
+    def _setup_training(self, state_ph, next_state_ph, next_state_pred, delta_state_norm_logvar):
         """
             Takes as input the current state, next state, and predicted next state, and returns
             the loss and optimizer for training the dynamics model
 
+            The states have shape [self._ensemble_size, batch_size, self._state_dim], member b is trained on
+            the (bootstrapped) minibatch state_ph[b]
+
             returns:
                 loss: Scalar loss tensor
                 optimizer: Operation used to perform gradient descent
 
             implementation details (in order):
                 (a) Compute both the actual state difference and the predicted state difference
-                (b) Normalize both of these state differences by using the statistics of self._init_dataset and
+                (b) Normalize both of these state differences by using the dataset statistics and
                     the utils.normalize function
                 (c) The loss function is the mean-squared-error between the normalized state difference and
-                    normalized predicted state difference
+                    normalized predicted state difference, or the Gaussian negative log-likelihood of the
+                    normalized state difference if self._probabilistic (with delta_state_norm_logvar as the log
+                    variance, plus a small penalty on self._max_logvar - self._min_logvar to keep the bounds tight)
                 (d) Create the optimizer by minimizing the loss using the Adam optimizer with self._learning_rate
 
         """
@@ -95,36 +255,163 @@ class ModelBasedPolicy(object):
 
     def _setup_action_selection(self, state_ph):
         """
-            Computes the best action from the current state by using randomly sampled action sequences
-            to predict future states, evaluating these predictions according to a cost function,
-            selecting the action sequence with the lowest cost, and returning the first action in that sequence
+            Computes the best action from the current state by planning an action sequence with the
+            configured planner (random shooting or the cross-entropy method), and returning the first
+            action in that sequence
+
+            returns:
+                best_action: the action that minimizes the cost function for every state in state_ph
+                    (tensor with shape [None, self._action_dim])
+        """
+        # action selection is batched: state_ph holds one state per environment, and every planner
+        # tensor has a leading dimension over those states
+        # previous plans shifted to start at the current step, used to warm start the planner
+        self._prev_plan_ph = tf.placeholder(tf.float32, [None, self._horizon, self._action_dim],
+                                            name='prev_plan')
+        # costs of externally given action sequences, see action_sequence_costs
+        self._action_sequences_ph = tf.placeholder(tf.float32, [None, None, self._horizon, self._action_dim],
+                                                   name='action_sequences')
+        self._action_sequence_costs_op = self._action_sequence_costs(state_ph, self._action_sequences_ph)
+        if self._planner == 'cem':
+            self._best_action_sequence = self._cem_action_selection(state_ph)
+        else:
+            self._best_action_sequence = self._random_shooting_action_selection(state_ph)
+        best_action = self._best_action_sequence[:, 0]
+
+        return best_action
+
+    def _action_sequence_costs(self, states, action_sequences):
+        """
+            Unrolls every action sequence from its state with the dynamics model and sums up the costs
+
+            The unroll is a tf.while_loop over the horizon, so neither the graph size nor the graph
+            construction time grows with self._horizon
+
+            arguments:
+                states: tensor with shape [num_states, self._state_dim]
+                action_sequences: tensor with shape
+                    [num_states, num_sequences, self._horizon, self._action_dim]
+
+            returns:
+                costs: tensor with shape [num_states, num_sequences]
+        """
+        num_sequences = tf.shape(action_sequences)[1]
+        states = tf.reshape(tf.tile(states[:, None], tf.stack([1, num_sequences, 1])), [-1, self._state_dim])
+        action_sequences = tf.reshape(action_sequences, [-1, self._horizon, self._action_dim])
+        # trajectory sampling (Chua et al. 2018): every sequence is unrolled as self._num_particles particles,
+        # each propagated through one randomly assigned ensemble member for the whole horizon
+        states = tf.tile(states, [self._num_particles, 1])
+        action_sequences = tf.tile(action_sequences, [self._num_particles, 1, 1])
+        if self._ensemble_size > 1:
+            permutation = tf.random_shuffle(tf.range(tf.shape(states)[0]))
+            states = tf.gather(states, permutation)
+            action_sequences = tf.gather(action_sequences, permutation)
+        actions_per_step = tf.transpose(action_sequences, [1, 0, 2])
+
+        def unroll_step(t, states, costs):
+            actions = actions_per_step[t]
+            next_states = self._sample_next_state(states, actions)
+            return t + 1, next_states, costs + self._cost_fn(states, actions, next_states)
+
+        _, _, costs = tf.while_loop(lambda t, states, costs: t < self._horizon,
+                                    unroll_step,
+                                    [tf.constant(0), states, tf.zeros(tf.shape(states)[:1])])
+        if self._ensemble_size > 1:
+            costs = tf.scatter_nd(permutation[:, None], costs, tf.shape(costs))
+        costs = tf.reduce_mean(tf.reshape(costs, [self._num_particles, -1]), axis=0)
+        return tf.reshape(costs, [-1, num_sequences])
+
+    @staticmethod
+    def _gather_sequences(action_sequences, indices):
+        """
+            Selects action_sequences[n, indices[n, ...]] for every state n
+        """
+        num_states = tf.shape(indices)[0]
+        batch_indices = tf.reshape(tf.range(num_states), [-1] + [1] * (indices.get_shape().ndims - 1))
+        batch_indices = tf.ones_like(indices) * batch_indices
+        return tf.gather_nd(action_sequences, tf.stack([batch_indices, indices], axis=-1))
+
+    def _warm_start_sequences(self, num_states, num_warm):
+        """
+            Perturbations of the previous plans in self._prev_plan_ph, the first one unperturbed, with shape
+            [num_states, num_warm, self._horizon, self._action_dim]
+        """
+        scale = 0.1 * (self._action_space_high - self._action_space_low)
+        noise = tf.random_normal(
+            tf.stack([num_states, num_warm - 1, self._horizon, self._action_dim])) * scale
+        noise = tf.concat([tf.zeros_like(noise[:, :1]), noise], axis=1)
+        return tf.clip_by_value(self._prev_plan_ph[:, None] + noise,
+                                self._action_space_low, self._action_space_high)
+
+    def _random_shooting_action_selection(self, state_ph):
+        """
+            Computes the best action sequence for every state in state_ph by using randomly sampled action
+            sequences to predict future states, evaluating these predictions according to a cost function,
+            and selecting the action sequence with the lowest cost
 
             returns:
-                best_action: the action that minimizes the cost function (tensor with shape [self._action_dim])
+                best_action_sequences: tensor with shape [None, self._horizon, self._action_dim]
 
             implementation details (in order):
-                (a) We will assume state_ph has a batch size of 1 whenever action selection is performed
-                (b) Randomly sample uniformly self._num_random_action_selection number of action sequences,
-                    each of length self._horizon
+                (a) Action selection plans for every state in state_ph at once (see get_actions)
+                (b) Randomly sample uniformly self._num_random_action_selection number of action sequences
+                    per state, each of length self._horizon. With warm starting, int(self._num_random_action_selection
+                    * self._warm_start_frac) of them are self._warm_start_sequences instead, so that the planner
+                    can keep refining the previous plan
                 (c) Starting from the input state, unroll each action sequence using your neural network
-                    dynamics model
-                (d) While unrolling the action sequences, keep track of the cost of each action sequence
-                    using self._cost_fn
-                (e) Find the action sequence with the lowest cost, and return the first action in that sequence
+                    dynamics model, and keep track of the cost of each action sequence (self._action_sequence_costs)
+                (d) Find the action sequence with the lowest cost for every state (self._gather_sequences)
 
             Hints:
                 (i) self._cost_fn takes three arguments: states, actions, and next states. These arguments are
                     2-dimensional tensors, where the 1st dimension is the batch size and the 2nd dimension is the
                     state or action size
-                (ii) You should call self._dynamics_func and self._cost_fn a total of self._horizon times
-                (iii) Use tf.random_uniform(...) to generate the random action sequences
+                (ii) Use tf.random_uniform(...) to generate the random action sequences
 
         """
         # PROBLEM 2
         # YOUR CODE HERE
         raise NotImplementedError
 
-        return best_action
+        return best_action_sequences
+
+    def _cem_action_selection(self, state_ph):
+        """
+            Cross-entropy method: for self._cem_iterations iterations, samples
+            self._num_random_action_selection action sequences per state from a diagonal Gaussian,
+            and refits the Gaussian to the self._cem_elite_frac fraction of sequences with the lowest
+            cost. The iterations run in a tf.while_loop, so the graph does not grow with their number.
+
+            With warm starting, the Gaussian mean is initialized with the previous plan
+
+            returns:
+                the final mean action sequence of every state
+        """
+        num_states = tf.shape(state_ph)[0]
+        num_sequences = self._num_random_action_selection
+        num_elites = max(1, int(num_sequences * self._cem_elite_frac))
+        low = tf.constant(self._action_space_low, dtype=tf.float32)
+        high = tf.constant(self._action_space_high, dtype=tf.float32)
+
+        if self._warm_start:
+            init_mean = self._prev_plan_ph
+        else:
+            init_mean = tf.tile(((low + high) / 2.)[None, None], tf.stack([num_states, self._horizon, 1]))
+        init_std = tf.tile(((high - low) / 4.)[None, None], tf.stack([num_states, self._horizon, 1]))
+
+        def cem_iteration(i, mean, std):
+            noise = tf.random_normal(tf.stack([num_states, num_sequences, self._horizon, self._action_dim]))
+            action_sequences = tf.clip_by_value(mean[:, None] + std[:, None] * noise, low, high)
+            costs = self._action_sequence_costs(state_ph, action_sequences)
+            _, elite_indices = tf.nn.top_k(-costs, k=num_elites)
+            elites = self._gather_sequences(action_sequences, elite_indices)
+            elite_mean, elite_var = tf.nn.moments(elites, axes=[1])
+            return i + 1, elite_mean, tf.sqrt(elite_var)
+
+        _, mean, _ = tf.while_loop(lambda i, mean, std: i < self._cem_iterations,
+                                   cem_iteration,
+                                   [tf.constant(0), init_mean, init_std])
+        return mean
 
     def _setup_graph(self):
         """
@@ -134,24 +421,56 @@ class ModelBasedPolicy(object):
         """
         sess = tf.Session()
 
-        # PROBLEM 1
-        # YOUR CODE HERE
-        raise NotImplementedError
-        # PROBLEM 2
-        # YOUR CODE HERE
-        best_action = None
+        state_ph, action_ph, next_state_ph = self._setup_placeholders()
+        self._setup_statistics()
+        self._train_state, self._train_action, self._train_next_state = self._setup_training_data()
+        # the training inputs hold the concatenated minibatches of all ensemble members
+        def member_batches(x):
+            return tf.reshape(x, [self._ensemble_size, -1, x.get_shape()[1].value])
+        train_next_state_pred, delta_state_norm_logvar = self._dynamics_func(member_batches(self._train_state),
+                                                                             member_batches(self._train_action),
+                                                                             reuse=False)
+        loss, optimizer = self._setup_training(member_batches(self._train_state),
+                                               member_batches(self._train_next_state),
+                                               train_next_state_pred, delta_state_norm_logvar)
+        next_state_pred = self._mean_prediction(state_ph, action_ph)
+        self._setup_open_loop_prediction(state_ph)
+        best_action = self._setup_action_selection(state_ph)
 
         sess.run(tf.global_variables_initializer())
+        self.update_statistics(self._init_dataset, sess=sess)
 
         return sess, state_ph, action_ph, next_state_ph, \
             next_state_pred, loss, optimizer, best_action
 
+    def update_statistics(self, dataset, sess=None):
+        """
+        Loads the running normalization statistics of dataset into the graph
+
+        This only assigns variable values, so it is cheap to call whenever the dataset grows
+        """
+        sess = sess or self._sess
+        for variable, value in ((self._state_mean, dataset.state_mean),
+                                (self._state_std, dataset.state_std),
+                                (self._action_mean, dataset.action_mean),
+                                (self._action_std, dataset.action_std),
+                                (self._delta_state_mean, dataset.delta_state_mean),
+                                (self._delta_state_std, dataset.delta_state_std)):
+            variable.load(value, sess)
+
     def train_step(self, states, actions, next_states):
         """
         Performs one step of gradient descent
 
+        The arguments either have a batch dimension, or a leading ensemble dimension followed by a batch
+        dimension to train every ensemble member on its own minibatch
+
         returns:
             loss: the loss from performing gradient descent
+
+        implementation details:
+            (i) The training inputs self._train_state, self._train_action and self._train_next_state can be fed
+                directly, with the ensemble dimension (if any) flattened into the batch dimension
         """
         # PROBLEM 1
         # YOUR CODE HERE
@@ -159,6 +478,36 @@ class ModelBasedPolicy(object):
 
         return loss
 
+    def set_training_data(self, dataset):
+        """
+        Loads all transitions of dataset into the graph, to be indexed by train_step_indices and
+        loss_indices with the dataset's indices
+        """
+        values = (dataset.states, dataset.actions, dataset.next_states)
+        self._sess.run([assign for _, assign in self._train_data_assigns],
+                       feed_dict={value_ph: value for (value_ph, _), value in zip(self._train_data_assigns, values)})
+
+    def train_step_indices(self, indices):
+        """
+        Performs one step of gradient descent on the stored transitions with the given indices
+
+        indices either has shape [batch_size], or [self._ensemble_size, batch_size] to train every ensemble
+        member on its own minibatch
+
+        returns:
+            loss: the loss from performing gradient descent
+        """
+        loss, _ = timeit.run('train step', self._sess, [self._loss, self._optimizer],
+                             feed_dict={self._train_indices_ph: np.reshape(indices, -1)})
+        return loss
+
+    def loss_indices(self, indices):
+        """
+        The loss of every ensemble member on the stored transitions with the given indices, averaged
+        """
+        return self._sess.run(self._loss,
+                              feed_dict={self._train_indices_ph: np.tile(indices, self._ensemble_size)})
+
     def predict(self, state, action):
         """
         Predicts the next state given the current state and action
@@ -179,6 +528,81 @@ class ModelBasedPolicy(object):
         assert np.shape(next_state_pred) == (self._state_dim,)
         return next_state_pred
 
+    def predict_open_loop(self, initial_states, action_sequences):
+        """
+        Predicts trajectories from their initial states using only the dynamics model
+
+        arguments:
+            initial_states: shape [batch_size, self._state_dim]
+            action_sequences: shape [batch_size, num_steps, self._action_dim]
+
+        returns:
+            pred_states: the predicted states after each action, shape [batch_size, num_steps, self._state_dim]
+        """
+        return self._sess.run(self._open_loop_pred,
+                              feed_dict={self._state_ph: initial_states,
+                                         self._open_loop_actions_ph: action_sequences})
+
+    def action_sequence_costs(self, states, action_sequences):
+        """
+        Evaluates the planning graph on given action sequences
+
+        arguments:
+            states: shape [num_states, self._state_dim]
+            action_sequences: shape [num_states, num_sequences, self._horizon, self._action_dim]
+
+        returns:
+            costs: shape [num_states, num_sequences]
+        """
+        return self._sess.run(self._action_sequence_costs_op,
+                              feed_dict={self._state_ph: states,
+                                         self._action_sequences_ph: action_sequences})
+
+    def reset(self):
+        """
+        Forgets the current plans, call at the start of every rollout
+        """
+        self._plan = None
+        self._plan_step = 0
+
+    def _shifted_plan(self, num_states):
+        """
+        The previous plans without their executed actions, padded with default actions
+        """
+        shifted_plan = np.tile(self._default_action, (num_states, self._horizon, 1))
+        if self._warm_start and self._plan is not None:
+            remaining = self._plan[:, self._plan_step:]
+            shifted_plan[:, :remaining.shape[1]] = remaining
+        return shifted_plan
+
+    def get_actions(self, states):
+        """
+        Computes the actions that minimize the cost function for a batch of states, e.g. one per
+        environment, with a single graph execution
+
+        A new plan is computed every self._replan_interval steps, in between the actions of the
+        current plans are executed open-loop. The batch of states must stay the same size until
+        the next reset.
+
+        returns:
+            best_actions: the best action for every state, shape [num_states, self._action_dim]
+        """
+        states = np.asarray(states)
+        assert states.ndim == 2 and states.shape[1] == self._state_dim
+        if self._plan is not None:
+            assert len(self._plan) == len(states)
+
+        if self._plan is not None and self._plan_step < self._replan_interval:
+            best_actions = self._plan[:, self._plan_step]
+            self._plan_step += 1
+            return best_actions
+
+        self._plan = timeit.run('plan', self._sess, self._best_action_sequence,
+                                feed_dict={self._state_ph: states,
+                                           self._prev_plan_ph: self._shifted_plan(len(states))})
+        self._plan_step = 1
+        return self._plan[:, 0]
+
     def get_action(self, state):
         """
         Computes the action that minimizes the cost function given the current state
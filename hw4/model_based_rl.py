@@ -1,7 +1,9 @@
 import os
+from multiprocessing import Process
 
 import matplotlib.pyplot as plt
 import numpy as np
+import pandas
 
 import utils
 from logger import logger
@@ -9,6 +11,26 @@ from model_based_policy import ModelBasedPolicy
 from timer import timeit
 
 
+def plot_predictions(rollouts, save_dir):
+    """
+    Plots the actual vs predicted states of every (states, pred_states) pair in rollouts
+    """
+    for r_num, (states, pred_states) in enumerate(rollouts):
+        state_dim = states.shape[1]
+        rows = int(np.sqrt(state_dim))
+        cols = state_dim // rows
+        f, axes = plt.subplots(rows, cols, figsize=(3 * cols, 3 * rows))
+        f.suptitle('Model predictions (red) versus ground truth (black) for open-loop predictions')
+        for i, (ax, state_i, pred_state_i) in enumerate(zip(axes.ravel(), states.T, pred_states.T)):
+            ax.set_title('state {0}'.format(i))
+            ax.plot(state_i, color='k')
+            ax.plot(pred_state_i, color='r')
+        plt.tight_layout()
+        plt.subplots_adjust(top=0.90)
+        f.savefig(os.path.join(save_dir, 'prediction_{0:03d}.jpg'.format(r_num)), bbox_inches='tight')
+        plt.close(f)
+
+
 class ModelBasedRL(object):
 
     def __init__(self,
@@ -22,14 +44,34 @@ class ModelBasedRL(object):
                  render=False,
                  mpc_horizon=15,
                  num_random_action_selection=4096,
-                 nn_layers=1):
+                 nn_layers=1,
+                 planner='random',
+                 cem_iterations=4,
+                 cem_elite_frac=0.1,
+                 warm_start=False,
+                 replan_interval=1,
+                 num_envs=1,
+                 ensemble_size=1,
+                 probabilistic=False,
+                 num_particles=None,
+                 plot_predictions=True,
+                 holdout_frac=0.,
+                 early_stopping_patience=5):
         self._env = env
+        # rollouts are gathered from num_envs copies of env in lockstep, so that the policy
+        # plans for all of them with one graph execution per step
+        self._envs = [env] + [type(env)() for _ in range(num_envs - 1)]
         self._max_rollout_length = max_rollout_length
         self._num_onpolicy_iters = num_onplicy_iters
         self._num_onpolicy_rollouts = num_onpolicy_rollouts
         self._training_epochs = training_epochs
         self._training_batch_size = training_batch_size
+        # with a held-out split, training stops once the held-out loss has not improved for
+        # early_stopping_patience epochs
+        self._holdout_frac = holdout_frac
+        self._early_stopping_patience = early_stopping_patience
         self._render = render
+        self._plot_predictions = plot_predictions
 
         logger.info('Gathering random dataset')
         self._random_dataset = self._gather_rollouts(utils.RandomPolicy(env),
@@ -39,35 +81,60 @@ class ModelBasedRL(object):
         self._policy = ModelBasedPolicy(env,
                                         self._random_dataset,
                                         horizon=mpc_horizon,
-                                        num_random_action_selection=num_random_action_selection)
-
+                                        num_random_action_selection=num_random_action_selection,
+                                        nn_layers=nn_layers,
+                                        planner=planner,
+                                        cem_iterations=cem_iterations,
+                                        cem_elite_frac=cem_elite_frac,
+                                        warm_start=warm_start,
+                                        replan_interval=replan_interval,
+                                        ensemble_size=ensemble_size,
+                                        probabilistic=probabilistic,
+                                        num_particles=num_particles)
+
+        self._num_profiles = 0
         timeit.reset()
         timeit.start('total')
 
     def _gather_rollouts(self, policy, num_rollouts):
+        """
+        Gathers num_rollouts rollouts, len(self._envs) at a time
+
+        The environments of a chunk are stepped in lockstep with one policy.get_actions call per step.
+        Environments whose rollout is done are no longer stepped (their last state is still passed
+        to the policy so the batch keeps its size). Rollouts are added to the dataset in order.
+        """
         dataset = utils.Dataset()
 
-        for _ in range(num_rollouts):
-            state = self._env.reset()
-            done = False
+        for start in range(0, num_rollouts, len(self._envs)):
+            envs = self._envs[:min(len(self._envs), num_rollouts - start)]
+            rollouts = [utils.Dataset() for _ in envs]
+            states = np.array([env.reset() for env in envs])
+            policy.reset()
+            dones = np.zeros(len(envs), dtype=bool)
             t = 0
-            while not done:
-                if self._render:
+            while not dones.all():
+                if self._render and not dones[0]:
                     timeit.start('render')
-                    self._env.render()
+                    envs[0].render()
                     timeit.stop('render')
                 timeit.start('get action')
-                action = policy.get_action(state)
+                actions = policy.get_actions(states)
                 timeit.stop('get action')
-                timeit.start('env step')
-                next_state, reward, done, _ = self._env.step(action)
-                timeit.stop('env step')
-                done = done or (t >= self._max_rollout_length)
-                dataset.add(state, action, next_state, reward, done)
-
-                state = next_state
+                for i in np.flatnonzero(~dones):
+                    timeit.start('env step')
+                    next_state, reward, done, _ = envs[i].step(actions[i])
+                    timeit.stop('env step')
+                    done = done or (t >= self._max_rollout_length)
+                    rollouts[i].add(states[i], actions[i], next_state, reward, done)
+
+                    states[i] = next_state
+                    dones[i] = done
                 t += 1
 
+            for rollout in rollouts:
+                dataset.append(rollout)
+
         return dataset
 
     def _train_policy(self, dataset):
@@ -75,20 +142,48 @@ class ModelBasedRL(object):
         Train the model-based policy
 
         implementation details:
-            (a) Train for self._training_epochs number of epochs
-            (b) The dataset.random_iterator(...)  method will iterate through the dataset once in a random order
+            (a) Train for self._training_epochs number of epochs (fewer if the held-out loss stops improving)
+            (b) The dataset.random_index_iterator(...) method will iterate through train_indices once in a random
+                order, with num_bootstraps so that every ensemble member is trained on its own bootstrap resample
             (c) Use self._training_batch_size for iterating through the dataset
-            (d) Keep track of the loss values by appending them to the losses array
+            (d) The dataset is loaded into the graph once, so every training step only feeds minibatch indices to
+                self._policy.train_step_indices(...)
+            (e) Keep track of the loss values by appending them to the losses array
         """
         timeit.start('train policy')
 
         losses = []
-        # PROBLEM 1
-        # YOUR CODE HERE
-        raise NotImplementedError
+        self._policy.set_training_data(dataset)
+        indices = np.random.permutation(dataset.transition_indices())
+        num_holdout = int(len(indices) * self._holdout_frac)
+        holdout_indices, train_indices = indices[:num_holdout], indices[num_holdout:]
+        num_bootstraps = self._policy.ensemble_size if self._policy.ensemble_size > 1 else None
+
+        best_holdout_loss = np.inf
+        holdout_loss = np.nan
+        epochs_without_improvement = 0
+        epochs_run = 0
+        for epoch in range(self._training_epochs):
+            # PROBLEM 1
+            # YOUR CODE HERE
+            raise NotImplementedError
 
-        logger.record_tabular('TrainingLossStart', losses[0])
-        logger.record_tabular('TrainingLossFinal', losses[-1])
+            epochs_run += 1
+            if num_holdout > 0:
+                holdout_loss = self._policy.loss_indices(holdout_indices)
+                if holdout_loss < best_holdout_loss:
+                    best_holdout_loss = holdout_loss
+                    epochs_without_improvement = 0
+                else:
+                    epochs_without_improvement += 1
+                    if epochs_without_improvement >= self._early_stopping_patience:
+                        break
+
+        logger.record_tabular('TrainingLossStart', losses[0] if losses else np.nan)
+        logger.record_tabular('TrainingLossFinal', losses[-1] if losses else np.nan)
+        logger.record_tabular('TrainingEpochs', epochs_run)
+        if num_holdout > 0:
+            logger.record_tabular('HoldoutLossFinal', holdout_loss)
 
         timeit.stop('train policy')
 
@@ -99,6 +194,10 @@ class ModelBasedRL(object):
         logger.debug('')
         for line in str(timeit).split('\n'):
             logger.debug(line)
+        if timeit.trace:
+            self._num_profiles += 1
+            timeit.save_stats_csv(os.path.join(logger.dir, 'profile_{0:03d}.csv'.format(self._num_profiles)))
+            timeit.save_chrome_trace(os.path.join(logger.dir, 'trace_{0:03d}.json'.format(self._num_profiles)))
         timeit.reset()
         timeit.start('total')
 
@@ -113,6 +212,10 @@ class ModelBasedRL(object):
                  NOTE: you should *not* be using any of the states in states[1:]. Only use states[0]
             (iii) After predicting the future states, we have provided plotting code that plots the actual vs
                   predicted states and saves these to the experiment's folder. You do not need to modify this code.
+
+        All rollouts are predicted together with one graph execution (ModelBasedPolicy.predict_open_loop).
+        The mean squared prediction error per number of predicted steps is written to prediction_mse.csv,
+        and the plots are rendered in a background process that can outlive this call.
         """
         logger.info('Training policy....')
         # PROBLEM 1
@@ -120,31 +223,46 @@ class ModelBasedRL(object):
         raise NotImplementedError
 
         logger.info('Evaluating predictions...')
-        for r_num, (states, actions, _, _, _) in enumerate(self._random_dataset.rollout_iterator()):
-            pred_states = []
+        rollouts = [(states, actions) for states, actions, _, _, _ in self._random_dataset.rollout_iterator()]
+        num_steps = max(len(states) for states, _ in rollouts)
+        # pad the rollouts to a common length, the padded steps are masked out of the errors
+        actions = np.zeros((len(rollouts), num_steps, rollouts[0][1].shape[1]), dtype=np.float32)
+        mask = np.zeros((len(rollouts), num_steps), dtype=bool)
+        for r_num, (states_r, actions_r) in enumerate(rollouts):
+            actions[r_num, :len(actions_r)] = actions_r
+            mask[r_num, :len(actions_r)] = True
 
-            # PROBLEM 1
-            # YOUR CODE HERE
-            raise NotImplementedError
+        # PROBLEM 1
+        # YOUR CODE HERE
+        # pred_states[r, t] is the prediction of the state before action t of rollout r, with shape
+        # [len(rollouts), num_steps, state_dim]
+        raise NotImplementedError
 
-            states = np.asarray(states)
-            pred_states = np.asarray(pred_states)
-
-            state_dim = states.shape[1]
-            rows = int(np.sqrt(state_dim))
-            cols = state_dim // rows
-            f, axes = plt.subplots(rows, cols, figsize=(3 * cols, 3 * rows))
-            f.suptitle('Model predictions (red) versus ground truth (black) for open-loop predictions')
-            for i, (ax, state_i, pred_state_i) in enumerate(zip(axes.ravel(), states.T, pred_states.T)):
-                ax.set_title('state {0}'.format(i))
-                ax.plot(state_i, color='k')
-                ax.plot(pred_state_i, color='r')
-            plt.tight_layout()
-            plt.subplots_adjust(top=0.90)
-            f.savefig(os.path.join(
-                logger.dir, 'prediction_{0:03d}.jpg'.format(r_num)), bbox_inches='tight')
-
-        logger.info('All plots saved to folder')
+        states = np.zeros_like(pred_states)
+        for r_num, (states_r, _) in enumerate(rollouts):
+            states[r_num, :len(states_r)] = states_r
+        squared_errors = np.square(pred_states - states)
+        state_var = np.square(self._random_dataset.state_std)
+        counts = np.sum(mask, axis=0)
+        mse = pandas.DataFrame({
+            'Horizon': np.arange(num_steps),
+            'MSE': np.sum(np.mean(squared_errors, axis=2) * mask, axis=0) / counts,
+            'NormalizedMSE': np.sum(np.mean(squared_errors / (state_var + 1e-8), axis=2) * mask, axis=0) / counts,
+        })
+        mse.to_csv(os.path.join(logger.dir, 'prediction_mse.csv'), index=False)
+        for horizon in (1, 10, 100):
+            if horizon < num_steps:
+                logger.info('Normalized MSE after {0} steps: {1:.4f}'.format(
+                    horizon, mse['NormalizedMSE'][horizon]))
+
+        if self._plot_predictions:
+            plot_process = Process(target=plot_predictions,
+                                   args=([(states[r][mask[r]], pred_states[r][mask[r]])
+                                          for r in range(len(rollouts))],
+                                         logger.dir))
+            # not a daemon, so the interpreter waits for the plots before exiting
+            plot_process.start()
+            logger.info('Saving plots to folder in the background')
 
     def run_q2(self):
         """
@@ -196,5 +314,6 @@ class ModelBasedRL(object):
             # YOUR CODE HERE
             logger.info('Appending dataset...')
             raise NotImplementedError
+            self._policy.update_statistics(dataset)
 
             self._log(new_dataset)
@@ -37,3 +37,24 @@ python3 main.py q3 --exp_name layers1 --nn_layers 1
 python3 main.py q3 --exp_name layers2 --nn_layers 2
 python3 main.py q3 --exp_name layers3 --nn_layers 3
 python3 plot.py --exps HalfCheetah_q3_layers1 HalfCheetah_q3_layers2 HalfCheetah_q3_layers3 --save HalfCheetah_q3_nn_layers
+
+###########
+### CEM ###
+###########
+
+python3 main.py q3 --exp_name cem512 --planner cem --num_random_action_selection 512
+python3 plot.py --exps HalfCheetah_q3_action4096 HalfCheetah_q3_cem512 --save HalfCheetah_q3_cem
+
+python3 main.py q3 --exp_name cem512_warm --planner cem --num_random_action_selection 512 --warm_start
+python3 main.py q3 --exp_name cem512_warm_replan3 --planner cem --num_random_action_selection 512 --warm_start --replan_interval 3
+python3 plot.py --exps HalfCheetah_q3_cem512 HalfCheetah_q3_cem512_warm HalfCheetah_q3_cem512_warm_replan3 --save HalfCheetah_q3_warm_start
+
+python3 main.py q3 --exp_name cem512_warm_envs10 --planner cem --num_random_action_selection 512 --warm_start --num_envs 10
+
+############
+### PETS ###
+############
+
+python3 main.py q3 --exp_name cem512_pe5 --planner cem --num_random_action_selection 512 --ensemble_size 5 --probabilistic
+python3 main.py q3 --exp_name cem512_pe5_p20 --planner cem --num_random_action_selection 512 --ensemble_size 5 --probabilistic --num_particles 20
+python3 plot.py --exps HalfCheetah_q3_cem512 HalfCheetah_q3_cem512_pe5 HalfCheetah_q3_cem512_pe5_p20 --save HalfCheetah_q3_pets
@@ -0,0 +1,68 @@
+"""
+Unit tests for half_cheetah_env.py
+"""
+
+import numpy as np
+import tensorflow as tf
+
+from half_cheetah_env import HalfCheetahEnv
+
+
+def per_joint_cost_fn(states, actions, next_states):
+    """The per-joint cost_fn loop that the vectorized one replaced, for numpy arrays"""
+    is_single_state = len(states.shape) == 1
+    if is_single_state:
+        states = states[None, ...]
+        actions = actions[None, ...]
+        next_states = next_states[None, ...]
+
+    scores = np.zeros(actions.shape[0])
+    heading_penalty_factor = 10
+    for joint, my_range in ((5, 0.2), (6, 0), (7, 0)):
+        scores += (states[:, joint] >= my_range) * heading_penalty_factor
+    scores -= (next_states[:, 17] - states[:, 17]) / 0.01
+
+    if is_single_state:
+        scores = scores[0]
+    return scores
+
+
+def random_transitions(batch_size):
+    rng = np.random.RandomState(0)
+    states = rng.randn(batch_size, 20).astype(np.float32)
+    # hit the range boundaries exactly
+    states[::3, 5:8] = [0.2, 0, 0]
+    actions = rng.randn(batch_size, 6).astype(np.float32)
+    next_states = states + 0.01 * rng.randn(batch_size, 20).astype(np.float32)
+    return states, actions, next_states
+
+
+class TestCostFn(object):
+    def test_batched(self):
+        states, actions, next_states = random_transitions(50)
+        np.testing.assert_allclose(HalfCheetahEnv.cost_fn(states, actions, next_states),
+                                   per_joint_cost_fn(states, actions, next_states), rtol=1e-5)
+
+    def test_unbatched(self):
+        states, actions, next_states = random_transitions(4)
+        for state, action, next_state in zip(states, actions, next_states):
+            cost = HalfCheetahEnv.cost_fn(state, action, next_state)
+            assert np.shape(cost) == ()
+            np.testing.assert_allclose(cost, per_joint_cost_fn(state, action, next_state), rtol=1e-5)
+
+    def test_tensors(self):
+        states, actions, next_states = random_transitions(50)
+        with tf.Graph().as_default():
+            states_ph = tf.placeholder(tf.float32, [None, 20])
+            actions_ph = tf.placeholder(tf.float32, [None, 6])
+            next_states_ph = tf.placeholder(tf.float32, [None, 20])
+            costs = HalfCheetahEnv.cost_fn(states_ph, actions_ph, next_states_ph)
+            cost = HalfCheetahEnv.cost_fn(states_ph[0], actions_ph[0], next_states_ph[0])
+            with tf.Session() as sess:
+                costs, cost = sess.run([costs, cost], feed_dict={states_ph: states, actions_ph: actions,
+                                                                 next_states_ph: next_states})
+
+        expected = per_joint_cost_fn(states, actions, next_states)
+        np.testing.assert_allclose(costs, expected, rtol=1e-5)
+        assert np.shape(cost) == ()
+        np.testing.assert_allclose(cost, expected[0], rtol=1e-5)
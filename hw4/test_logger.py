@@ -0,0 +1,55 @@
+"""
+Unit tests for logger.py
+"""
+
+import numpy as np
+import pandas
+
+from logger import LoggerClass
+
+
+def dump_rows(logger, rows):
+    for row in rows:
+        for key, val in row.items():
+            logger.record_tabular(key, val)
+        logger.dump_tabular()
+
+
+class TestLogger(object):
+    def test_csv_round_trip(self, tmpdir):
+        log_path, csv_path = str(tmpdir.join('log.txt')), str(tmpdir.join('log.csv'))
+        logger = LoggerClass()
+        logger.setup('test_csv_round_trip', log_path, 'info', flush_rows=2)
+
+        dump_rows(logger, [{'Itr': i, 'ReturnAvg': 0.5 * i} for i in range(3)])
+        # a new column rewrites the file, the following rows are appended again
+        dump_rows(logger, [{'Itr': i, 'ReturnAvg': 0.5 * i, 'TrainingEpochs': 10 + i} for i in range(3, 6)])
+        logger.flush()
+
+        with open(csv_path) as f:
+            lines = f.read().split('\n')
+        # a header and one line per row, without blank lines
+        assert lines[-1] == '' and all(lines[:-1]) and len(lines) == 8
+        data = pandas.read_csv(csv_path, index_col=0)
+        assert list(data.columns) == ['Itr', 'ReturnAvg', 'TrainingEpochs']
+        np.testing.assert_array_equal(data.index, np.arange(6))
+        np.testing.assert_array_equal(data['Itr'], np.arange(6))
+        np.testing.assert_allclose(data['ReturnAvg'], 0.5 * np.arange(6))
+        np.testing.assert_array_equal(data['TrainingEpochs'], [np.nan] * 3 + [13, 14, 15])
+
+    def test_resume(self, tmpdir):
+        log_path, csv_path = str(tmpdir.join('log.txt')), str(tmpdir.join('log.csv'))
+        logger = LoggerClass()
+        logger.setup('test_resume', log_path, 'info', flush_rows=1)
+        dump_rows(logger, [{'Itr': i, 'ReturnAvg': 0.5 * i} for i in range(2)])
+        logger.flush()
+
+        resumed = LoggerClass()
+        resumed.setup('test_resume_2', log_path, 'info', flush_rows=1)
+        dump_rows(resumed, [{'Itr': i, 'ReturnAvg': 0.5 * i} for i in range(2, 4)])
+        resumed.flush()
+
+        data = pandas.read_csv(csv_path, index_col=0)
+        np.testing.assert_array_equal(data.index, np.arange(4))
+        np.testing.assert_array_equal(data['Itr'], np.arange(4))
+        np.testing.assert_allclose(data['ReturnAvg'], 0.5 * np.arange(4))
@@ -0,0 +1,97 @@
+"""
+Unit tests for timer.py
+"""
+
+import json
+
+import numpy as np
+import pandas
+from mock import patch
+
+from timer import TimeIt
+
+
+def run_phases(timer, phases):
+    """Replay (start or stop, name, time) steps on timer with a fake clock"""
+    with patch('time.time', side_effect=[t for _, _, t in phases]):
+        for action, name, _ in phases:
+            getattr(timer, action)(name)
+
+
+class TestTimeIt(object):
+    def test_reparented_phase(self):
+        timer = TimeIt()
+        run_phases(timer, [
+            ('start', 'total', 0.),
+            # 'get action' is first a direct child of 'total'...
+            ('start', 'get action', 1.),
+            ('stop', 'get action', 2.),
+            # ...and then nested in 'rollout'
+            ('start', 'rollout', 3.),
+            ('start', 'get action', 4.),
+            ('stop', 'get action', 6.),
+            ('stop', 'rollout', 7.),
+            ('stop', 'total', 10.),
+        ])
+
+        assert timer.elapsed('get action') == 3.
+        assert timer.self_time('rollout') == 2.
+        # 1s of 'get action' and 4s of 'rollout' are directly in 'total'
+        assert timer.self_time('total') == 5.
+        assert timer.parents['get action'] == {'total', 'rollout'}
+        other = [line for line in str(timer).split('\n') if 'other' in line]
+        assert other == [': other      5.0 (50.0%)']
+
+    def test_stats(self):
+        timer = TimeIt()
+        # calls of 1, 2, ..., 100 ms
+        phases = []
+        for i in range(1, 101):
+            phases += [('start', 'step', float(i)), ('stop', 'step', i + i * 1e-3)]
+        run_phases(timer, phases)
+
+        stats = timer.stats('step')
+        assert stats['count'] == 100
+        np.testing.assert_allclose(stats['total'], 5.05)
+        np.testing.assert_allclose(stats['mean'], 0.0505)
+        np.testing.assert_allclose(stats['p50'], 0.0505)
+        np.testing.assert_allclose(stats['p99'], 0.09901)
+        assert np.isnan(timer.stats('unknown')['p50'])
+
+    def test_save_stats_csv(self, tmpdir):
+        timer = TimeIt()
+        run_phases(timer, [
+            ('start', 'total', 0.),
+            ('start', 'step', 1.),
+            ('stop', 'step', 3.),
+            ('stop', 'total', 4.),
+        ])
+        path = str(tmpdir.join('profile.csv'))
+        timer.save_stats_csv(path)
+
+        stats = pandas.read_csv(path, index_col='name')
+        assert stats.loc['step', 'parent'] == 'total'
+        assert stats.loc['total', 'self'] == 2.
+        assert stats.loc['step', 'count'] == 1
+
+    def test_chrome_trace(self, tmpdir):
+        timer = TimeIt()
+        timer.enable_trace()
+        run_phases(timer, [
+            ('start', 'total', 1.),
+            ('start', 'plan', 1.5),
+            ('stop', 'plan', 1.75),
+            ('stop', 'total', 2.),
+        ])
+        path = str(tmpdir.join('trace.json'))
+        timer.save_chrome_trace(path)
+
+        with open(path) as f:
+            trace = json.load(f)
+        events = {event['name']: event for event in trace['traceEvents'] if event['ph'] == 'X'}
+        assert sorted(events) == ['plan', 'total']
+        assert events['plan']['ts'] == 1.5e6 and events['plan']['dur'] == 0.25e6
+        assert events['plan']['args']['depth'] == 1
+        assert events['total']['ts'] == 1e6 and events['total']['dur'] == 1e6
+        assert events['total']['args']['depth'] == 0
+        assert trace['traceEvents'][0]['ph'] == 'M'
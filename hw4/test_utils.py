@@ -0,0 +1,132 @@
+"""
+Unit tests for utils.py
+"""
+
+import numpy as np
+
+from utils import Dataset, RunningStats
+
+
+def random_rollout(rng, length, state_dim=3, action_dim=2):
+    """A rollout as a Dataset and as plain (states, actions, next_states, rewards, dones) arrays"""
+    states = rng.randn(length + 1, state_dim)
+    arrays = (states[:-1], rng.randn(length, action_dim), states[1:], rng.randn(length),
+              np.arange(length) == length - 1)
+    dataset = Dataset(capacity=2)
+    for transition in zip(*arrays):
+        dataset.add(*transition)
+    return dataset, arrays
+
+
+class TestRunningStats(object):
+    def test_update(self):
+        rng = np.random.RandomState(0)
+        batches = [rng.randn(n, 4) * 3 + 5 for n in (1, 7, 0, 30, 2)]
+        stats = RunningStats()
+        for batch in batches:
+            stats.update(batch)
+
+        data = np.concatenate(batches)
+        assert stats.count == len(data)
+        np.testing.assert_allclose(stats.mean, np.mean(data, axis=0))
+        np.testing.assert_allclose(stats.var, np.var(data, axis=0))
+        np.testing.assert_allclose(stats.std, np.std(data, axis=0))
+
+    def test_merge(self):
+        rng = np.random.RandomState(1)
+        first, second = rng.randn(10, 3), rng.randn(25, 3) + 100
+        stats, other = RunningStats(), RunningStats()
+        stats.update(first)
+        other.update(second)
+        stats.merge(other)
+
+        data = np.concatenate([first, second])
+        assert stats.count == len(data)
+        np.testing.assert_allclose(stats.mean, np.mean(data, axis=0))
+        np.testing.assert_allclose(stats.var, np.var(data, axis=0))
+        # other is unchanged
+        np.testing.assert_allclose(other.mean, np.mean(second, axis=0))
+
+    def test_merge_empty(self):
+        data = np.random.RandomState(2).randn(5, 2)
+        stats = RunningStats()
+        stats.update(data)
+
+        stats.merge(RunningStats())
+        np.testing.assert_allclose(stats.mean, np.mean(data, axis=0))
+        np.testing.assert_allclose(stats.var, np.var(data, axis=0))
+
+        empty = RunningStats()
+        empty.merge(stats)
+        assert empty.count == len(data)
+        np.testing.assert_allclose(empty.mean, np.mean(data, axis=0))
+        np.testing.assert_allclose(empty.var, np.var(data, axis=0))
+        # the merged statistics do not share arrays with stats
+        stats.update(data + 1)
+        np.testing.assert_allclose(empty.mean, np.mean(data, axis=0))
+
+
+class TestDataset(object):
+    def test_empty_statistics(self):
+        dataset = Dataset()
+        for stat in (dataset.state_mean, dataset.state_std, dataset.action_mean, dataset.action_std,
+                     dataset.delta_state_mean, dataset.delta_state_std):
+            assert np.all(np.isnan(stat))
+
+    def test_growth(self):
+        rng = np.random.RandomState(0)
+        dataset = Dataset(capacity=1)
+        expected = None
+        for length in (1, 5, 20, 50):
+            rollout, arrays = random_rollout(rng, length)
+            # query the statistics before every growth step, so that they are cached
+            if expected is not None:
+                np.testing.assert_allclose(dataset.state_mean, np.mean(expected[0], axis=0))
+            if length % 2:
+                dataset.append(rollout)
+            else:
+                for transition in zip(*arrays):
+                    dataset.add(*transition)
+            expected = arrays if expected is None else \
+                [np.concatenate([e, a]) for e, a in zip(expected, arrays)]
+
+        assert len(dataset) == 76
+        for actual, values in zip((dataset.states, dataset.actions, dataset.next_states, dataset.rewards,
+                                   dataset.dones), expected):
+            np.testing.assert_array_equal(actual, values)
+        states, actions, next_states = expected[:3]
+        np.testing.assert_allclose(dataset.state_mean, np.mean(states, axis=0))
+        np.testing.assert_allclose(dataset.state_std, np.std(states, axis=0))
+        np.testing.assert_allclose(dataset.action_mean, np.mean(actions, axis=0))
+        np.testing.assert_allclose(dataset.action_std, np.std(actions, axis=0))
+        np.testing.assert_allclose(dataset.delta_state_mean, np.mean(next_states - states, axis=0))
+        np.testing.assert_allclose(dataset.delta_state_std, np.std(next_states - states, axis=0))
+
+    def test_iterators(self):
+        rng = np.random.RandomState(1)
+        dataset = Dataset(capacity=1)
+        rollouts = []
+        for length in (3, 7, 4):
+            rollout, arrays = random_rollout(rng, length)
+            dataset.append(rollout)
+            rollouts.append(arrays)
+
+        for actual, expected in zip(dataset.rollout_iterator(), rollouts):
+            for actual_values, expected_values in zip(actual, expected):
+                np.testing.assert_array_equal(actual_values, expected_values)
+                # views of the storage, not copies
+                assert actual_values.base is not None
+
+        transition_indices = dataset.transition_indices()
+        assert len(transition_indices) == len(dataset) - len(rollouts)
+        assert not np.any(dataset.dones[transition_indices])
+        batches = list(dataset.random_index_iterator(4))
+        np.testing.assert_array_equal(np.sort(np.concatenate(batches)), transition_indices)
+        assert all(len(batch) == 4 for batch in batches[:-1])
+
+        for states, actions, next_states, rewards, dones in dataset.random_iterator(4):
+            indices = [int(np.flatnonzero(np.all(dataset.states == state, axis=1))[0]) for state in states]
+            np.testing.assert_array_equal(actions, dataset.actions[indices])
+            np.testing.assert_array_equal(next_states, dataset.next_states[indices])
+            np.testing.assert_array_equal(rewards, dataset.rewards[indices])
+            assert not np.any(dones)
@@ -1,42 +1,177 @@
+import json
 import time
 from collections import defaultdict
+from contextlib import contextmanager
+
+import numpy as np
 
 class TimeIt(object):
+    """
+    Accumulates wall-clock time of named phases
+
+    Phases can nest: a phase started while another one is running is its child in that call, and the
+    time of every call is added to the child time of its parent, so the self time of a phase (see
+    self_time) is correct even if it has different parents in different calls. The unaccounted 'other'
+    time is the self time of 'total'. Besides the totals, the duration of
+    every call is kept for per-call statistics. With tracing enabled (see enable_trace), every call is
+    also recorded as an event for export in the Chrome trace format (chrome://tracing), together with
+    the tensorflow step stats of selected sess.run calls.
+    """
     def __init__(self, prefix=''):
         self.prefix = prefix
-        self.start_times = dict()
-        self.elapsed_times = defaultdict(int)
+        self.trace = False
+        self.run_metadata_names = ()
+        self.run_metadata_interval = 100
+        self.reset()
+
+    def enable_trace(self, run_metadata_names=(), run_metadata_interval=100):
+        """
+        Record trace events, and capture tf.RunMetadata for every run_metadata_interval-th
+        call of the runs (see run) in run_metadata_names
+        """
+        self.trace = True
+        self.run_metadata_names = tuple(run_metadata_names)
+        self.run_metadata_interval = run_metadata_interval
 
     def start(self, name):
         assert(name not in self.start_times)
+        self.parents[name].add(self.open_names[-1] if self.open_names else None)
+        self.open_names.append(name)
         self.start_times[name] = time.time()
 
     def stop(self, name):
         assert(name in self.start_times)
-        self.elapsed_times[name] += time.time() - self.start_times[name]
-        self.start_times.pop(name)
+        start_time = self.start_times.pop(name)
+        elapsed = time.time() - start_time
+        self.elapsed_times[name] += elapsed
+        self.call_times[name].append(elapsed)
+        depth = self.open_names.index(name)
+        if depth > 0:
+            self.child_times[self.open_names[depth - 1]] += elapsed
+        self.open_names.remove(name)
+        if self.trace:
+            self.events.append((name, start_time, elapsed, depth))
+
+    @contextmanager
+    def span(self, name):
+        """
+        Times the enclosed block, usable as a context manager or as a function decorator:
+
+            with timeit.span('plan'):
+                ...
+
+            @timeit.span('plan')
+            def plan(...):
+                ...
+        """
+        self.start(name)
+        try:
+            yield
+        finally:
+            self.stop(name)
+
+    def run(self, name, sess, fetches, feed_dict=None):
+        """
+        sess.run(fetches, feed_dict) timed as name, capturing its tf.RunMetadata if requested
+        """
+        with self.span(name):
+            if self.trace and name in self.run_metadata_names and \
+                    self.count(name) % self.run_metadata_interval == 0:
+                import tensorflow as tf
+                run_metadata = tf.RunMetadata()
+                result = sess.run(fetches, feed_dict=feed_dict,
+                                  options=tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE),
+                                  run_metadata=run_metadata)
+                self.step_stats.append(run_metadata.step_stats)
+            else:
+                result = sess.run(fetches, feed_dict=feed_dict)
+        return result
 
     def elapsed(self, name):
         return self.elapsed_times[name]
 
+    def count(self, name):
+        return len(self.call_times[name])
+
+    def self_time(self, name):
+        """
+        Time of name not spent in phases nested in it
+        """
+        return self.elapsed_times[name] - self.child_times[name]
+
+    def stats(self, name):
+        """
+        Per-call statistics of name in seconds: count, total, mean, p50 and p99
+        """
+        call_times = np.array(self.call_times[name])
+        return {
+            'count': len(call_times),
+            'total': self.elapsed_times[name],
+            'mean': np.mean(call_times) if len(call_times) > 0 else np.nan,
+            'p50': np.percentile(call_times, 50) if len(call_times) > 0 else np.nan,
+            'p99': np.percentile(call_times, 99) if len(call_times) > 0 else np.nan,
+        }
+
     def reset(self):
         self.start_times = dict()
         self.elapsed_times = defaultdict(int)
+        self.call_times = defaultdict(list)
+        self.child_times = defaultdict(int)
+        # the names of the phases every phase was started in (None at the top level)
+        self.parents = defaultdict(set)
+        self.open_names = []
+        self.events = []
+        self.step_stats = []
+
+    def save_stats_csv(self, path):
+        """
+        Write the per-call statistics of every name to a csv file
+        """
+        import pandas
+        rows = []
+        for name in sorted(self.elapsed_times):
+            stats = self.stats(name)
+            parents = sorted(parent for parent in self.parents[name] if parent is not None)
+            stats.update(name=name, parent=';'.join(parents), self=self.self_time(name))
+            rows.append(stats)
+        pandas.DataFrame(rows, columns=['name', 'parent', 'count', 'total', 'self', 'mean', 'p50', 'p99']).to_csv(
+            path, index=False)
+
+    def save_chrome_trace(self, path):
+        """
+        Write the recorded events and tensorflow step stats to a json file that can be opened in
+        chrome://tracing. The python phases are in process 0, the tensorflow devices follow.
+        """
+        trace_events = [{'name': 'process_name', 'ph': 'M', 'pid': 0, 'args': {'name': 'python'}}]
+        for name, start_time, elapsed, depth in self.events:
+            trace_events.append({'name': name, 'ph': 'X', 'pid': 0, 'tid': 0,
+                                 'ts': start_time * 1e6, 'dur': elapsed * 1e6, 'args': {'depth': depth}})
+        if self.step_stats:
+            from tensorflow.python.client import timeline
+            for step_stats in self.step_stats:
+                tf_trace = json.loads(timeline.Timeline(step_stats).generate_chrome_trace_format())
+                for event in tf_trace['traceEvents']:
+                    event['pid'] = event.get('pid', 0) + 1
+                    trace_events.append(event)
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': trace_events, 'displayTimeUnit': 'ms'}, f)
 
     def __str__(self):
         s = ''
         names_elapsed = sorted(self.elapsed_times.items(), key=lambda x: x[1], reverse=True)
         for name, elapsed in names_elapsed:
+            stats = self.stats(name)
+            call_stats = '[{0} calls, mean {1:.2f}ms, p50 {2:.2f}ms, p99 {3:.2f}ms]'.format(
+                stats['count'], 1e3 * stats['mean'], 1e3 * stats['p50'], 1e3 * stats['p99'])
             if 'total' not in self.elapsed_times:
-                s += '{0}: {1: <10} {2:.1f}\n'.format(self.prefix, name, elapsed)
+                s += '{0}: {1: <10} {2:.1f} {3}\n'.format(self.prefix, name, elapsed, call_stats)
             else:
                 assert(self.elapsed_times['total'] >= max(self.elapsed_times.values()))
                 pct = 100. * elapsed / self.elapsed_times['total']
-                s += '{0}: {1: <10} {2:.1f} ({3:.1f}%)\n'.format(self.prefix, name, elapsed, pct)
+                s += '{0}: {1: <10} {2:.1f} ({3:.1f}%) {4}\n'.format(self.prefix, name, elapsed, pct, call_stats)
         if 'total' in self.elapsed_times:
-            times_summed = sum([t for k, t in self.elapsed_times.items() if k != 'total'])
-            other_time = self.elapsed_times['total'] - times_summed
-            assert(other_time >= 0)
+            # nested phases are already contained in their parent's time
+            other_time = self.self_time('total')
             pct = 100. * other_time / self.elapsed_times['total']
             s += '{0}: {1: <10} {2:.1f} ({3:.1f}%)\n'.format(self.prefix, 'other', other_time, pct)
         return s
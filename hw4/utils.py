@@ -8,49 +8,203 @@ from logger import logger
 ### Data ###
 ############
 
-class Dataset(object):
+class RunningStats(object):
+    """
+    Mean and variance of a stream of vectors
+
+    Batches are folded in with the parallel form of Welford's algorithm (Chan et al.), which is
+    numerically stable and lets statistics of disjoint data be merged without revisiting the data.
+    """
 
     def __init__(self):
-        self._states = []
-        self._actions = []
-        self._next_states = []
-        self._rewards = []
-        self._dones = []
+        self._count = 0
+        self._mean = None
+        self._m2 = None
+
+    @property
+    def count(self):
+        return self._count
+
+    @property
+    def mean(self):
+        # NaN without data, like np.mean of an empty list
+        return np.nan if self._count == 0 else self._mean
+
+    @property
+    def var(self):
+        return np.nan if self._count == 0 else self._m2 / self._count
+
+    @property
+    def std(self):
+        return np.sqrt(self.var)
+
+    def _combine(self, count, mean, m2):
+        if count == 0:
+            return
+        if self._count == 0:
+            self._count, self._mean, self._m2 = count, np.array(mean, dtype=np.float64), np.array(m2, dtype=np.float64)
+            return
+        total = self._count + count
+        delta = mean - self._mean
+        self._mean = self._mean + delta * (count / total)
+        self._m2 = self._m2 + m2 + np.square(delta) * (self._count * count / total)
+        self._count = total
+
+    def update(self, x):
+        """
+        Fold in a batch x with shape [batch_size, dim]
+        """
+        x = np.asarray(x)
+        if len(x) == 0:
+            return
+        mean = np.mean(x, axis=0)
+        self._combine(len(x), mean, np.sum(np.square(x - mean), axis=0))
+
+    def merge(self, other):
+        """
+        Fold in the statistics of other, a RunningStats over disjoint data
+        """
+        self._combine(other._count, other._mean, other._m2)
+
+    def copy(self):
+        stats = RunningStats()
+        stats.merge(self)
+        return stats
+
+
+class Dataset(object):
+    """
+    (s, a, s', r, done) transitions stored in preallocated arrays
+
+    The arrays grow by doubling their capacity, so adding a transition is amortized O(1), and the
+    properties states, actions, ... are views of the filled part that do not copy any data.
+    Normalization statistics are RunningStats that only fold in the transitions added since they
+    were last queried.
+    """
+
+    def __init__(self, capacity=1024):
+        self._capacity = capacity
+        self._size = 0
+        self._states = None
+        self._actions = None
+        self._next_states = None
+        self._rewards = None
+        self._dones = None
+        self._state_stats = RunningStats()
+        self._action_stats = RunningStats()
+        self._delta_state_stats = RunningStats()
+        self._num_summarized = 0
 
     @property
     def is_empty(self):
         return len(self) == 0
 
     def __len__(self):
-        return len(self._states)
+        return self._size
+
+    ###############
+    ### Storage ###
+    ###############
+
+    def _allocate(self, state_dim, action_dim):
+        self._states = np.empty((self._capacity, state_dim), dtype=np.float64)
+        self._actions = np.empty((self._capacity, action_dim), dtype=np.float64)
+        self._next_states = np.empty((self._capacity, state_dim), dtype=np.float64)
+        self._rewards = np.empty(self._capacity, dtype=np.float64)
+        self._dones = np.empty(self._capacity, dtype=np.bool_)
+
+    def _reserve(self, size):
+        """
+        Grow the arrays to hold at least size transitions
+        """
+        if size <= self._capacity:
+            return
+        capacity = self._capacity
+        while capacity < size:
+            capacity *= 2
+        for name in ('_states', '_actions', '_next_states', '_rewards', '_dones'):
+            old = getattr(self, name)
+            new = np.empty((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self._size] = old[:self._size]
+            setattr(self, name, new)
+        self._capacity = capacity
+
+    def _view(self, array):
+        return np.empty(0) if array is None else array[:self._size]
+
+    @property
+    def states(self):
+        return self._view(self._states)
+
+    @property
+    def actions(self):
+        return self._view(self._actions)
+
+    @property
+    def next_states(self):
+        return self._view(self._next_states)
+
+    @property
+    def rewards(self):
+        return self._view(self._rewards)
+
+    @property
+    def dones(self):
+        return self._view(self._dones)
 
     ##################
     ### Statistics ###
     ##################
 
+    def _update_stats(self):
+        """
+        Fold the transitions added since the last query into the running statistics
+        """
+        if self._num_summarized < self._size:
+            new = slice(self._num_summarized, self._size)
+            self._state_stats.update(self._states[new])
+            self._action_stats.update(self._actions[new])
+            self._delta_state_stats.update(self._next_states[new] - self._states[new])
+            self._num_summarized = self._size
+
+    @property
+    def state_stats(self):
+        self._update_stats()
+        return self._state_stats
+
+    @property
+    def action_stats(self):
+        self._update_stats()
+        return self._action_stats
+
+    @property
+    def delta_state_stats(self):
+        self._update_stats()
+        return self._delta_state_stats
+
     @property
     def state_mean(self):
-        return np.mean(self._states, axis=0)
+        return self.state_stats.mean
 
     @property
     def state_std(self):
-        return np.std(self._states, axis=0)
+        return self.state_stats.std
 
     @property
     def action_mean(self):
-        return np.mean(self._actions, axis=0)
+        return self.action_stats.mean
 
     @property
     def action_std(self):
-        return np.std(self._actions, axis=0)
+        return self.action_stats.std
 
     @property
     def delta_state_mean(self):
-        return np.mean(np.array(self._next_states) - np.array(self._states), axis=0)
+        return self.delta_state_stats.mean
 
     @property
     def delta_state_std(self):
-        return np.std(np.array(self._next_states) - np.array(self._states), axis=0)
+        return self.delta_state_stats.std
 
     ###################
     ### Adding data ###
@@ -60,33 +214,52 @@ class Dataset(object):
         """
         Add (s, a, r, s') to this dataset
         """
-        if not self.is_empty:
-            # ensure the state, action, next_state are of the same dimension
-            assert len(self._states[-1]) == len(np.ravel(state))
-            assert len(self._actions[-1]) == len(np.ravel(action))
-            assert len(self._next_states[-1]) == len(np.ravel(next_state))
-
-        self._states.append(np.ravel(state))
-        self._actions.append(np.ravel(action))
-        self._next_states.append(np.ravel(next_state))
-        self._rewards.append(reward)
-        self._dones.append(done)
+        state = np.ravel(state)
+        action = np.ravel(action)
+        next_state = np.ravel(next_state)
+        if self._states is None:
+            self._allocate(len(state), len(action))
+        # ensure the state, action, next_state are of the same dimension
+        assert self._states.shape[1] == len(state)
+        assert self._actions.shape[1] == len(action)
+        assert self._next_states.shape[1] == len(next_state)
+
+        self._reserve(self._size + 1)
+        i = self._size
+        self._states[i] = state
+        self._actions[i] = action
+        self._next_states[i] = next_state
+        self._rewards[i] = reward
+        self._dones[i] = done
+        self._size += 1
 
     def append(self, other_dataset):
         """
         Append other_dataset to this dataset
         """
-        if not self.is_empty and not other_dataset.is_empty:
-            # ensure the state, action, next_state are of the same dimension
-            assert len(self._states[-1]) == len(other_dataset._states[-1])
-            assert len(self._actions[-1]) == len(other_dataset._actions[-1])
-            assert len(self._next_states[-1]) == len(other_dataset._next_states[-1])
-
-        self._states += other_dataset._states
-        self._actions += other_dataset._actions
-        self._next_states += other_dataset._next_states
-        self._rewards += other_dataset._rewards
-        self._dones += other_dataset._dones
+        if other_dataset.is_empty:
+            return
+        if self._states is None:
+            self._allocate(other_dataset._states.shape[1], other_dataset._actions.shape[1])
+        # ensure the state, action, next_state are of the same dimension
+        assert self._states.shape[1] == other_dataset._states.shape[1]
+        assert self._actions.shape[1] == other_dataset._actions.shape[1]
+        assert self._next_states.shape[1] == other_dataset._next_states.shape[1]
+
+        start, end = self._size, self._size + len(other_dataset)
+        if self._num_summarized == start:
+            # merge the statistics of other_dataset instead of recomputing them over its data
+            self._state_stats.merge(other_dataset.state_stats)
+            self._action_stats.merge(other_dataset.action_stats)
+            self._delta_state_stats.merge(other_dataset.delta_state_stats)
+            self._num_summarized = end
+        self._reserve(end)
+        self._states[start:end] = other_dataset.states
+        self._actions[start:end] = other_dataset.actions
+        self._next_states[start:end] = other_dataset.next_states
+        self._rewards[start:end] = other_dataset.rewards
+        self._dones[start:end] = other_dataset.dones
+        self._size = end
 
     ############################
     ### Iterate through data ###
@@ -95,54 +268,67 @@ class Dataset(object):
     def rollout_iterator(self):
         """
         Iterate through all the rollouts in the dataset sequentially
-        """
-        end_indices = np.nonzero(self._dones)[0] + 1
 
-        states = np.asarray(self._states)
-        actions = np.asarray(self._actions)
-        next_states = np.asarray(self._next_states)
-        rewards = np.asarray(self._rewards)
-        dones = np.asarray(self._dones)
+        The yielded arrays are views into the dataset, do not modify them
+        """
+        end_indices = np.nonzero(self.dones)[0] + 1
 
         start_idx = 0
         for end_idx in end_indices:
-            indices = np.arange(start_idx, end_idx)
-            yield states[indices], actions[indices], next_states[indices], rewards[indices], dones[indices]
+            rollout = slice(start_idx, end_idx)
+            yield self.states[rollout], self.actions[rollout], self.next_states[rollout], \
+                self.rewards[rollout], self.dones[rollout]
             start_idx = end_idx
 
-    def random_iterator(self, batch_size):
+    def transition_indices(self):
         """
-        Iterate once through all (s, a, r, s') in batches in a random order
+        Indices of all (s, a, r, s') used for training, i.e. that do not end a rollout
         """
-        all_indices = np.nonzero(np.logical_not(self._dones))[0]
-        np.random.shuffle(all_indices)
+        return np.nonzero(np.logical_not(self.dones))[0]
 
-        states = np.asarray(self._states)
-        actions = np.asarray(self._actions)
-        next_states = np.asarray(self._next_states)
-        rewards = np.asarray(self._rewards)
-        dones = np.asarray(self._dones)
+    def random_index_iterator(self, batch_size, num_bootstraps=None, indices=None):
+        """
+        Iterate once through indices (by default self.transition_indices()) in batches in a random order
 
-        i = 0
-        while i < len(all_indices):
-            indices = all_indices[i:i+batch_size]
+        If num_bootstraps is given, every batch gets a leading dimension of size num_bootstraps,
+        where row b iterates through its own bootstrap resample (drawn with replacement) of the indices
+        """
+        all_indices = self.transition_indices() if indices is None else np.array(indices)
+        if num_bootstraps is None:
+            np.random.shuffle(all_indices)
+        else:
+            all_indices = all_indices[np.random.randint(len(all_indices),
+                                                        size=(num_bootstraps, len(all_indices)))]
 
-            yield states[indices], actions[indices], next_states[indices], rewards[indices], dones[indices]
+        i = 0
+        while i < all_indices.shape[-1]:
+            yield all_indices[..., i:i+batch_size]
 
             i += batch_size
 
+    def random_iterator(self, batch_size, num_bootstraps=None):
+        """
+        Iterate once through all (s, a, r, s') in batches in a random order
+
+        If num_bootstraps is given, every batch element gets a leading dimension of size num_bootstraps,
+        where row b iterates through its own bootstrap resample (drawn with replacement) of the dataset
+        """
+        for indices in self.random_index_iterator(batch_size, num_bootstraps=num_bootstraps):
+            yield self.states[indices], self.actions[indices], self.next_states[indices], \
+                self.rewards[indices], self.dones[indices]
+
     ###############
     ### Logging ###
     ###############
 
     def log(self):
-        end_idxs = np.nonzero(self._dones)[0] + 1
+        end_idxs = np.nonzero(self.dones)[0] + 1
 
         returns = []
 
         start_idx = 0
         for end_idx in end_idxs:
-            rewards = self._rewards[start_idx:end_idx]
+            rewards = self.rewards[start_idx:end_idx]
             returns.append(np.sum(rewards))
 
             start_idx = end_idx
@@ -171,6 +357,36 @@ def build_mlp(input_layer,
         layer = tf.layers.dense(layer, output_dim, activation=output_activation)
     return layer
 
+def build_ensemble_mlp(input_layer,
+                       output_dim,
+                       scope,
+                       ensemble_size,
+                       n_layers=1,
+                       hidden_dim=500,
+                       activation=tf.nn.relu,
+                       output_activation=None,
+                       reuse=False):
+    """
+    ensemble_size independent MLPs evaluated together as batched matmuls
+
+    input_layer has shape [ensemble_size, batch_size, input_dim], and member b is applied to input_layer[b]
+    """
+    layer = input_layer
+    dims = [input_layer.get_shape()[-1].value] + [hidden_dim] * n_layers + [output_dim]
+    with tf.variable_scope(scope, reuse=reuse):
+        for i, (in_dim, out_dim) in enumerate(zip(dims[:-1], dims[1:])):
+            # glorot uniform per member (tf.glorot_uniform_initializer would count the ensemble axis in the fans)
+            limit = np.sqrt(6. / (in_dim + out_dim))
+            kernel = tf.get_variable('kernel_{0}'.format(i), [ensemble_size, in_dim, out_dim],
+                                     initializer=tf.random_uniform_initializer(-limit, limit))
+            bias = tf.get_variable('bias_{0}'.format(i), [ensemble_size, 1, out_dim],
+                                   initializer=tf.zeros_initializer())
+            layer = tf.matmul(layer, kernel) + bias
+            act = activation if i < n_layers else output_activation
+            if act is not None:
+                layer = act(layer)
+    return layer
+
 def normalize(x, mean, std, eps=1e-8):
     return (x - mean) / (std + eps)
 
@@ -187,5 +403,12 @@ class RandomPolicy(object):
         self._action_space_low = env.action_space.low
         self._action_space_high = env.action_space.high
 
+    def reset(self):
+        pass
+
     def get_action(self, state):
         return np.random.uniform(self._action_space_low, self._action_space_high)
+
+    def get_actions(self, states):
+        return np.random.uniform(self._action_space_low, self._action_space_high,
+                                 size=(len(states), len(self._action_space_low)))
@@ -9,11 +9,17 @@ import tensorflow as tf
 import tensorflow_probability as tfp
 import gym
 import logz
+import functools
 import os
+import sys
 import time
 import inspect
 from multiprocessing import Process
 
+# modules shared between homeworks live in common/ at the repository root
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir, os.pardir))
+from common.parallel_sampler import ParallelSampler
+
 from exploration import ExemplarExploration, DiscreteExploration, RBFExploration
 from density_model import Exemplar, Histogram, RBF
 
@@ -46,6 +52,12 @@ def build_mlp(input_placeholder, output_size, scope, n_layers, size, activation=
         output_placeholder = tf.layers.dense(output_placeholder, output_size, activation=output_activation)
     return output_placeholder
 
+def make_env(env_name):
+    if env_name == 'PointMass-v0':
+        from pointmass import PointMass
+        return PointMass()
+    return gym.make(env_name)
+
 def pathlength(path):
     return len(path["reward"])
 
@@ -76,6 +88,7 @@ class Agent(object):
         self.animate = sample_trajectory_args['animate']
         self.max_path_length = sample_trajectory_args['max_path_length']
         self.min_timesteps_per_batch = sample_trajectory_args['min_timesteps_per_batch']
+        self.sampler = sample_trajectory_args['sampler']
 
         self.gamma = estimate_advantage_args['gamma']
         self.normalize_advantages = estimate_advantage_args['normalize_advantages']
@@ -250,6 +263,10 @@ class Agent(object):
         self.critic_update_op = tf.train.AdamOptimizer(self.learning_rate).minimize(self.critic_loss)
 
     def sample_trajectories(self, itr, env):
+        if self.sampler is not None:
+            animate_this_batch = (itr % 10 == 0) and self.animate
+            return self.sampler.sample(self.policy_fn, self.min_timesteps_per_batch,
+                                       render=animate_this_batch)
         # Collect paths until we have enough timesteps
         timesteps_this_batch = 0
         paths = []
@@ -262,6 +279,10 @@ class Agent(object):
                 break
         return paths, timesteps_this_batch
 
+    def policy_fn(self, ob_no):
+        """ Samples actions for a batch of observations, used by the parallel sampler """
+        return self.sess.run(self.sy_sampled_ac, feed_dict={self.sy_ob_no: ob_no})
+
     def sample_trajectory(self, env, animate_this_episode):
         ob = env.reset()
         obs, acs, rewards, next_obs, terminals = [], [], [], [], []
@@ -373,6 +394,7 @@ def train_AC(
         num_target_updates,
         num_grad_steps_per_target_update,
         animate, 
+        num_envs,
         logdir, 
         normalize_advantages,
         seed,
@@ -428,6 +450,12 @@ def train_AC(
     ob_dim = env.observation_space.shape[0]
     ac_dim = env.action_space.n if discrete else env.action_space.shape[0]
 
+    # Subprocess env workers are forked before any tensorflow session exists
+    sampler = None
+    if num_envs > 1:
+        sampler = ParallelSampler(functools.partial(make_env, env_name), num_envs, ob_dim, ac_dim,
+                                  discrete, max_path_length, seed)
+
     #========================================================================================#
     # Initialize Agent
     #========================================================================================#
@@ -446,6 +474,7 @@ def train_AC(
         'animate': animate,
         'max_path_length': max_path_length,
         'min_timesteps_per_batch': min_timesteps_per_batch,
+        'sampler': sampler,
     }
 
     estimate_advantage_args = {
@@ -593,12 +622,16 @@ def train_AC(
         logz.dump_tabular()
         logz.pickle_tf_vars()
 
+    if sampler is not None:
+        sampler.close()
+
 def main():
     import argparse
     parser = argparse.ArgumentParser()
     parser.add_argument('env_name', type=str)
     parser.add_argument('--exp_name', type=str, default='vac')
     parser.add_argument('--render', action='store_true')
+    parser.add_argument('--num_envs', '-ne', type=int, default=1)
     parser.add_argument('--discount', type=float, default=1.0)
     parser.add_argument('--n_iter', '-n', type=int, default=100)
     parser.add_argument('--batch_size', '-b', type=int, default=1000)
@@ -654,6 +687,7 @@ def main():
                 num_target_updates=args.num_target_updates,
                 num_grad_steps_per_target_update=args.num_grad_steps_per_target_update,
                 animate=args.render,
+                num_envs=args.num_envs,
                 logdir=os.path.join(logdir,'%d'%seed),
                 normalize_advantages=not(args.dont_normalize_advantages),
                 seed=seed,
@@ -1,15 +1,61 @@
 import numpy as np
 import tensorflow as tf
-from tensorflow.keras import layers
+from tensorflow.keras import activations, initializers, layers
 from tensorflow_probability import distributions
 from tensorflow.python import keras
 from tensorflow.python.keras.engine.network import Network
 
 
+class StackedDense(layers.Layer):
+    """Dense layer of `num_stacked` independent networks.
+
+    Maps inputs of shape [num_stacked, batch_size, input_dim] to
+    [num_stacked, batch_size, units] with one batched matmul. Every network
+    has its own kernel, initialized like a `layers.Dense` kernel.
+    """
+    def __init__(self, num_stacked, units, activation=None, **kwargs):
+        super(StackedDense, self).__init__(**kwargs)
+        self._num_stacked = num_stacked
+        self._units = units
+        self._activation = activations.get(activation)
+
+    def build(self, input_shape):
+        input_dim = int(input_shape[-1])
+        limit = np.sqrt(6. / (input_dim + self._units))
+        self.kernel = self.add_weight(
+            'kernel', shape=(self._num_stacked, input_dim, self._units),
+            initializer=initializers.RandomUniform(-limit, limit))
+        self.bias = self.add_weight(
+            'bias', shape=(self._num_stacked, 1, self._units),
+            initializer='zeros')
+        super(StackedDense, self).build(input_shape)
+
+    def call(self, inputs):
+        return self._activation(tf.matmul(inputs, self.kernel) + self.bias)
+
+    def compute_output_shape(self, input_shape):
+        return tf.TensorShape(input_shape)[:-1].concatenate([self._units])
+
+
+def dense(units, activation=None, num_stacked=None):
+    """A `layers.Dense`, or a `StackedDense` if num_stacked is given."""
+    if num_stacked is None:
+        return layers.Dense(units, activation=activation)
+    return StackedDense(num_stacked, units, activation=activation)
+
+
 class QFunction(Network):
-    def __init__(self, hidden_layer_sizes, **kwargs):
+    def __init__(self, hidden_layer_sizes, num_stacked=None, **kwargs):
+        """
+        Args:
+            num_stacked (`int`): If given, the network is a stack of
+                `num_stacked` independent networks taking inputs with an
+                extra leading dimension of that size. The same holds for the
+                other networks in this module.
+        """
         super(QFunction, self).__init__(**kwargs)
         self._hidden_layer_sizes = hidden_layer_sizes
+        self._num_stacked = num_stacked
 
     def build(self, input_shape):
         inputs = [
@@ -17,53 +63,64 @@ class QFunction(Network):
             layers.Input(batch_shape=input_shape[1], name='actions')
         ]
 
-        x = layers.Concatenate(axis=1)(inputs)
+        x = layers.Concatenate(axis=-1)(inputs)
         for hidden_units in self._hidden_layer_sizes:
-            x = layers.Dense(hidden_units, activation='relu')(x)
-        q_values = layers.Dense(1, activation=None)(x)
+            x = dense(hidden_units, 'relu', self._num_stacked)(x)
+        q_values = dense(1, None, self._num_stacked)(x)
 
         self._init_graph_network(inputs, q_values)
         super(QFunction, self).build(input_shape)
 
 
 class ValueFunction(Network):
-    def __init__(self, hidden_layer_sizes, **kwargs):
+    def __init__(self, hidden_layer_sizes, num_stacked=None, **kwargs):
         super(ValueFunction, self).__init__(**kwargs)
         self._hidden_layer_sizes = hidden_layer_sizes
+        self._num_stacked = num_stacked
 
     def build(self, input_shape):
         inputs = layers.Input(batch_shape=input_shape, name='observations')
 
         x = inputs
         for hidden_units in self._hidden_layer_sizes:
-            x = layers.Dense(hidden_units, activation='relu')(x)
-        values = layers.Dense(1, activation=None)(x)
+            x = dense(hidden_units, 'relu', self._num_stacked)(x)
+        values = dense(1, None, self._num_stacked)(x)
 
         self._init_graph_network(inputs, values)
         super(ValueFunction, self).build(input_shape)
 
 
 class GaussianPolicy(Network):
-    def __init__(self, action_dim, hidden_layer_sizes, reparameterize, **kwargs):
+    def __init__(self, action_dim, hidden_layer_sizes, reparameterize,
+                 num_stacked=None, numpy_inference=False, **kwargs):
+        """
+        Args:
+            numpy_inference (`bool`): Evaluate the policy in NumPy, on a copy
+                of the dense layer weights that is refreshed by
+                `update_numpy_weights`, instead of in a session call.
+        """
         super(GaussianPolicy, self).__init__(**kwargs)
         self._action_dim = action_dim
         self._f = None
         self._hidden_layer_sizes = hidden_layer_sizes
         self._reparameterize = reparameterize
+        self._num_stacked = num_stacked
+        self._numpy_inference = numpy_inference
+        self._numpy_weights = None
 
     def build(self, input_shape):
         inputs = layers.Input(batch_shape=input_shape, name='observations')
 
         x = inputs
         for hidden_units in self._hidden_layer_sizes:
-            x = layers.Dense(hidden_units, activation='relu')(x)
+            x = dense(hidden_units, 'relu', self._num_stacked)(x)
 
-        mean_and_log_std = layers.Dense(
-            self._action_dim * 2, activation=None)(x)
+        mean_and_log_std = dense(
+            self._action_dim * 2, None, self._num_stacked)(x)
 
         def create_distribution_layer(mean_and_log_std):
             mean, log_std = tf.split(
-                mean_and_log_std, num_or_size_splits=2, axis=1)
+                mean_and_log_std, num_or_size_splits=2, axis=-1)
             log_std = tf.clip_by_value(log_std, -20., 2.)
 
             distribution = distributions.MultivariateNormalDiag(
@@ -99,8 +156,49 @@ class GaussianPolicy(Network):
     def eval(self, observation):
         assert self.built and observation.ndim == 1
 
-        if self._f is None:
-            self._f = keras.backend.function(self.inputs, [self.outputs[0]])
+        return self.eval_batch(observation[None])[0]
+
+    def eval_batch(self, observations):
+        """Actions for a batch of observations. A stacked policy takes one
+        observation per network."""
+        assert self.built and observations.ndim == 2
+
+        if self._numpy_inference:
+            evaluate = self._numpy_eval
+        else:
+            if self._f is None:
+                self._f = keras.backend.function(self.inputs, [self.outputs[0]])
+            evaluate = lambda observations: self._f([observations])[0]
 
-        action, = self._f([observation[None]])
-        return action.flatten()
+        if self._num_stacked is not None:
+            assert len(observations) == self._num_stacked
+            return evaluate(observations[:, None])[:, 0]
+
+        return evaluate(observations)
+
+    def update_numpy_weights(self):
+        """Copy the current dense layer weights for NumPy inference."""
+        dense_layers = [
+            layer for layer in self.layers
+            if isinstance(layer, (layers.Dense, StackedDense))
+        ]
+        weights = keras.backend.batch_get_value(
+            [w for layer in dense_layers for w in (layer.kernel, layer.bias)])
+        self._numpy_weights = list(zip(weights[::2], weights[1::2]))
+
+    def _numpy_eval(self, observations):
+        """Sampled actions of the policy computed in NumPy: the MLP, a
+        Gaussian sample and tanh squashing."""
+        if self._numpy_weights is None:
+            self.update_numpy_weights()
+
+        x = observations.astype(np.float32)
+        for kernel, bias in self._numpy_weights[:-1]:
+            x = np.maximum(np.matmul(x, kernel) + bias, 0)
+        kernel, bias = self._numpy_weights[-1]
+        mean_and_log_std = np.matmul(x, kernel) + bias
+
+        mean, log_std = np.split(mean_and_log_std, 2, axis=-1)
+        log_std = np.clip(log_std, -20., 2.)
+        raw_actions = mean + np.exp(log_std) * np.random.randn(*mean.shape)
+        return np.tanh(raw_actions)
@@ -1,3 +1,6 @@
+from contextlib import contextmanager
+
+import numpy as np
 import tensorflow as tf
 import time
 
@@ -20,9 +23,26 @@ class SAC:
                  learning_rate=3e-3,
                  reparameterize=False,
                  tau=0.01,
+                 utd_ratio=1.0,
+                 steps_per_call=1,
+                 num_stacked=None,
                  **kwargs):
         """
         Args:
+            epoch_length (`int`): Number of environment steps per epoch.
+            utd_ratio (`float`): Update-to-data ratio, the number of
+                gradient steps per environment step.
+            steps_per_call (`int`): Number of gradient steps run by a single
+                session call. Gradient steps are then done in groups of
+                `steps_per_call`, on batches sampled together ahead of the
+                call by a tf.data pipeline.
+            num_stacked (`int`): If given, train `num_stacked` independent
+                agents at once. The networks are then stacked (see
+                `nn.QFunction`), the inputs and batches have an extra leading
+                dimension of this size, and the sampler takes one step per
+                agent. The losses should average over both leading
+                dimensions; they are scaled by `num_stacked`, so that every
+                agent gets the gradient of its own loss.
         """
 
         self._alpha = alpha
@@ -32,6 +52,9 @@ class SAC:
         self._learning_rate = learning_rate
         self._reparameterize = reparameterize
         self._tau = tau
+        self._utd_ratio = utd_ratio
+        self._steps_per_call = steps_per_call
+        self._num_stacked = num_stacked
 
         self._training_ops = []
 
@@ -40,6 +63,25 @@ class SAC:
 
         self._create_placeholders(env)
 
+        optimizer = tf.train.AdamOptimizer(
+            self._learning_rate, name='optimizer')
+        self._training_ops = self._create_training_ops(
+            optimizer, policy, q_function, q_function2, value_function,
+            target_value_function)
+        # a whole gradient step in one call: the target update waits for the
+        # training ops
+        with tf.control_dependencies(self._training_ops):
+            self._train_op = tf.group(*self._create_target_update(
+                source=value_function, target=target_value_function))
+        if self._steps_per_call > 1:
+            self._multi_step_train_op = self._create_multi_step_train_op(
+                env, optimizer, policy, q_function, q_function2,
+                value_function, target_value_function)
+
+        tf.get_default_session().run(tf.global_variables_initializer())
+
+    def _create_training_ops(self, optimizer, policy, q_function, q_function2,
+                             value_function, target_value_function):
         policy_loss = self._policy_loss_for(policy, q_function, q_function2, value_function)
         value_function_loss = self._value_function_loss_for(
             policy, q_function, q_function2, value_function)
@@ -49,8 +91,13 @@ class SAC:
             q_function2_loss = self._q_function_loss_for(q_function2,
                                                         target_value_function)
 
-        optimizer = tf.train.AdamOptimizer(
-            self._learning_rate, name='optimizer')
+        if self._num_stacked is not None:
+            policy_loss *= self._num_stacked
+            value_function_loss *= self._num_stacked
+            q_function_loss *= self._num_stacked
+            if q_function2 is not None:
+                q_function2_loss *= self._num_stacked
+
         policy_training_op = optimizer.minimize(
             loss=policy_loss, var_list=policy.trainable_variables)
         value_training_op = optimizer.minimize(
@@ -62,43 +109,134 @@ class SAC:
             q_function2_training_op = optimizer.minimize(
                 loss=q_function2_loss, var_list=q_function2.trainable_variables)
 
-        self._training_ops = [
+        training_ops = [
             policy_training_op, value_training_op, q_function_training_op
         ]
         if q_function2 is not None:
-            self._training_ops += [q_function2_training_op]
-        self._target_update_ops = self._create_target_update(
-            source=value_function, target=target_value_function)
+            training_ops += [q_function2_training_op]
+        return training_ops
 
-        tf.get_default_session().run(tf.global_variables_initializer())
+    @contextmanager
+    def _bind_inputs(self, observations, actions, next_observations, rewards,
+                     terminals):
+        """Temporarily replace the input placeholders, so that the loss
+        functions, which read their inputs from them, are built on other
+        tensors."""
+        placeholders = (self._observations_ph, self._actions_ph,
+                        self._next_observations_ph, self._rewards_ph,
+                        self._terminals_ph)
+        (self._observations_ph, self._actions_ph, self._next_observations_ph,
+         self._rewards_ph, self._terminals_ph) = (
+             observations, actions, next_observations, rewards, terminals)
+        try:
+            yield
+        finally:
+            (self._observations_ph, self._actions_ph,
+             self._next_observations_ph, self._rewards_ph,
+             self._terminals_ph) = placeholders
+
+    def _create_multi_step_train_op(self, env, optimizer, policy, q_function,
+                                    q_function2, value_function,
+                                    target_value_function):
+        """Create an op running one gradient step (with target update) for
+        each of the batches in the `_multi_step_*_ph` inputs, which have an
+        extra leading dimension, inside a `tf.while_loop`.
+
+        The inputs default to the next `steps_per_call` batches, sampled from
+        the sampler passed to `train` by a prefetching tf.data pipeline (as
+        in hw3's dqn), so the batches are staged on the graph side while the
+        previous call runs rather than fed with every call. They can still be
+        fed explicitly.
+
+        The keras networks use resource variables, so every iteration reads
+        the weights updated by the previous one. The optimizer slots were
+        created by the single-step training ops and are shared.
+        """
+        placeholders = (self._observations_ph, self._actions_ph,
+                        self._next_observations_ph, self._rewards_ph,
+                        self._terminals_ph)
+        shapes = [
+            tf.TensorShape([None] + placeholder.shape.as_list())
+            for placeholder in placeholders
+        ]
+
+        def generator():
+            while True:
+                batch = self._multi_step_batch(self._sampler,
+                                               self._steps_per_call)
+                yield tuple(batch[field_name] for field_name in (
+                    'observations', 'actions', 'next_observations', 'rewards',
+                    'terminals'))
+
+        dataset = tf.data.Dataset.from_generator(
+            generator,
+            output_types=(tf.float32, ) * len(placeholders),
+            output_shapes=tuple(shapes)).prefetch(1)
+        (observations, actions, next_observations, rewards,
+         terminals) = dataset.make_one_shot_iterator().get_next()
+
+        self._multi_step_observations_ph = tf.placeholder_with_default(
+            observations, shapes[0], name='multi_step_observation')
+        self._multi_step_actions_ph = tf.placeholder_with_default(
+            actions, shapes[1], name='multi_step_actions')
+        self._multi_step_next_observations_ph = tf.placeholder_with_default(
+            next_observations, shapes[2], name='multi_step_next_observation')
+        self._multi_step_rewards_ph = tf.placeholder_with_default(
+            rewards, shapes[3], name='multi_step_rewards')
+        self._multi_step_terminals_ph = tf.placeholder_with_default(
+            terminals, shapes[4], name='multi_step_terminals')
+
+        def train_step(step):
+            with self._bind_inputs(
+                    self._multi_step_observations_ph[step],
+                    self._multi_step_actions_ph[step],
+                    self._multi_step_next_observations_ph[step],
+                    self._multi_step_rewards_ph[step],
+                    self._multi_step_terminals_ph[step]):
+                training_ops = self._create_training_ops(
+                    optimizer, policy, q_function, q_function2,
+                    value_function, target_value_function)
+            with tf.control_dependencies(training_ops):
+                target_update_op = tf.group(*self._create_target_update(
+                    source=value_function, target=target_value_function))
+            with tf.control_dependencies([target_update_op]):
+                return step + 1
+
+        num_steps = tf.shape(self._multi_step_rewards_ph)[0]
+        return tf.while_loop(lambda step: step < num_steps, train_step,
+                             [tf.constant(0)])
 
     def _create_placeholders(self, env):
         observation_dim = env.observation_space.shape[0]
         action_dim = env.action_space.shape[0]
+        if self._num_stacked is None:
+            batch_shape = (None, )
+        else:
+            batch_shape = (self._num_stacked, None)
 
         self._observations_ph = tf.placeholder(
             tf.float32,
-            shape=(None, observation_dim),
+            shape=batch_shape + (observation_dim, ),
             name='observation',
         )
         self._next_observations_ph = tf.placeholder(
             tf.float32,
-            shape=(None, observation_dim),
+            shape=batch_shape + (observation_dim, ),
             name='next_observation',
         )
         self._actions_ph = tf.placeholder(
             tf.float32,
-            shape=(None, action_dim),
+            shape=batch_shape + (action_dim, ),
             name='actions',
         )
         self._rewards_ph = tf.placeholder(
             tf.float32,
-            shape=(None, ),
+            shape=batch_shape,
             name='rewards',
         )
         self._terminals_ph = tf.placeholder(
             tf.float32,
-            shape=(None, ),
+            shape=batch_shape,
             name='terminals',
         )
 
@@ -142,27 +280,70 @@ class SAC:
             pool (`PoolBase`): Sample pool to add samples to
         """
         self._start = time.time()
+        # read by the input pipeline of the multi-step train op
+        self._sampler = sampler
+        # gradient steps owed to the samples taken so far, carried across
+        # epochs so that fractional ratios average out
+        updates_due = 0.
         for epoch in range(n_epochs):
-            for t in range(self._epoch_length):
-                sampler.sample()
-
-                batch = sampler.random_batch(self._batch_size)
-                feed_dict = {
-                    self._observations_ph: batch['observations'],
-                    self._actions_ph: batch['actions'],
-                    self._next_observations_ph: batch['next_observations'],
-                    self._rewards_ph: batch['rewards'],
-                    self._terminals_ph: batch['terminals'],
-                }
-                tf.get_default_session().run(self._training_ops, feed_dict)
-                tf.get_default_session().run(self._target_update_ops)
+            self._samples_this_epoch = 0
+            self._updates_this_epoch = 0
+            while self._samples_this_epoch < self._epoch_length:
+                num_samples = sampler.sample()
+                if self._num_stacked is not None:
+                    # one step per agent
+                    num_samples //= self._num_stacked
+                self._samples_this_epoch += num_samples
+
+                updates_due += num_samples * self._utd_ratio
+                while updates_due >= self._steps_per_call:
+                    self._do_training(sampler, self._steps_per_call)
+                    updates_due -= self._steps_per_call
+                    self._updates_this_epoch += self._steps_per_call
 
             yield epoch
 
+    def _do_training(self, sampler, num_steps=1):
+        if num_steps > 1:
+            # the batches come from the input pipeline
+            assert num_steps == self._steps_per_call
+            tf.get_default_session().run(self._multi_step_train_op)
+            return
+
+        batch = sampler.random_batch(self._batch_size)
+        feed_dict = {
+            self._observations_ph: batch['observations'],
+            self._actions_ph: batch['actions'],
+            self._next_observations_ph: batch['next_observations'],
+            self._rewards_ph: batch['rewards'],
+            self._terminals_ph: batch['terminals'],
+        }
+        tf.get_default_session().run(self._train_op, feed_dict)
+
+    def _multi_step_batch(self, sampler, num_steps):
+        """Sample `num_steps` batches at once, with a leading step dimension."""
+        batch = sampler.random_batch(num_steps * self._batch_size)
+        if self._num_stacked is None:
+            return {
+                field_name: values.reshape(
+                    (num_steps, self._batch_size) +
+                    values.shape[1:]).astype(np.float32)
+                for field_name, values in batch.items()
+            }
+        # [num_stacked, num_steps * batch_size, ...] to
+        # [num_steps, num_stacked, batch_size, ...]
+        return {
+            field_name: values.reshape(
+                (self._num_stacked, num_steps, self._batch_size) +
+                values.shape[2:]).swapaxes(0, 1).astype(np.float32)
+            for field_name, values in batch.items()
+        }
+
     def get_statistics(self):
         statistics = {
             'Time': time.time() - self._start,
-            'TimestepsThisBatch': self._epoch_length,
+            'TimestepsThisBatch': self._samples_this_epoch,
+            'UpdatesThisBatch': self._updates_this_epoch,
         }
 
         return statistics
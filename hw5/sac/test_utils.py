@@ -0,0 +1,212 @@
+"""
+Unit tests for utils.py and logz.py
+"""
+
+import os
+
+import numpy as np
+import pytest
+
+import logz
+from utils import ReplayPool, SimpleReplayPool, SimpleSampler
+
+
+class TestSimpleReplayPool(object):
+    def _add_episodes(self, pool, num_episodes, episode_length):
+        """Add episodes of float64 observations, one sample per step as SimpleSampler does"""
+        rng = np.random.RandomState(0)
+        transitions = []
+        for _ in range(num_episodes):
+            observation = rng.randn(3)
+            for t in range(episode_length):
+                next_observation = rng.randn(3)
+                terminal = t == episode_length - 1
+                pool.add_sample(
+                    observations=observation,
+                    actions=rng.randn(2),
+                    next_observations=next_observation,
+                    rewards=1.,
+                    terminals=terminal)
+                transitions.append((observation, next_observation))
+                observation = next_observation
+        return transitions
+
+    def test_deduplicate_float64_observations(self):
+        num_episodes = 5
+        pool = SimpleReplayPool([3], [2], 1000, deduplicate_observations=True)
+
+        self._add_episodes(pool, num_episodes, episode_length=50)
+
+        # only the episode ends are left in the side table
+        assert pool.get_statistics()['SideTableSize'] <= num_episodes + 1
+
+    def test_deduplicated_next_observations(self):
+        pool = SimpleReplayPool([3], [2], 1000, deduplicate_observations=True)
+
+        transitions = self._add_episodes(pool, num_episodes=5, episode_length=50)
+
+        indices = np.arange(len(transitions))
+        expected = np.array([next_observation for _, next_observation in transitions],
+                            dtype=np.float32)
+        np.testing.assert_array_equal(pool.gather_field('next_observations', indices), expected)
+
+
+class TestReplayPool(object):
+    max_size = 10
+
+    def _pool(self):
+        return ReplayPool(self.max_size, {
+            'observations': {'shape': [3], 'dtype': 'float32'},
+            'terminals': {'shape': [], 'dtype': 'bool'},
+        })
+
+    def _add_blocks(self, pool, block_sizes, use_extend):
+        """Add blocks of consecutive samples, and the contents of a one-sample-at-a-time ring buffer"""
+        expected_observations = np.zeros([self.max_size, 3], dtype=np.float32)
+        expected_terminals = np.zeros(self.max_size, dtype=bool)
+        pointer = count = 0
+        for num_samples in block_sizes:
+            observations = np.arange(count, count + num_samples, dtype=np.float32)[:, None] * [1, 2, 3]
+            terminals = np.arange(count, count + num_samples) % 3 == 0
+            if use_extend:
+                pool.extend(observations=observations, terminals=terminals)
+            else:
+                pool.add_samples(num_samples, observations=observations, terminals=terminals)
+            for observation, terminal in zip(observations, terminals):
+                expected_observations[pointer] = observation
+                expected_terminals[pointer] = terminal
+                pointer = (pointer + 1) % self.max_size
+            count += num_samples
+        return expected_observations, expected_terminals, pointer
+
+    def _check_blocks(self, block_sizes, use_extend):
+        pool = self._pool()
+        expected_observations, expected_terminals, pointer = self._add_blocks(pool, block_sizes, use_extend)
+        np.testing.assert_array_equal(pool.observations, expected_observations)
+        np.testing.assert_array_equal(pool.terminals, expected_terminals)
+        assert pool._pointer == pointer
+        assert pool.size == min(sum(block_sizes), self.max_size)
+
+    def test_wraparound(self):
+        # the blocks of 4 end at 8, then 2 and 6 wrap around max_size
+        for use_extend in (False, True):
+            self._check_blocks([4, 4, 4, 4], use_extend)
+            self._check_blocks([7, 3, 5], use_extend)
+            self._check_blocks([1, 9, 1, 9, 1], use_extend)
+
+    def test_oversize_blocks(self):
+        # only the last max_size samples of a block larger than the pool are kept
+        for use_extend in (False, True):
+            self._check_blocks([25], use_extend)
+            self._check_blocks([3, 25], use_extend)
+            self._check_blocks([7, 10, 13, 2], use_extend)
+
+    def test_single_samples(self):
+        pool = self._pool()
+        for i in range(13):
+            pool.add_sample(observations=np.full(3, i), terminals=False)
+        expected = np.concatenate([np.arange(10, 13), np.arange(3, 10)])
+        np.testing.assert_array_equal(pool.observations[:, 0], expected)
+        assert pool._pointer == 3
+        assert pool.size == self.max_size
+
+
+class CountingEnv(object):
+    """Observations, actions and rewards all count the steps, so that a torn sample is easy to spot"""
+    class Space(object):
+        shape = (2, )
+
+    observation_space = Space()
+    action_space = Space()
+
+    def __init__(self):
+        self._count = 0.
+
+    def reset(self):
+        self._count += 1
+        return np.full(3, self._count)
+
+    def step(self, action):
+        self._count += 1
+        return np.full(3, self._count), self._count, self._count % 13 == 0, {}
+
+    def terminate(self):
+        pass
+
+
+class CountingPolicy(object):
+    def eval(self, observation):
+        return np.full(2, observation[0])
+
+
+class TestBatchPrefetcher(object):
+    def _num_torn_samples(self, deduplicate_observations):
+        pool = SimpleReplayPool([3], [2], 64, deduplicate_observations=deduplicate_observations)
+        sampler = SimpleSampler(max_episode_length=1000, prefill_steps=64, prefetch_batches=2)
+        sampler.initialize(CountingEnv(), None, pool)
+        sampler.set_policy(CountingPolicy())
+
+        num_torn = 0
+        for step in range(5000):
+            sampler.sample()
+            batch = sampler.random_batch(32)
+            # the uniformly random prefill samples are overwritten after max_size steps
+            if step > 100:
+                consistent = ((batch['actions'][:, 0] == batch['observations'][:, 0]) &
+                              (batch['next_observations'][:, 0] == batch['rewards']))
+                num_torn += np.sum(~consistent)
+        sampler.terminate()
+        return num_torn
+
+    def test_concurrent_writes(self):
+        # batches are gathered on another thread while the sampler keeps writing to the pool
+        assert self._num_torn_samples(deduplicate_observations=False) == 0
+
+    def test_concurrent_writes_deduplicated(self):
+        assert self._num_torn_samples(deduplicate_observations=True) == 0
+
+
+class TestMetrics(object):
+    def test_schema_evolution(self, tmpdir):
+        output_dir = str(tmpdir.join('run'))
+        writer = logz.create_writer(output_dir, chunk_rows=2)
+        rows = [{'Iteration': 0, 'AverageReturn': 1.5},
+                {'Iteration': 1, 'AverageReturn': 2.5},
+                {'Iteration': 2, 'AverageReturn': 3.5, 'Time': 10.},
+                {'Iteration': 3, 'AverageReturn': 4.5, 'Time': 20.},
+                {'Iteration': 4, 'AverageReturn': 5.5, 'Time': 30., 'Env': 'Pendulum'}]
+        for row in rows:
+            writer.write(row)
+        writer.close()
+
+        # the lines written before a new column appeared are padded
+        with open(os.path.join(output_dir, 'log.txt')) as f:
+            lines = [line.split('\t') for line in f.read().splitlines()]
+        assert lines[0] == ['Iteration', 'AverageReturn', 'Time', 'Env']
+        assert lines[1] == ['0', '1.5', '', '']
+        assert lines[3] == ['2', '3.5', '10.0', '']
+        assert lines[5] == ['4', '5.5', '30.0', 'Pendulum']
+        assert len(lines) == 6
+
+        # only the rows since the last chunk are kept in memory
+        assert writer.rows == []
+        assert sorted(os.listdir(os.path.join(output_dir, 'metrics'))) == [
+            'chunk_%i_%05d.npz' % (os.getpid(), i) for i in range(3)]
+        metrics = logz.load_metrics(output_dir)
+        np.testing.assert_array_equal(metrics['Iteration'], np.arange(5))
+        np.testing.assert_array_equal(metrics['AverageReturn'], np.arange(5) + 1.5)
+        np.testing.assert_array_equal(metrics['Time'], [np.nan, np.nan, 10., 20., 30.])
+        np.testing.assert_array_equal(metrics['Env'], ['', '', '', '', 'Pendulum'])
+
+    def test_existing_output_dir(self, tmpdir):
+        output_dir = str(tmpdir)
+        with pytest.raises(AssertionError):
+            logz.create_writer(output_dir)
+
+        writer = logz.create_writer(output_dir, exist_ok=True)
+        other_writer = logz.create_writer(output_dir, exist_ok=True)
+        # the second writer does not touch the log.txt of the first one
+        assert os.path.basename(writer.output_file.name) == 'log.txt'
+        assert os.path.basename(other_writer.output_file.name) == 'log_%i.txt' % os.getpid()
+        writer.close()
+        other_writer.close()
@@ -12,7 +12,21 @@ import utils
 
 from multiprocessing import Process
 
-def train_SAC(env_name, exp_name, seed, logdir):
+def train_SAC(env_name, exp_name, seed, logdir, num_envs=1, utd_ratio=1.0,
+              steps_per_call=1, prefetch_batches=0,
+              deduplicate_observations=False, num_stacked_seeds=1,
+              numpy_policy=False):
+    """
+    With num_stacked_seeds > 1, trains one agent for each of the seeds
+    seed, seed + 10, ... as stacked networks in a single graph, with one
+    environment per agent, logging to logdir/<seed>.
+    """
+    stacked = num_stacked_seeds > 1
+    if stacked:
+        assert num_envs == 1, 'stacked seeds use one environment per agent'
+        seeds = [seed + 10 * i for i in range(num_stacked_seeds)]
+    else:
+        seeds = [seed]
     alpha = {
         'Ant-v2': 0.1,
         'HalfCheetah-v2': 0.2,
@@ -31,13 +45,18 @@ def train_SAC(env_name, exp_name, seed, logdir):
         'epoch_length': 1000,
         'n_epochs': 500,
         'two_qf': False,
+        'utd_ratio': utd_ratio,
+        'steps_per_call': steps_per_call,
+        'num_stacked': num_stacked_seeds if stacked else None,
     }
     sampler_params = {
         'max_episode_length': 1000,
         'prefill_steps': 1000,
+        'prefetch_batches': prefetch_batches,
     }
     replay_pool_params = {
         'max_size': 1e6,
+        'deduplicate_observations': deduplicate_observations,
     }
 
     value_function_params = {
@@ -50,32 +69,65 @@ def train_SAC(env_name, exp_name, seed, logdir):
 
     policy_params = {
         'hidden_layer_sizes': (128, 128),
+        'numpy_inference': numpy_policy,
     }
 
-    logz.configure_output_dir(logdir)
+    for network_params in (value_function_params, q_function_params,
+                           policy_params):
+        network_params['num_stacked'] = algorithm_params['num_stacked']
+
+    if stacked:
+        writers = [logz.create_writer(os.path.join(logdir, '%d' % s))
+                   for s in seeds]
+    else:
+        logz.configure_output_dir(logdir)
     params = {
         'exp_name': exp_name,
         'env_name': env_name,
         'algorithm_params': algorithm_params,
         'sampler_params': sampler_params,
+        'num_envs': num_envs,
         'replay_pool_params': replay_pool_params,
         'value_function_params': value_function_params,
         'q_function_params': q_function_params,
         'policy_params': policy_params
     }
-    logz.save_params(params)
+    if stacked:
+        for s, writer in zip(seeds, writers):
+            logz.save_params(dict(params, seed=s), writer.output_dir)
+    else:
+        logz.save_params(params)
 
-    env = gym.envs.make(env_name)
+    envs = [gym.envs.make(env_name) for _ in range(max(num_envs, len(seeds)))]
+    env = envs[0]
     # Set random seeds
     tf.set_random_seed(seed)
     np.random.seed(seed)
-    env.seed(seed)
+    for i, e in enumerate(envs):
+        e.seed(seeds[i] if stacked else seed + i)
+
+    if stacked:
+        # prefill_steps steps for every agent
+        sampler = utils.VectorizedSampler(
+            num_envs=len(envs),
+            **dict(sampler_params,
+                   prefill_steps=sampler_params['prefill_steps'] * len(envs)))
+    elif num_envs > 1:
+        sampler = utils.VectorizedSampler(num_envs=num_envs, **sampler_params)
+    else:
+        sampler = utils.SimpleSampler(**sampler_params)
 
-    sampler = utils.SimpleSampler(**sampler_params)
-    replay_pool = utils.SimpleReplayPool(
-        observation_shape=env.observation_space.shape,
-        action_shape=env.action_space.shape,
-        **replay_pool_params)
+    def make_replay_pool():
+        return utils.SimpleReplayPool(
+            observation_shape=env.observation_space.shape,
+            action_shape=env.action_space.shape,
+            **replay_pool_params)
+
+    if stacked:
+        replay_pool = utils.StackedReplayPool(
+            [make_replay_pool() for _ in seeds])
+    else:
+        replay_pool = make_replay_pool()
 
     q_function = nn.QFunction(name='q_function', **q_function_params)
     if algorithm_params.get('two_qf', False):
@@ -91,7 +143,7 @@ def train_SAC(env_name, exp_name, seed, logdir):
         reparameterize=algorithm_params['reparameterize'],
         **policy_params)
 
-    sampler.initialize(env, policy, replay_pool)
+    sampler.initialize(envs if len(envs) > 1 else env, policy, replay_pool)
 
     algorithm = SAC(**algorithm_params)
 
@@ -107,6 +159,23 @@ def train_SAC(env_name, exp_name, seed, logdir):
             target_value_function=target_value_function)
 
         for epoch in algorithm.train(sampler, n_epochs=algorithm_params.get('n_epochs', 1000)):
+            if numpy_policy:
+                # the next epoch acts with the weights trained so far
+                policy.update_numpy_weights()
+
+            if stacked:
+                for i, writer in enumerate(writers):
+                    logz.log_tabular('Iteration', epoch)
+                    logz.log_tabular('Seed', seeds[i])
+                    for k, v in algorithm.get_statistics().items():
+                        logz.log_tabular(k, v)
+                    for k, v in replay_pool.pools[i].get_statistics().items():
+                        logz.log_tabular(k, v)
+                    for k, v in sampler.get_env_statistics(i).items():
+                        logz.log_tabular(k, v)
+                    logz.dump_tabular(writer)
+                continue
+
             logz.log_tabular('Iteration', epoch)
             for k, v in algorithm.get_statistics().items():
                 logz.log_tabular(k, v)
@@ -122,7 +191,16 @@ def main():
     parser.add_argument('--exp_name', type=str, default=None)
     parser.add_argument('--seed', type=int, default=1)
     parser.add_argument('--n_experiments', '-e', type=int, default=1)
+    parser.add_argument('--num_envs', type=int, default=1)
+    parser.add_argument('--utd_ratio', type=float, default=1.0)
+    parser.add_argument('--steps_per_call', type=int, default=1)
+    parser.add_argument('--prefetch_batches', type=int, default=0)
+    parser.add_argument('--deduplicate_observations', action='store_true')
+    parser.add_argument('--stacked_seeds', action='store_true')
+    parser.add_argument('--numpy_policy', action='store_true')
     args = parser.parse_args()
+    if args.stacked_seeds and args.n_experiments > 1 and args.num_envs > 1:
+        parser.error('--stacked_seeds uses one environment per seed, drop --num_envs')
 
     data_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'data')
 
@@ -131,6 +209,23 @@ def main():
     logdir = 'sac_' + args.env_name + '_' + args.exp_name + '_' + time.strftime("%d-%m-%Y_%H-%M-%S")
     logdir = os.path.join(data_path, logdir)
 
+    if args.stacked_seeds and args.n_experiments > 1:
+        # all seeds in this process, one stacked graph
+        train_SAC(
+            env_name=args.env_name,
+            exp_name=args.exp_name,
+            seed=args.seed,
+            logdir=logdir,
+            num_envs=args.num_envs,
+            utd_ratio=args.utd_ratio,
+            steps_per_call=args.steps_per_call,
+            prefetch_batches=args.prefetch_batches,
+            deduplicate_observations=args.deduplicate_observations,
+            num_stacked_seeds=args.n_experiments,
+            numpy_policy=args.numpy_policy,
+        )
+        return
+
     processes = []
 
     for e in range(args.n_experiments):
@@ -143,6 +238,12 @@ def main():
                 exp_name=args.exp_name,
                 seed=seed,
                 logdir=os.path.join(logdir, '%d' % seed),
+                num_envs=args.num_envs,
+                utd_ratio=args.utd_ratio,
+                steps_per_call=args.steps_per_call,
+                prefetch_batches=args.prefetch_batches,
+                deduplicate_observations=args.deduplicate_observations,
+                numpy_policy=args.numpy_policy,
             )
         # # Awkward hacky process runs, because Tensorflow does not like
         # # repeatedly calling train_AC in the same thread.
@@ -1,5 +1,7 @@
 import numpy as np
 import os
+import threading
+from queue import Queue
 import tensorflow as tf
 
 
@@ -52,7 +54,8 @@ class ReplayPool:
         for field_name, field_attrs in fields.items():
             field_shape = [self._max_size] + list(field_attrs['shape'])
             initializer = field_attrs.get('initializer', np.zeros)
-            setattr(self, field_name, initializer(field_shape))
+            setattr(self, field_name, initializer(
+                field_shape, dtype=field_attrs.get('dtype', np.float64)))
 
     def _advance(self, count=1):
         self._pointer = (self._pointer + count) % self._max_size
@@ -61,14 +64,52 @@ class ReplayPool:
     def add_sample(self, **kwargs):
         self.add_samples(1, **kwargs)
 
+    def _slices(self, num_samples):
+        """
+        (pool slice, sample slice) pairs covering the next num_samples
+        positions, two of them if the block wraps around.
+        """
+        end = self._pointer + num_samples
+        if end <= self._max_size:
+            return ((slice(self._pointer, end), slice(None)), )
+        split = self._max_size - self._pointer
+        return ((slice(self._pointer, None), slice(None, split)),
+                (slice(None, end - self._max_size), slice(split, None)))
+
     def add_samples(self, num_samples=1, **kwargs):
-        for field_name in self.field_names:
-            idx = np.arange(self._pointer,
-                            self._pointer + num_samples) % self._max_size
-            getattr(self, field_name)[idx] = kwargs.pop(field_name)
+        if num_samples > self._max_size:
+            # only the last max_size samples survive
+            kwargs = {
+                field_name: np.asarray(kwargs[field_name])[-self._max_size:]
+                for field_name in self.field_names
+            }
+            self._advance(num_samples - self._max_size)
+            num_samples = self._max_size
+
+        if num_samples == 1:
+            # a one-row slice takes samples with or without the batch dimension
+            pool_slice = slice(self._pointer, self._pointer + 1)
+            for field_name in self.field_names:
+                getattr(self, field_name)[pool_slice] = kwargs[field_name]
+        else:
+            slices = self._slices(num_samples)
+            for field_name in self.field_names:
+                array = getattr(self, field_name)
+                values = kwargs[field_name]
+                if len(slices) == 1:
+                    array[slices[0][0]] = values
+                else:
+                    values = np.asarray(values)
+                    for pool_slice, sample_slice in slices:
+                        array[pool_slice] = values[sample_slice]
 
         self._advance(num_samples)
 
+    def extend(self, **arrays):
+        """Add a block of samples given as arrays with a leading batch dimension."""
+        num_samples = len(arrays[self.field_names[0]])
+        self.add_samples(num_samples, **arrays)
+
     def random_indices(self, batch_size):
         if self._size == 0: return []
         return np.random.randint(0, self._size, batch_size)
@@ -77,8 +118,35 @@ class ReplayPool:
         random_indices = self.random_indices(batch_size)
         return self.batch_by_indices(random_indices, field_name_filter)
 
+    @property
+    def batch_field_names(self):
+        """Names of the fields of a batch."""
+        return self.field_names
+
+    def gather_field(self, field_name, indices, out=None):
+        """Gather the values of a field at indices, into out if given."""
+        array = getattr(self, field_name)
+        if out is None:
+            return array[indices]
+        if array.dtype == out.dtype:
+            np.take(array, indices, axis=0, out=out)
+        else:
+            out[...] = array[indices]
+        return out
+
+    def empty_batch(self, batch_size):
+        """Uninitialized batch arrays, float32 except for non-float fields."""
+        batch = {}
+        for field_name in self.batch_field_names:
+            field_attrs = self.fields[field_name]
+            dtype = np.dtype(field_attrs.get('dtype', np.float64))
+            dtype = np.float32 if dtype.kind == 'f' else dtype
+            batch[field_name] = np.empty(
+                [batch_size] + list(field_attrs['shape']), dtype=dtype)
+        return batch
+
     def batch_by_indices(self, indices, field_name_filter=None):
-        field_names = self.field_names
+        field_names = self.batch_field_names
         if field_name_filter is not None:
             field_names = [
                 field_name for field_name in field_names
@@ -86,7 +154,7 @@ class ReplayPool:
             ]
 
         return {
-            field_name: getattr(self, field_name)[indices]
+            field_name: self.gather_field(field_name, indices)
             for field_name in field_names
         }
 
@@ -97,9 +165,24 @@ class ReplayPool:
 
 
 class SimpleReplayPool(ReplayPool):
-    def __init__(self, observation_shape, action_shape, *args, **kwargs):
+    def __init__(self, observation_shape, action_shape, *args,
+                 deduplicate_observations=False, **kwargs):
+        """
+        Args:
+            deduplicate_observations (`bool`): Store every observation once.
+                The next observation of a sample is then the observation of
+                a later sample of the same episode, and only next
+                observations without such a sample (episode ends and the
+                latest samples) are kept in a side table. A sample is linked
+                to the sample at the same position of the following
+                `add_samples` call if that call has the same number of
+                samples and its observation equals the next observation, as
+                is the case for continuing episodes of `SimpleSampler` and
+                `VectorizedSampler`.
+        """
         self._observation_shape = observation_shape
         self._action_shape = action_shape
+        self._deduplicate_observations = deduplicate_observations
 
         fields = {
             'observations': {
@@ -128,13 +211,248 @@ class SimpleReplayPool(ReplayPool):
             },
         }
 
+        if not deduplicate_observations:
+            super(SimpleReplayPool, self).__init__(*args, fields=fields, **kwargs)
+            return
+
+        next_observations_field = fields.pop('next_observations')
         super(SimpleReplayPool, self).__init__(*args, fields=fields, **kwargs)
+        self.fields['next_observations'] = next_observations_field
+
+        # next observation of sample i: observations[(i + _next_offsets[i]) % max_size]
+        # if _next_slots[i] < 0, else _side_observations[_next_slots[i]]
+        self._next_slots = np.full(self._max_size, -1, dtype=np.int64)
+        self._next_offsets = np.zeros(self._max_size, dtype=np.int64)
+        self._side_observations = np.zeros(
+            [1024] + list(self._observation_shape), dtype=self.observations.dtype)
+        self._free_slots = list(range(len(self._side_observations)))[::-1]
+        # indices and side table slots of the samples of the last add_samples call
+        self._last_indices = None
+        self._last_slots = None
+
+    @property
+    def batch_field_names(self):
+        if not self._deduplicate_observations:
+            return self.field_names
+        return self.field_names + ['next_observations']
+
+    def _allocate_slots(self, count):
+        if len(self._free_slots) < count:
+            old_size = len(self._side_observations)
+            new_size = max(2 * old_size, old_size + count)
+            self._side_observations = np.concatenate([
+                self._side_observations,
+                np.zeros([new_size - old_size] + list(self._observation_shape),
+                         dtype=self._side_observations.dtype)])
+            self._free_slots = list(range(old_size, new_size))[::-1] + self._free_slots
+        return np.array([self._free_slots.pop() for _ in range(count)], dtype=np.int64)
+
+    def _free(self, slots):
+        self._free_slots.extend(slots[slots >= 0].tolist())
+
+    def add_samples(self, num_samples=1, **kwargs):
+        if not self._deduplicate_observations:
+            return super(SimpleReplayPool, self).add_samples(num_samples, **kwargs)
+
+        next_observations = kwargs.pop('next_observations')
+        indices = np.arange(self._pointer,
+                            self._pointer + num_samples) % self._max_size
+
+        # the overwritten samples release their side table entries
+        if self._size == self._max_size:
+            self._free(self._next_slots[indices])
+            self._next_slots[indices] = -1
+
+        # link the samples of the last call to the samples continuing them
+        if self._last_indices is not None and len(self._last_indices) == num_samples:
+            # compare as stored: env observations are often float64, while
+            # the side table holds them cast to the pool's dtype
+            observations = np.reshape(
+                np.asarray(kwargs['observations'],
+                           dtype=self.observations.dtype), (num_samples, -1))
+            last_next_observations = np.reshape(
+                self._side_observations[self._last_slots], (num_samples, -1))
+            linked = np.all(last_next_observations == observations, axis=1)
+            linked &= self._next_slots[self._last_indices] == self._last_slots
+            self._free(self._last_slots[linked])
+            self._next_slots[self._last_indices[linked]] = -1
+            self._next_offsets[self._last_indices[linked]] = (
+                indices[linked] - self._last_indices[linked]) % self._max_size
+
+        super(SimpleReplayPool, self).add_samples(num_samples, **kwargs)
+
+        slots = self._allocate_slots(num_samples)
+        self._side_observations[slots] = next_observations
+        self._next_slots[indices] = slots
+        self._last_indices = indices
+        self._last_slots = slots
+
+    def gather_field(self, field_name, indices, out=None):
+        if not (self._deduplicate_observations and field_name == 'next_observations'):
+            return super(SimpleReplayPool, self).gather_field(field_name, indices, out)
+
+        indices = np.asarray(indices)
+        if out is None:
+            out = np.empty((len(indices), ) + tuple(self._observation_shape),
+                           dtype=self.observations.dtype)
+        slots = self._next_slots[indices]
+        linked = slots < 0
+        linked_indices = indices[linked]
+        out[linked] = self.observations[
+            (linked_indices + self._next_offsets[linked_indices]) % self._max_size]
+        out[~linked] = self._side_observations[slots[~linked]]
+        return out
+
+    def get_statistics(self):
+        statistics = super(SimpleReplayPool, self).get_statistics()
+        if self._deduplicate_observations:
+            statistics['SideTableSize'] = (
+                len(self._side_observations) - len(self._free_slots))
+        return statistics
+
+
+class StackedReplayPool(object):
+    """One replay pool per agent of a stack of independent agents.
+
+    Sample i of every `add_samples` call goes to pool i, and batches are
+    stacked along a new leading dimension, i.e. fields have shape
+    [num_pools, batch_size, ...].
+    """
+    def __init__(self, pools):
+        self.pools = list(pools)
+
+    @property
+    def size(self):
+        return min(pool.size for pool in self.pools)
+
+    @property
+    def batch_field_names(self):
+        return self.pools[0].batch_field_names
+
+    def add_samples(self, num_samples, **kwargs):
+        assert num_samples == len(self.pools)
+        for i, pool in enumerate(self.pools):
+            pool.add_sample(**{
+                field_name: values[i] for field_name, values in kwargs.items()
+            })
+
+    def extend(self, **arrays):
+        self.add_samples(len(self.pools), **arrays)
+
+    def random_indices(self, batch_size):
+        return np.stack(
+            [pool.random_indices(batch_size) for pool in self.pools])
+
+    def gather_field(self, field_name, indices, out=None):
+        if out is None:
+            return np.stack([
+                pool.gather_field(field_name, pool_indices)
+                for pool, pool_indices in zip(self.pools, indices)
+            ])
+        for i, (pool, pool_indices) in enumerate(zip(self.pools, indices)):
+            pool.gather_field(field_name, pool_indices, out=out[i])
+        return out
+
+    def empty_batch(self, batch_size):
+        return {
+            field_name: np.empty((len(self.pools), ) + values.shape,
+                                 dtype=values.dtype)
+            for field_name, values in
+            self.pools[0].empty_batch(batch_size).items()
+        }
+
+    def random_batch(self, batch_size, field_name_filter=None):
+        batches = [
+            pool.random_batch(batch_size, field_name_filter)
+            for pool in self.pools
+        ]
+        return {
+            field_name: np.stack([batch[field_name] for batch in batches])
+            for field_name in batches[0]
+        }
+
+    def get_statistics(self):
+        return {
+            'PoolSize': self.size,
+        }
+
+
+class UniformPolicy:
+    def __init__(self, action_dim):
+        self._action_dim = action_dim
+
+    def eval(self, _):
+        return np.random.uniform(-1, 1, self._action_dim)
+
+    def eval_batch(self, observations):
+        return np.random.uniform(-1, 1, (len(observations), self._action_dim))
+
+
+class BatchPrefetcher(object):
+    """Samples random batches from a pool on a background thread.
+
+    Batches are gathered into preallocated buffers, float32 except for
+    non-float fields, so that the next `num_prefetch` batches are ready while
+    the current gradient step runs (which releases the GIL). A batch returned
+    by `random_batch` is only valid until the next call. Every batch is
+    sampled while holding `lock`, which whoever writes to the pool has to
+    hold as well.
+    """
+    def __init__(self, pool, batch_size, num_prefetch=2, lock=None):
+        self._pool = pool
+        self._batch_size = batch_size
+        self._lock = threading.Lock() if lock is None else lock
+
+        self._buffers = [
+            pool.empty_batch(batch_size) for _ in range(num_prefetch + 1)
+        ]
+
+        self._free = Queue()
+        self._full = Queue()
+        for i in range(num_prefetch):
+            self._free.put(i)
+        # the buffer returned by the last random_batch call
+        self._in_use = num_prefetch
+
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            i = self._free.get()
+            if i is None:
+                break
+            with self._lock:
+                indices = self._pool.random_indices(self._batch_size)
+                for field_name, buffer in self._buffers[i].items():
+                    self._pool.gather_field(field_name, indices, out=buffer)
+            self._full.put(i)
+
+    def random_batch(self):
+        self._free.put(self._in_use)
+        self._in_use = self._full.get()
+        return self._buffers[self._in_use]
+
+    def close(self):
+        self._free.put(None)
+        self._thread.join()
 
 
 class Sampler(object):
-    def __init__(self, max_episode_length, prefill_steps):
+    def __init__(self, max_episode_length, prefill_steps, prefetch_batches=0):
+        """
+        Args:
+            prefetch_batches (`int`): If positive, batches are sampled by a
+                `BatchPrefetcher` that keeps this many batches ready.
+        """
         self._max_episode_length = max_episode_length
         self._prefill_steps = prefill_steps
+        self._prefetch_batches = prefetch_batches
+        self._prefetchers = {}
+        # held while writing to the pool and while sampling from it, which
+        # may happen on other threads
+        self._pool_lock = threading.Lock()
 
         self.env = None
         self.policy = None
@@ -145,27 +463,34 @@ class Sampler(object):
         self.policy = policy
         self.pool = pool
 
-        class UniformPolicy:
-            def __init__(self, action_dim):
-                self._action_dim = action_dim
-
-            def eval(self, _):
-                return np.random.uniform(-1, 1, self._action_dim)
-
         uniform_exploration_policy = UniformPolicy(env.action_space.shape[0])
-        for _ in range(self._prefill_steps):
-            self.sample(uniform_exploration_policy)
+        num_samples = 0
+        while num_samples < self._prefill_steps:
+            num_samples += self.sample(uniform_exploration_policy)
 
     def set_policy(self, policy):
         self.policy = policy
 
-    def sample(self):
+    def sample(self, policy=None):
+        """Take environment steps with policy (default: self.policy) and
+        add them to the pool. Returns the number of steps taken."""
         raise NotImplementedError
 
     def random_batch(self, batch_size):
-        return self.pool.random_batch(batch_size)
+        if self._prefetch_batches <= 0:
+            with self._pool_lock:
+                return self.pool.random_batch(batch_size)
+
+        if batch_size not in self._prefetchers:
+            # started on first use, i.e. after the pool was prefilled
+            self._prefetchers[batch_size] = BatchPrefetcher(
+                self.pool, batch_size, self._prefetch_batches,
+                lock=self._pool_lock)
+        return self._prefetchers[batch_size].random_batch()
 
     def terminate(self):
+        for prefetcher in self._prefetchers.values():
+            prefetcher.close()
         self.env.terminate()
 
 
@@ -192,12 +517,13 @@ class SimpleSampler(Sampler):
         self._episode_return += reward
         self._total_samples += 1
 
-        self.pool.add_sample(
-            observations=self._current_observation,
-            actions=action,
-            rewards=reward,
-            terminals=terminal,
-            next_observations=next_observation)
+        with self._pool_lock:
+            self.pool.add_sample(
+                observations=self._current_observation,
+                actions=action,
+                rewards=reward,
+                terminals=terminal,
+                next_observations=next_observation)
 
         if terminal or self._episode_length >= self._max_episode_length:
             self._current_observation = self.env.reset()
@@ -212,6 +538,8 @@ class SimpleSampler(Sampler):
         else:
             self._current_observation = next_observation
 
+        return 1
+
     def get_statistics(self):
         statistics = {
             'MaxEpReturn': self._max_episode_return,
@@ -221,3 +549,106 @@ class SimpleSampler(Sampler):
         }
 
         return statistics
+
+
+class VectorizedSampler(Sampler):
+    """Steps several copies of the environment in lockstep.
+
+    Every call to `sample` evaluates the policy once on the batch of current
+    observations, steps each environment once and adds all transitions to
+    the pool with a single `add_samples` call.
+    """
+    def __init__(self, num_envs=1, **kwargs):
+        super(VectorizedSampler, self).__init__(**kwargs)
+
+        self._num_envs = num_envs
+        self.envs = None
+
+        self._episode_lengths = np.zeros(num_envs, dtype=np.int64)
+        self._episode_returns = np.zeros(num_envs)
+        self._last_episode_returns = np.full(num_envs, np.nan)
+        self._max_episode_returns = np.full(num_envs, -np.inf)
+        self._episode_counts = np.zeros(num_envs, dtype=np.int64)
+        self._last_episode_return = 0
+        self._max_episode_return = -np.inf
+        self._n_episodes = 0
+        self._current_observations = None
+        self._total_samples = 0
+
+    def initialize(self, env, policy, pool):
+        """`env` is a list of `num_envs` environments."""
+        assert len(env) == self._num_envs
+        self.envs = list(env)
+        super(VectorizedSampler, self).initialize(self.envs[0], policy, pool)
+
+    def sample(self, policy=None):
+        policy = self.policy if policy is None else policy
+        if self._current_observations is None:
+            self._current_observations = np.array([env.reset() for env in self.envs])
+
+        actions = policy.eval_batch(self._current_observations)
+        next_observations, rewards, terminals, _ = zip(*[
+            env.step(action) for env, action in zip(self.envs, actions)])
+        next_observations = np.array(next_observations)
+        rewards = np.array(rewards)
+        terminals = np.array(terminals)
+        self._episode_lengths += 1
+        self._episode_returns += rewards
+        self._total_samples += self._num_envs
+
+        with self._pool_lock:
+            self.pool.extend(
+                observations=self._current_observations,
+                actions=actions,
+                rewards=rewards,
+                terminals=terminals,
+                next_observations=next_observations)
+
+        dones = terminals | (self._episode_lengths >= self._max_episode_length)
+        for i in np.flatnonzero(dones):
+            next_observations[i] = self.envs[i].reset()
+            self._max_episode_return = max(self._max_episode_return,
+                                           self._episode_returns[i])
+            self._last_episode_return = self._episode_returns[i]
+            self._last_episode_returns[i] = self._episode_returns[i]
+            self._max_episode_returns[i] = max(self._max_episode_returns[i],
+                                               self._episode_returns[i])
+            self._episode_counts[i] += 1
+            self._n_episodes += 1
+        self._episode_lengths[dones] = 0
+        self._episode_returns[dones] = 0
+
+        self._current_observations = next_observations
+
+        return self._num_envs
+
+    def terminate(self):
+        for prefetcher in self._prefetchers.values():
+            prefetcher.close()
+        for env in self.envs:
+            env.terminate()
+
+    def get_statistics(self):
+        finished = ~np.isnan(self._last_episode_returns)
+        statistics = {
+            'MaxEpReturn': self._max_episode_return,
+            'LastEpReturn': self._last_episode_return,
+            'AverageLastEpReturn': (np.mean(self._last_episode_returns[finished])
+                                    if finished.any() else np.nan),
+            'Episodes': self._n_episodes,
+            'TimestepsSoFar': self._total_samples,
+        }
+
+        return statistics
+
+    def get_env_statistics(self, i):
+        """Statistics of environment i alone, as `SimpleSampler` reports them."""
+        last_episode_return = self._last_episode_returns[i]
+        statistics = {
+            'MaxEpReturn': self._max_episode_returns[i],
+            'LastEpReturn': 0 if np.isnan(last_episode_return) else last_episode_return,
+            'Episodes': self._episode_counts[i],
+            'TimestepsSoFar': self._total_samples // self._num_envs,
+        }
+
+        return statistics